@@ -0,0 +1,281 @@
+import logger
+import os
+import pickle
+import zlib
+import util
+
+LOGGER = logger.get_logger('EXCEL_CACHE')
+# bump it if the format of cached sheets changes
+CACHE_VERSION = 3
+CACHE_EXT = '.sheet'
+
+
+class CachedSheet:
+    """
+    sheet reader of a parsed sheet, offering the same apis as readers in excel_reader
+    data is stored by cols, from start row and start col, as stringified values
+    """
+    def __init__(self, name: str, header_row: int, start_row: int, start_col: int,
+                 headers: list, cols: [[str]], nrows: int):
+        self.name = name
+        self._header_row = header_row
+        self._start_row = start_row
+        self._start_col = start_col
+        self._headers = headers
+        self._cols = cols
+        self._nrows = nrows
+
+    @staticmethod
+    def from_sheet(sheet, header_row: int, start_row: int, start_col: int):
+        """
+        read the header row and data of all header cols from a sheet reader
+        :param sheet: sheet reader
+        :param header_row: header row
+        :param start_row: start row of data
+        :param start_col: start col of data
+        :return: cached sheet
+        """
+        headers = sheet.row_values(header_row, start_colx=start_col)
+        cols = [[] for _ in headers]
+        nrows = 0
+        for row in sheet.iter_rows(start_row, list(range(start_col, start_col + len(headers)))):
+            for j in range(len(row)):
+                cols[j].append(row[j])
+            nrows += 1
+        return CachedSheet(sheet.name, header_row, start_row, start_col, headers, cols, nrows)
+
+    def row_values(self, rowx: int, start_colx: int = 0) -> list:
+        """
+        get values of the header row
+        :param rowx: row idx, must be the header row
+        :param start_colx: start col idx, must be not less than start col
+        :return: cell values
+        """
+        if rowx != self._header_row or start_colx < self._start_col:
+            raise ValueError('Sheet %s: only header row %d from col %d is cached!'
+                             % (self.name, self._header_row, self._start_col))
+        return self._headers[start_colx - self._start_col:]
+
+    def iter_rows(self, start_rowx: int, colxs: [int]):
+        """
+        iterate rows from start row, only values of specific cols are read
+        :param start_rowx: start row idx, must be not less than start row
+        :param colxs: col indices
+        :return: generator of stringified cell values
+        """
+        if start_rowx < self._start_row:
+            raise ValueError('Sheet %s: only rows from %d are cached!' % (self.name, self._start_row))
+        cols = [self._cols[c - self._start_col] if 0 <= c - self._start_col < len(self._cols) else None
+                for c in colxs]
+        for i in range(start_rowx - self._start_row, self._nrows):
+            yield [col[i] if col is not None else '' for col in cols]
+
+
+class SheetCache:
+    """
+    on-disk cache of parsed sheets
+    sheets are keyed by content hash of the file, sheet name, reader and differ options,
+    least recently used sheets are evicted if the total size exceeds max size
+    """
+    def __init__(self, cache_dir: str = './tmp/excel_cache', max_size: int = 1 << 30):
+        """
+        :param cache_dir: cache directory
+        :param max_size: max total size of cache files in bytes
+        """
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        # running total size of cache files, scanned on first put and corrected on each eviction
+        self._total = None
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(file_hash: str, sheet_name: str, header_row: int, start_row: int, start_col: int,
+                reader: str = '') -> str:
+        """
+        get cache key of a sheet
+        :param file_hash: content hash of the file
+        :param sheet_name: sheet name
+        :param header_row: header row
+        :param start_row: start row of data
+        :param start_col: start col of data
+        :param reader: name of the reader parsing the file, see excel_reader.get_reader_name
+        :return: cache key
+        """
+        return util.md5('%s|%s|%d|%d|%d|%s' % (file_hash, sheet_name, header_row, start_row, start_col, reader))
+
+    @staticmethod
+    def get_names_key(file_hash: str, reader: str = '') -> str:
+        """
+        get cache key of sheet names of a file
+        :param file_hash: content hash of the file
+        :param reader: name of the reader parsing the file
+        :return: cache key
+        """
+        return util.md5('%s|%s' % (file_hash, reader))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key + CACHE_EXT)
+
+    def get(self, key: str):
+        """
+        get cached object
+        :param key: cache key
+        :return: cached sheet or sheet names, None if missed
+        """
+        p = self._path(key)
+        try:
+            with open(p, 'rb') as f:
+                version, obj = pickle.loads(zlib.decompress(f.read()))
+            if version != CACHE_VERSION:
+                return None
+            # refresh mtime for lru eviction
+            os.utime(p)
+            return obj
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            LOGGER.exception('Failed to load cache %s! %s' % (key, e))
+            return None
+
+    def put(self, key: str, obj) -> None:
+        """
+        put object into cache as compressed pickle, then evict lru objects if oversize
+        :param key: cache key
+        :param obj: cached sheet or sheet names
+        :return: None
+        """
+        p = self._path(key)
+        tmp = '%s.%d.tmp' % (p, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps((CACHE_VERSION, obj), protocol=pickle.HIGHEST_PROTOCOL)))
+            size = os.path.getsize(tmp)
+            try:
+                old_size = os.path.getsize(p)
+            except OSError:
+                old_size = 0
+            os.replace(tmp, p)
+        except Exception as e:
+            LOGGER.exception('Failed to cache %s! %s' % (key, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        if self._total is None:
+            self._evict()
+        else:
+            self._total += size - old_size
+            if self._total > self._max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        remove least recently used sheets until total size is not larger than max size
+        the directory is scanned, so that files put by other processes are counted as well
+        :return: None
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self._cache_dir):
+            if entry.is_file() and entry.name.endswith(CACHE_EXT):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        self._total = total
+        if total <= self._max_size:
+            return
+        entries.sort()
+        for _, size, p in entries:
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(p)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._total = total
+
+    def clear(self) -> None:
+        """
+        remove all cached sheets
+        :return: None
+        """
+        for entry in os.scandir(self._cache_dir):
+            if entry.is_file() and entry.name.endswith(CACHE_EXT):
+                os.remove(entry.path)
+        self._total = 0
+
+
+class CachedWorkbook:
+    """
+    workbook reader backed by sheet cache
+    the real workbook is opened only if sheet names or any sheet is not cached
+    """
+    def __init__(self, cache: SheetCache, file_hash: str, open_book: callable,
+                 header_row: int, start_row: int, start_col: int, reader: str = ''):
+        """
+        :param cache: sheet cache
+        :param file_hash: content hash of the file
+        :param open_book: function to open the real workbook reader
+        :param header_row: header row
+        :param start_row: start row of data
+        :param start_col: start col of data
+        :param reader: name of the reader opened by open_book, part of cache keys
+        """
+        self._cache = cache
+        self._file_hash = file_hash
+        self._open_book = open_book
+        self._header_row = header_row
+        self._start_row = start_row
+        self._start_col = start_col
+        self._reader = reader
+        self._book = None
+
+    def _get_book(self):
+        if self._book is None:
+            self._book = self._open_book()
+        return self._book
+
+    def _get_names(self):
+        """
+        get sheet names and signatures of sheets, cached together
+        :return: sheet names, sheet name -> signature
+        """
+        key = SheetCache.get_names_key(self._file_hash, self._reader)
+        names = self._cache.get(key)
+        if names is None:
+            book = self._get_book()
+            sheet_names = book.sheet_names()
+            names = (sheet_names, dict([(n, book.sheet_signature(n)) for n in sheet_names]))
+            self._cache.put(key, names)
+        return names
+
+    def sheet_names(self) -> [str]:
+        return self._get_names()[0]
+
+    def sheet_signature(self, name: str):
+        return self._get_names()[1].get(name)
+
+    def sheet(self, name: str) -> CachedSheet:
+        key = SheetCache.get_key(self._file_hash, name, self._header_row, self._start_row, self._start_col,
+                                 self._reader)
+        sheet = self._cache.get(key)
+        if sheet is None:
+            LOGGER.debug('Sheet cache missed: %s of %s' % (name, self._file_hash))
+            book = self._get_book()
+            sheet = CachedSheet.from_sheet(book.sheet(name), self._header_row, self._start_row, self._start_col)
+            if hasattr(book, 'unload_sheet'):
+                book.unload_sheet(name)
+            self._cache.put(key, sheet)
+        return sheet
+
+    def close(self):
+        if self._book is not None:
+            self._book.close()
+            self._book = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,402 @@
+import argparse
+import http.client
+import io
+import json
+import logger
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util import get_iter_diff, md5_file
+from lib.excel_differ import ExcelDiffer
+from lib.excel_report import ReportWriter, read_report
+from lib.excel_snapshot import WorkbookSnapshot
+
+LOGGER = logger.get_logger('EXCEL_DIFF_SERVICE')
+
+"""
+Local http service of excel diff, keeping warm worker processes and parsed workbooks in memory
+POST /diff with json body {"src": path, "dest": path}, paths are directories (as get_diff_report) or files,
+the report is sent back as newline-delimited json events (see excel_report), events of a file are
+buffered in the worker and written as soon as the file is diffed, in file order
+GET /status returns num of workers, running and queued jobs
+a job is rejected with 503 if the queue is full
+"""
+
+# differ and workbook cache of worker process, set by _init_worker
+_DIFFER = None
+_CACHE = None
+
+
+class WorkbookCache:
+    """
+    lru cache of parsed workbooks, keyed by path and validated by size and mtime
+    sheets of a cached workbook are parsed on first use, and indexes of them are memoized (see excel_snapshot),
+    values of other workbooks diffed with it are not kept in the cache
+    """
+    def __init__(self, differ: ExcelDiffer, max_size: int = 16):
+        """
+        :param differ: excel differ, whose options are used to parse sheets
+        :param max_size: max num of cached workbooks
+        """
+        self._differ = differ
+        self._max_size = max_size
+        # path -> (size, mtime in ns, snapshot)
+        self._snapshots = OrderedDict()
+
+    def get(self, path: str) -> WorkbookSnapshot:
+        """
+        get snapshot of a workbook, content hash is calculated once
+        :param path: file path
+        :return: workbook snapshot, close it after use to release the file
+        """
+        st = os.stat(path)
+        entry = self._snapshots.pop(path, None)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            LOGGER.debug('Workbook cache hit: %s' % path)
+            snapshot = entry[2]
+        else:
+            snapshot = self._differ.get_snapshot(path)
+            snapshot.file_hash = md5_file(path)
+        self._snapshots[path] = (st.st_size, st.st_mtime_ns, snapshot)
+        while len(self._snapshots) > self._max_size:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def __len__(self):
+        return len(self._snapshots)
+
+
+def _init_worker(differ: ExcelDiffer, cache_size: int) -> None:
+    """
+    initialize worker process
+    :param differ: excel differ
+    :param cache_size: max num of cached workbooks of the worker
+    :return: None
+    """
+    global _DIFFER, _CACHE
+    _DIFFER = differ
+    _CACHE = WorkbookCache(differ, cache_size)
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _diff_file_job(f1: str, f2: str, name: str):
+    """
+    diff a file pair with cached workbooks, run in worker process
+    :param f1: file path 1
+    :param f2: file path 2
+    :param name: file name in report
+    :return: file diff, error msg, events of modified cells and sheets, stats dict
+    """
+    fp = io.StringIO()
+    writer = ReportWriter(fp, file=name)
+    try:
+        d1, d2 = _CACHE.get(f1), _CACHE.get(f2)
+        try:
+            with _DIFFER.stats.scope(file=f1):
+                if d1.file_hash == d2.file_hash:
+                    _DIFFER.stats.count('skipped_files')
+                    ret = None
+                else:
+                    ret = _DIFFER.diff_workbooks(d1, d2, f1, f2, writer, d1.file_hash, d2.file_hash)
+        finally:
+            d1.close()
+            d2.close()
+        err = ''
+    except Exception as e:
+        err = 'Error while differing excel file %s and %s! %s' % (f1, f2, e)
+        LOGGER.exception(err)
+        ret = None
+    return ret, err, fp.getvalue(), _DIFFER.stats.collect()
+
+
+class ExcelDiffService:
+    """
+    diff service keeping a pool of warm worker processes
+    files of a job are diffed in parallel by workers, and streamed back in order
+    """
+    def __init__(self, differ: ExcelDiffer, host: str = '127.0.0.1', port: int = 8765, workers: int = 2,
+                 max_jobs: int = 2, max_queue: int = 8, cache_size: int = 16):
+        """
+        :param differ: excel differ, stats of workers are merged into its stats
+        :param host: host to listen on, local only by default
+        :param port: port to listen on, a free port is picked if 0
+        :param workers: num of worker processes
+        :param max_jobs: max num of jobs running at the same time
+        :param max_queue: max num of jobs waiting to run, more jobs are rejected
+        :param cache_size: max num of cached workbooks of each worker
+        """
+        self._differ = differ
+        self._workers = workers
+        self._max_jobs = max_jobs
+        self._max_queue = max_queue
+        self._cache_size = cache_size
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._executor = None
+        self._server = ThreadingHTTPServer((host, port), _DiffRequestHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def address(self) -> (str, int):
+        return self._server.server_address[:2]
+
+    def _start_pool(self) -> None:
+        """
+        start worker processes, and warm them up so that the first job does not pay for startup
+        :return: None
+        """
+        self._executor = ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker,
+                                             initargs=(self._differ, self._cache_size))
+        pids = set([f.result() for f in [self._executor.submit(_warm_up) for _ in range(self._workers)]])
+        LOGGER.info('Worker processes started: %s' % list(pids))
+
+    def start(self) -> None:
+        """
+        start workers and serve in a background thread
+        :return: None
+        """
+        self._start_pool()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        LOGGER.info('Excel diff service started at %s:%d' % self.address)
+
+    def serve_forever(self) -> None:
+        """
+        start workers and serve in current thread until stopped
+        :return: None
+        """
+        self._start_pool()
+        LOGGER.info('Excel diff service started at %s:%d' % self.address)
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self._workers,
+                'max_jobs': self._max_jobs,
+                'max_queue': self._max_queue,
+                'running': self._running,
+                'queued': self._queued,
+            }
+
+    def enqueue(self) -> bool:
+        """
+        wait for a job slot, only jobs waiting for a slot count in the queue
+        :return: False if the queue is full
+        """
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self._running += 1
+            return True
+        with self._lock:
+            if self._queued >= self._max_queue:
+                return False
+            self._queued += 1
+        self._slots.acquire()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._running -= 1
+        self._slots.release()
+
+    def _restart_pool(self, broken) -> None:
+        """
+        restart worker processes if a worker crashed, jobs on the broken pool fail
+        :param broken: the broken executor
+        :return: None
+        """
+        with self._lock:
+            if self._executor is not broken:
+                return
+            LOGGER.warning('Worker process crashed, restart workers')
+            self._executor = ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker,
+                                                 initargs=(self._differ, self._cache_size))
+        broken.shutdown(wait=False)
+
+    def run_job(self, src: str, dest: str, fp) -> dict:
+        """
+        diff src and dest, and write report events to fp file by file
+        :param src: src directory or file
+        :param dest: dest directory or file
+        :param fp: text file object to write
+        :return: report dict in which modified sheets only contain names
+        """
+        writer = ReportWriter(fp)
+        report = {
+            'added_files': [],
+            'removed_files': [],
+            'modified_files': [],
+            'errors': [],
+        }
+        if os.path.isfile(src) and os.path.isfile(dest):
+            pairs = [(os.path.basename(dest), src, dest)]
+        else:
+            rm, kp, ad = get_iter_diff(ExcelDiffer.get_excel_files(src), ExcelDiffer.get_excel_files(dest))
+            report['removed_files'] = rm
+            report['added_files'] = ad
+            pairs = [(kf, os.path.join(src, kf), os.path.join(dest, kf)) for kf in kp]
+        writer.write('report', added_files=report['added_files'], removed_files=report['removed_files'])
+        fp.flush()
+        with self._lock:
+            executor = self._executor
+        try:
+            futures = [executor.submit(_diff_file_job, f1, f2, kf) for kf, f1, f2 in pairs]
+        except BrokenProcessPool:
+            self._restart_pool(executor)
+            with self._lock:
+                executor = self._executor
+            futures = [executor.submit(_diff_file_job, f1, f2, kf) for kf, f1, f2 in pairs]
+        for i in range(len(pairs)):
+            kf, f1, f2 = pairs[i]
+            try:
+                ret, err, events, stats = futures[i].result()
+                self._differ.stats.merge(stats)
+                fp.write(events)
+            except BrokenProcessPool as e:
+                self._restart_pool(executor)
+                ret, err = None, 'Error while differing excel file %s and %s! %s' % (f1, f2, e)
+                LOGGER.error(err)
+            ExcelDiffer.add_file_diffs(report, [(kf, ret, err)], writer)
+            fp.flush()
+        return report
+
+
+class _DiffRequestHandler(BaseHTTPRequestHandler):
+    """
+    http request handler of diff service, the response of /diff is closed after the last event
+    """
+    def log_message(self, fmt, *args):
+        LOGGER.debug('%s - %s' % (self.address_string(), fmt % args))
+
+    def _send_json(self, code: int, obj) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._send_json(200, self.server.service.get_status())
+        else:
+            self._send_json(404, {'error': 'Not found: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/diff':
+            self._send_json(404, {'error': 'Not found: %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            src, dest = job['src'], job['dest']
+        except Exception as e:
+            self._send_json(400, {'error': 'Invalid diff job! %s' % e})
+            return
+        if not os.path.exists(src) or not os.path.exists(dest):
+            self._send_json(400, {'error': 'Path not existed: %s or %s' % (src, dest)})
+            return
+        service = self.server.service
+        if not service.enqueue():
+            self._send_json(503, {'error': 'Too many diff jobs, try later'})
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            fp = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+            try:
+                service.run_job(src, dest, fp)
+            except Exception as e:
+                LOGGER.exception('Error while running diff job %s! %s' % (job, e))
+            finally:
+                fp.detach()
+        finally:
+            service.release()
+
+
+class ExcelDiffClient:
+    """
+    client of diff service
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, timeout: float = None):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+
+    def iter_events(self, src: str, dest: str):
+        """
+        request a diff and iterate report events while they are streamed
+        :param src: src directory or file, on the host of service
+        :param dest: dest directory or file, on the host of service
+        :return: generator of event lines
+        """
+        conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+        try:
+            body = json.dumps({'src': src, 'dest': dest}).encode('utf-8')
+            conn.request('POST', '/diff', body, {'Content-Type': 'application/json'})
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise RuntimeError('Diff job failed with %d: %s' % (resp.status, resp.read().decode('utf-8')))
+            for line in resp:
+                yield line.decode('utf-8')
+        finally:
+            conn.close()
+
+    def diff(self, src: str, dest: str) -> dict:
+        """
+        request a diff and rebuild the nested report
+        :param src: src directory or file
+        :param dest: dest directory or file
+        :return: report dict, see ExcelDiffer.get_diff_report
+        """
+        return read_report(self.iter_events(src, dest))
+
+    def get_status(self) -> dict:
+        conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+        try:
+            conn.request('GET', '/status')
+            return json.loads(conn.getresponse().read().decode('utf-8'))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local excel diff service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-jobs', type=int, default=2)
+    parser.add_argument('--max-queue', type=int, default=8)
+    parser.add_argument('--cache-size', type=int, default=16)
+    args = parser.parse_args()
+    service = ExcelDiffService(ExcelDiffer(use_excel_indices=True), args.host, args.port, args.workers,
+                               args.max_jobs, args.max_queue, args.cache_size)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.stop()
@@ -1,11 +1,106 @@
 import logger
 import os
 import json
+import shutil
+import tempfile
+import time
 import xlrd
-from util import get_iter_diff, lis, ppt
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from util import get_iter_diff, lis, md5_bytes, md5_file
+from lib.excel_cache import CachedWorkbook, SheetCache
+# EXCEL_EXTENSIONS is kept importable from excel_differ
+from lib.excel_manifest import EXCEL_EXTENSIONS, ExcelManifest
+from lib.excel_reader import XlrdSheet, get_reader_name, open_workbook
+from lib.excel_report import ReportWriter
+from lib.excel_rows import LayeredValuePool, RowMatrix, ValuePool
+from lib.excel_snapshot import SheetSnapshot, WorkbookSnapshot
+from lib.excel_spill import RowSpiller
+from lib.excel_stats import DiffStats, NULL_STATS
 
-EXCEL_EXTENSIONS = ['xls', 'xlsx']
+try:
+    import numpy
+except ImportError:
+    # optional, cells are compared in pure python without it
+    numpy = None
+
+# num of row pairs compared in a numpy batch
+NUMPY_BATCH_ROWS = 4096
+# num of candidate dest rows verified in a numpy batch
+NUMPY_BATCH_CANDIDATES = 64
 LOGGER = logger.get_logger('EXCEL_DIFFER')
+# baseline snapshots of get_multi_diff_report, set once in each worker process
+_BASELINE = dict()
+
+
+def _init_baseline(baseline: dict) -> None:
+    """
+    initialize worker process of get_multi_diff_report
+    :param baseline: file name -> workbook snapshot
+    :return: None
+    """
+    global _BASELINE
+    _BASELINE = baseline
+
+
+class ModifiedCells:
+    """
+    collector of modified cells
+    indices of data rows and data cols are converted to report indices as soon as a cell is found,
+    cells are kept in a list, or written to a report writer without being kept if it is specified
+    """
+    def __init__(self, row_offset: int = 0, cols1: [int] = None, cols2: [int] = None, writer=None):
+        """
+        :param row_offset: offset added to data row indices
+        :param cols1: report col indices of src data cols, data col indices are used if None
+        :param cols2: report col indices of dest data cols, data col indices are used if None
+        :param writer: report writer (see excel_report)
+        """
+        self._row_offset = row_offset
+        self._cols1 = cols1
+        self._cols2 = cols2
+        self._writer = writer
+        self._rows1 = None
+        self._rows2 = None
+        self.cells = []
+        self.count = 0
+
+    def map_rows(self, rows1: [int], rows2: [int]) -> None:
+        """
+        map row indices of cells added later, e.g. rows of a matrix of some data rows
+        :param rows1: src data row idx of each src row
+        :param rows2: dest data row idx of each dest row
+        :return: None
+        """
+        self._rows1 = rows1
+        self._rows2 = rows2
+
+    def add(self, row1: int, row2: int, col: int, val1: str, val2: str) -> None:
+        """
+        add a modified cell
+        :param row1: src data row idx
+        :param row2: dest data row idx
+        :param col: data col idx
+        :param val1: src value
+        :param val2: dest value
+        :return: None
+        """
+        if self._rows1 is not None:
+            row1, row2 = self._rows1[row1], self._rows2[row2]
+        cell = {
+            'src_row': row1 + self._row_offset,
+            'dest_row': row2 + self._row_offset,
+            'src_col': self._cols1[col] if self._cols1 is not None else col,
+            'dest_col': self._cols2[col] if self._cols2 is not None else col,
+            'src_val': val1,
+            'dest_val': val2
+        }
+        self.count += 1
+        if self._writer is not None:
+            self._writer.write('cell', **cell)
+        else:
+            self.cells.append(cell)
 
 
 class ExcelDiffer:
@@ -20,73 +115,166 @@ class ExcelDiffer:
                  start_col: int = 0,
                  header_row: int = 0,
                  row_modify_threshold: float = 0.66,
-                 use_excel_indices: bool = False):
+                 use_excel_indices: bool = False,
+                 key_cols=None,
+                 readers: dict = None,
+                 cache: SheetCache = None,
+                 sheet_workers: int = 1,
+                 use_numpy: bool = True,
+                 memory_budget: int = 0,
+                 stats: DiffStats = None):
         """
         :param start_row: start row of data
         :param start_col: start col of data
         :param header_row: start row of header
         :param row_modify_threshold: the ratio threshold to judge if the dest row is modified from the src row
         :param use_excel_indices: whether +1 to all indices as excel shows (row 1, col 1) on left top
+        :param key_cols: header name or col idx (same base as report indices) of the unique key col,
+        or a list of them as composite key, rows are matched by key instead of content if specified
+        :param readers: extension -> workbook reader class, overriding READERS of excel_reader
+        :param cache: on-disk cache of parsed sheets, workbooks already parsed are not read again
+        :param sheet_workers: num of worker processes to diff sheets of a file with, each worker reads its own
+        sheet pair, diff sheets one by one if <= 1
+        :param use_numpy: compare cells of matched rows in vectorized batches if numpy is installed
+        :param memory_budget: memory in bytes for rows of a sheet, rows are spilled to disk and
+        diffed out of core if > 0 (see diff_data_external), keyed sheets are always diffed in memory
+        :param stats: collector of phase timings, counts and process peak memory (see excel_stats), disabled if None
         """
         self._start_row = start_row
         self._start_col = start_col
         self._header_row = header_row
         self._row_modify_threshold = row_modify_threshold
         self._use_excel_indices = use_excel_indices
+        if key_cols is not None and not isinstance(key_cols, (list, tuple)):
+            key_cols = [key_cols]
+        self._key_cols = list(key_cols) if key_cols else []
+        self._readers = readers
+        self._cache = cache
+        self._sheet_workers = sheet_workers
+        self._use_numpy = use_numpy and numpy is not None
+        self._memory_budget = memory_budget
+        self._stats = stats if stats is not None else NULL_STATS
 
-    @staticmethod
-    def _get_excel_files(r, d, fs: set):
+    @property
+    def stats(self) -> DiffStats:
         """
-        get excel files recursively
-        :param r: root
-        :param d: current dir
-        :param fs: excel files
-        :return: None
+        stats of differ, a null stats object if stats are disabled
         """
-        if not os.path.isdir(d) or not os.path.exists(d):
-            return
-        f_list = os.listdir(d)
-        for f in f_list:
-            if f.startswith('~$'):
-                continue
-            p = os.path.join(d, f)
-            if os.path.isfile(p):
-                _, f_ext = os.path.splitext(p)
-                if f_ext.replace('.', '') in EXCEL_EXTENSIONS:
-                    abs_p = p.replace(r, '', 1)
-                    if abs_p.startswith(os.path.sep):
-                        abs_p = abs_p.replace(os.path.sep, '', 1)
-                    fs.add(abs_p)
-            elif os.path.isdir(p):
-                ExcelDiffer._get_excel_files(r, p, fs)
+        return self._stats
+
+    @property
+    def key_cols(self) -> list:
+        """
+        key cols of rows, empty if rows are matched by content
+        """
+        return list(self._key_cols)
+
+    @property
+    def header_row(self) -> int:
+        return self._header_row
+
+    @property
+    def start_row(self) -> int:
+        return self._start_row
+
+    @property
+    def start_col(self) -> int:
+        return self._start_col
+
+    @property
+    def use_excel_indices(self) -> bool:
+        return self._use_excel_indices
+
+    @property
+    def readers(self) -> dict:
+        """
+        extension -> workbook reader class overriding READERS of excel_reader, None if not specified
+        """
+        return self._readers
+
+    @property
+    def cache(self):
+        """
+        on-disk sheet cache, None if disabled
+        """
+        return self._cache
 
     @staticmethod
-    def get_excel_files(directory: str) -> set:
+    def get_excel_files(directory: str, workers: int = 1) -> set:
         """
         get excel files recursively from a specific direcotry
         :param directory: directory
+        :param workers: num of threads to scan with, see ExcelManifest.scan
         :return: excel file list
         """
-        files = set()
-        ExcelDiffer._get_excel_files(directory, directory, files)
-        return files
+        return ExcelManifest.scan(directory, workers).files()
 
-    def diff_file(self, f1: str, f2: str):
+    def diff_file(self, f1: str, f2: str, writer=None, data1: bytes = None, data2: bytes = None):
         """
         get file diff
         :param f1: file path 1
         :param f2: file path 2
+        :param writer: report writer (see excel_report), modified sheets are written to it instead of kept
+        :param data1: content of file 1 in memory (e.g. a git blob), f1 is only used as name if specified
+        :param data2: content of file 2 in memory, f2 is only used as name if specified
         :return: file diff report dict
         """
         LOGGER.info('Get file diff --- src: %s, dest: %s' % (f1, f2))
+        with self._stats.scope(file=f1):
+            # skip identical files without parsing
+            h1, h2 = '', ''
+            size1 = len(data1) if data1 is not None else os.path.getsize(f1)
+            size2 = len(data2) if data2 is not None else os.path.getsize(f2)
+            if size1 == size2:
+                with self._stats.timer('hash_file'):
+                    h1 = md5_bytes(data1) if data1 is not None else md5_file(f1)
+                    h2 = md5_bytes(data2) if data2 is not None else md5_file(f2)
+                if h1 == h2:
+                    self._stats.count('skipped_files')
+                    return None
+            with self.open_workbook(f1, h1, data1) as d1, self.open_workbook(f2, h2, data2) as d2:
+                return self.diff_workbooks(d1, d2, f1, f2, writer, h1, h2, data1, data2)
+
+    def open_workbook(self, f: str, file_hash: str = '', data: bytes = None):
+        """
+        open workbook reader, backed by sheet cache if configured
+        :param f: file path
+        :param file_hash: content hash of the file, calculated if empty
+        :param data: file content in memory
+        :return: workbook reader
+        """
+        def open_book():
+            with self._stats.timer('open'):
+                return open_workbook(f, self._readers, data)
+        if self._cache is None:
+            return open_book()
+        if not file_hash:
+            file_hash = md5_bytes(data) if data is not None else md5_file(f)
+        return CachedWorkbook(self._cache, file_hash, open_book,
+                              self._header_row, self._start_row, self._start_col, get_reader_name(f, self._readers))
+
+    def diff_workbooks(self, d1, d2, f1: str, f2: str, writer=None, h1: str = '', h2: str = '',
+                       data1: bytes = None, data2: bytes = None):
+        """
+        get workbook diff, only sheets kept in both workbooks are read
+        workbooks are opened by caller, e.g. snapshots kept across diffs (see excel_snapshot)
+        :param d1: workbook reader 1
+        :param d2: workbook reader 2
+        :param f1: file path 1
+        :param f2: file path 2
+        :param writer: report writer, only names of modified sheets are kept if specified
+        :param h1: content hash of file 1
+        :param h2: content hash of file 2
+        :param data1: content of file 1 in memory
+        :param data2: content of file 2 in memory
+        :return: file diff report dict
+        """
         modified = False
         file_diff = {
             'added_sheets': [],
             'removed_sheets': [],
             'modified_sheets': [],
         }
-        d1 = xlrd.open_workbook(f1)
-        d2 = xlrd.open_workbook(f2)
         sheets1 = d1.sheet_names()
         sheets2 = d2.sheet_names()
         removed_sheets, kept_sheets, added_sheets = get_iter_diff(sheets1, sheets2)
@@ -96,28 +284,168 @@ class ExcelDiffer:
         if len(added_sheets) > 0:
             file_diff['added_sheets'] = added_sheets
             modified = True
+        sheet_names = []
         for sheet_name in kept_sheets:
-            sheet1 = d1.sheet_by_name(sheet_name)
-            sheet2 = d2.sheet_by_name(sheet_name)
-            LOGGER.info('Get sheet %s diff --- src: %s, dest: %s' % (sheet_name, f1, f2))
+            if ExcelDiffer._is_same_sheet(d1, d2, sheet_name):
+                self._stats.count('skipped_sheets')
+                LOGGER.info('Sheet %s did not change --- src: %s, dest: %s' % (sheet_name, f1, f2))
+            else:
+                sheet_names.append(sheet_name)
+        for sheet_name, sheet_diff in self._diff_sheets(d1, d2, f1, f2, sheet_names, writer, h1, h2,
+                                                          data1, data2):
+            if sheet_diff:
+                sheet_diff['name'] = sheet_name
+                modified = True
+                if writer is not None:
+                    sheet_diff['modified_data'].pop('modified_cells', None)
+                    writer.write('sheet', **sheet_diff)
+                    sheet_diff = {'name': sheet_name}
+                file_diff['modified_sheets'].append(sheet_diff)
+        return file_diff if modified else None
+
+    def _diff_sheets(self, d1, d2, f1: str, f2: str, sheet_names: [str], writer=None, h1: str = '', h2: str = '',
+                     data1: bytes = None, data2: bytes = None):
+        """
+        diff sheets of workbooks, in a process pool if sheet workers > 1
+        results are yielded in the same order as sheet names, errors are logged and yielded as None
+        each worker opens the files again and reads its own sheet pair,
+        and writes modified cells to a part file if writer is specified
+        :param d1: workbook reader 1
+        :param d2: workbook reader 2
+        :param f1: file path 1
+        :param f2: file path 2
+        :param sheet_names: names of sheets to diff
+        :param writer: report writer
+        :param h1: content hash of file 1
+        :param h2: content hash of file 2
+        :param data1: content of file 1 in memory
+        :param data2: content of file 2 in memory
+        :return: generator of (sheet name, sheet diff)
+        """
+        if self._sheet_workers <= 1 or len(sheet_names) <= 1:
+            for sheet_name in sheet_names:
+                LOGGER.info('Get sheet %s diff --- src: %s, dest: %s' % (sheet_name, f1, f2))
+                try:
+                    sheet_diff = self.diff_sheet(d1.sheet(sheet_name), d2.sheet(sheet_name), writer)
+                except Exception as e:
+                    LOGGER.exception('Error while differing sheet %s of %s and %s! %s'
+                                     % (sheet_name, f1, f2, e))
+                    sheet_diff = None
+                finally:
+                    ExcelDiffer.unload_sheet(d1, sheet_name)
+                    ExcelDiffer.unload_sheet(d2, sheet_name)
+                yield sheet_name, sheet_diff
+            return
+        part_dir = tempfile.mkdtemp(prefix='excel_diff_') if writer is not None else ''
+        try:
+            with ProcessPoolExecutor(max_workers=min(self._sheet_workers, len(sheet_names))) as executor:
+                parts = [os.path.join(part_dir, '%d.ndjson' % i) if part_dir else ''
+                         for i in range(len(sheet_names))]
+                futures = [executor.submit(self._run_with_stats, '_diff_sheet_of_files', f1, f2, h1, h2,
+                                           sheet_names[i], parts[i], writer.tags if writer is not None else None,
+                                           data1, data2)
+                           for i in range(len(sheet_names))]
+                for i in range(len(sheet_names)):
+                    sheet_name = sheet_names[i]
+                    LOGGER.info('Get sheet %s diff --- src: %s, dest: %s' % (sheet_name, f1, f2))
+                    try:
+                        sheet_diff, stats = futures[i].result()
+                        self._stats.merge(stats)
+                        if writer is not None:
+                            writer.write_part(parts[i])
+                        yield sheet_name, sheet_diff
+                    except Exception as e:
+                        LOGGER.exception('Error while differing sheet %s of %s and %s! %s'
+                                         % (sheet_name, f1, f2, e))
+                        yield sheet_name, None
+        finally:
+            if part_dir:
+                shutil.rmtree(part_dir, ignore_errors=True)
+
+    def _diff_sheet_of_files(self, f1: str, f2: str, h1: str, h2: str, sheet_name: str,
+                             part: str = '', tags: dict = None, data1: bytes = None, data2: bytes = None):
+        """
+        open files and diff a sheet of them, run in worker process
+        :param f1: file path 1
+        :param f2: file path 2
+        :param h1: content hash of file 1
+        :param h2: content hash of file 2
+        :param sheet_name: sheet name
+        :param part: path of part file to write modified cells, cells are kept if empty
+        :param tags: tags of report writer
+        :param data1: content of file 1 in memory
+        :param data2: content of file 2 in memory
+        :return: sheet diff
+        """
+        with self._stats.scope(file=f1), \
+                self.open_workbook(f1, h1, data1) as d1, self.open_workbook(f2, h2, data2) as d2:
+            s1, s2 = d1.sheet(sheet_name), d2.sheet(sheet_name)
+            if not part:
+                return self.diff_sheet(s1, s2)
+            with open(part, 'w', encoding='utf-8') as fp:
+                return self.diff_sheet(s1, s2, ReportWriter(fp, **(tags or {})))
+
+    def _run_with_stats(self, method: str, *args):
+        """
+        run a method in worker process, stats collected in the worker are sent back with the result
+        :param method: method name
+        :param args: args of method
+        :return: result, stats dict (None if stats are disabled)
+        """
+        return getattr(self, method)(*args), self._stats.collect()
+
+    @staticmethod
+    def unload_sheet(d, sheet_name: str) -> None:
+        """
+        release a sheet after diff if the workbook reader loads sheets on demand (e.g. legacy .xls)
+        :param d: workbook reader
+        :param sheet_name: sheet name
+        :return: None
+        """
+        if hasattr(d, 'unload_sheet'):
             try:
-                sheet_diff = self.diff_sheet(sheet1, sheet2)
-                if sheet_diff:
-                    sheet_diff['name'] = sheet_name
-                    modified = True
-                    file_diff['modified_sheets'].append(sheet_diff)
+                d.unload_sheet(sheet_name)
             except Exception as e:
-                LOGGER.exception('Error while differing sheet %s of %s and %s! %s'
-                                 % (sheet_name, f1, f2, e))
-        return file_diff if modified else None
+                LOGGER.warning('Failed to unload sheet %s! %s' % (sheet_name, e))
+
+    @staticmethod
+    def _is_same_sheet(d1, d2, sheet_name: str) -> bool:
+        """
+        check if sheet data is unchanged by signatures of workbook readers, without parsing the sheet
+        :param d1: workbook reader 1
+        :param d2: workbook reader 2
+        :param sheet_name: sheet name
+        :return: True if signatures are available and equal
+        """
+        if not hasattr(d1, 'sheet_signature') or not hasattr(d2, 'sheet_signature'):
+            return False
+        sig1 = d1.sheet_signature(sheet_name)
+        return sig1 is not None and sig1 == d2.sheet_signature(sheet_name)
 
-    def diff_sheet(self, s1: xlrd.sheet.Sheet, s2: xlrd.sheet.Sheet):
+    def diff_sheet(self, s1, s2, writer=None):
         """
         get sheet diff
-        :param s1: sheet 1
-        :param s2: sheet 2
+        :param s1: sheet reader 1 (see excel_reader), or xlrd sheet
+        :param s2: sheet reader 2 (see excel_reader), or xlrd sheet
+        :param writer: report writer, modified cells are written to it instead of kept
         :return: sheet diff of s1 and s2
         """
+        with self._stats.scope(sheet=s1.name):
+            return self._diff_sheet(s1, s2, writer)
+
+    def _diff_sheet(self, s1, s2, writer=None):
+        """
+        see diff_sheet
+        :param s1: sheet reader 1
+        :param s2: sheet reader 2
+        :param writer: report writer
+        :return: sheet diff
+        """
+        t = time.perf_counter()
+        if isinstance(s1, xlrd.sheet.Sheet):
+            s1 = XlrdSheet(s1)
+        if isinstance(s2, xlrd.sheet.Sheet):
+            s2 = XlrdSheet(s2)
         sheet_diff = {
             'added_cols': [],
             'removed_cols': [],
@@ -173,36 +501,80 @@ class ExcelDiffer:
                     cols1_cols2[col_idx1] = col_idx2
         indices1 = list(cols1_header.keys())
         indices1.sort()
-        d1, d2 = [], []
-        if self._start_row > s1.nrows:
-            LOGGER.warn('Sheet %s: start row %d is larger than num rows %d!' %
-                        (s1.name, self._start_row, s1.nrows))
-        else:
-            for i in range(self._start_row, s1.nrows):
-                d1.append([str(s1.cell_value(i, c)) for c in indices1])
-        if self._start_row > s2.nrows:
-            LOGGER.warn('Sheet %s: start row %d is larger then num rows %d!' %
-                        (s2.name, self._start_row, s2.nrows))
+        self._stats.add_seconds('header', time.perf_counter() - t)
+        self._stats.count('cols', len(indices1))
+        # diff data, modified cells are collected in report indices
+        offset = 1 if self._use_excel_indices else 0
+        cells = ModifiedCells(row_offset=self._start_row + offset,
+                              cols1=[c + self._start_col + offset for c in indices1],
+                              cols2=[cols1_cols2[c] + self._start_col + offset for c in indices1],
+                              writer=writer.scope(sheet=s1.name) if writer is not None else None)
+        key_indices = self._get_key_indices(headers1, indices1, s1.name)
+        # read data of mapped cols only
+        rows1 = s1.iter_rows(self._start_row, [c + self._start_col for c in indices1])
+        rows2 = s2.iter_rows(self._start_row, [cols1_cols2[c] + self._start_col for c in indices1])
+        if self._memory_budget > 0 and not key_indices and len(indices1) > 0:
+            data_diff, nrows1, nrows2 = self._diff_data_external(rows1, rows2, len(indices1), cells)
         else:
-            for i in range(self._start_row, s2.nrows):
-                d2.append([str(s2.cell_value(i, cols1_cols2[c])) for c in indices1])
-        # diff data
-        data_diff = self.diff_data(d1, d2)
+            # into compact matrices sharing one value pool
+            with self._stats.timer('read'):
+                if isinstance(s1, SheetSnapshot):
+                    # memoized src data of baseline, with row indexes memoized on it,
+                    # values of dest are kept in a pool of this diff, so the baseline pool does not grow
+                    d1 = s1.matrix(self._start_row, [c + self._start_col for c in indices1])
+                    pool = LayeredValuePool(d1.pool)
+                else:
+                    pool = ValuePool()
+                    d1 = RowMatrix.from_rows(pool, rows1, len(indices1))
+                d2 = RowMatrix.from_rows(pool, rows2, len(indices1))
+            nrows1, nrows2 = len(d1), len(d2)
+            if key_indices:
+                data_diff = self.diff_keyed_data(d1, d2, key_indices, cells)
+            else:
+                data_diff = self.diff_data(d1, d2, cells)
+        if nrows1 == 0:
+            LOGGER.warning('Sheet %s: no src data from start row %d!' % (s1.name, self._start_row))
+        if nrows2 == 0:
+            LOGGER.warning('Sheet %s: no dest data from start row %d!' % (s2.name, self._start_row))
+        self._stats.count('src_rows', nrows1)
+        self._stats.count('dest_rows', nrows2)
         if data_diff:
             modified = True
-            data_diff['modified_cells'] = [
-                dict(d, **{
-                    'src_col': indices1[d['src_col']] + self._start_col,
-                    'dest_col': cols1_cols2[indices1[d['dest_col']]] + self._start_col,
-                })
-                for d in data_diff['modified_cells']
-            ]
             sheet_diff['modified_data'] = data_diff
-        # +1 to all indices if using excel
+            if self._stats.enabled:
+                for k in ['moved_rows', 'duplicated_src_rows', 'duplicated_dest_rows', 'added_rows', 'removed_rows']:
+                    self._stats.count(k, len(data_diff[k]))
+                self._stats.count('modified_cells', cells.count)
+        # +1 to all indices if using excel, except modified cells that have been converted
         if modified and self._use_excel_indices:
+            modified_cells = sheet_diff['modified_data'].pop('modified_cells', None)
             sheet_diff = ExcelDiffer._convert_idx_of_sheet_diff(sheet_diff)
+            if modified_cells is not None:
+                sheet_diff['modified_data']['modified_cells'] = modified_cells
         return sheet_diff if modified else None
 
+    def _get_key_indices(self, headers: [str], indices: [int], sheet_name: str):
+        """
+        resolve key cols to indices of data cols
+        :param headers: headers of src sheet
+        :param indices: src col indices (from start col) of data cols
+        :param sheet_name: sheet name
+        :return: indices of key cols in data rows, empty if not keyed or any key col is not kept
+        """
+        key_indices = []
+        for k in self._key_cols:
+            if isinstance(k, int):
+                col = k - self._start_col - (1 if self._use_excel_indices else 0)
+            else:
+                cols = [c for c in indices if headers[c] == k]
+                col = cols[0] if len(cols) > 0 else -1
+            if col not in indices:
+                LOGGER.warning('Sheet %s: key col %s is not kept, fallback to diff by row content!'
+                               % (sheet_name, k))
+                return []
+            key_indices.append(indices.index(col))
+        return key_indices
+
     @staticmethod
     def _convert_idx_of_sheet_diff(sheet_diff: dict):
         """
@@ -245,38 +617,51 @@ class ExcelDiffer:
                 ]
         return sd
 
-    def diff_data(self, d1: [[str]], d2: [[str]]):
+    @staticmethod
+    def _to_matrices(d1, d2) -> (RowMatrix, RowMatrix):
+        """
+        convert data to row matrices sharing one value pool
+        :param d1: data 1, row matrix or list of rows
+        :param d2: data 2, row matrix or list of rows
+        :return: row matrix 1, row matrix 2
+        """
+        if isinstance(d1, RowMatrix) and isinstance(d2, RowMatrix) and d1.pool is d2.pool:
+            return d1, d2
+        ncols = len(d1[0]) if len(d1) > 0 else (len(d2[0]) if len(d2) > 0 else 0)
+        pool = ValuePool()
+        return RowMatrix.from_rows(pool, (d1[i] for i in range(len(d1))), ncols), \
+            RowMatrix.from_rows(pool, (d2[i] for i in range(len(d2))), ncols)
+
+    def diff_data(self, d1, d2, cells: ModifiedCells = None):
         """
         generate data diff
-        :param d1: data 1
-        :param d2: data 2
+        rows are identified by 128-bit fingerprints of their value ids
+        :param d1: data 1, row matrix or list of rows
+        :param d2: data 2, row matrix or list of rows
+        :param cells: collector of modified cells, cells are in data col indices if None
         :return: data diff
         """
+        if cells is None:
+            cells = ModifiedCells(row_offset=self._start_row)
+        d1, d2 = ExcelDiffer._to_matrices(d1, d2)
         data_diff = {
             'moved_rows': dict(),
             'duplicated_src_rows': dict(),
             'duplicated_dest_rows': dict()
         }
         # get rows both have, remove duplicates
-        row_hashes1, row_hashes2 = dict(), dict()
+        t = time.perf_counter()
+        row_hashes2 = dict()
         kept_rows = dict()
-        empty_rows1, empty_rows2 = set(), set()
-        for i in range(len(d1)):
-            # check cell of first column to judge if the row is valid
-            if len(d1[i][0]) == 0:
-                empty_rows1.add(i)
-                continue
-            row_hash1 = '|||'.join(d1[i])
-            if row_hash1 in row_hashes1.keys():
-                data_diff['duplicated_src_rows'][i + self._start_row] = \
-                    row_hashes1[row_hash1] + self._start_row
-            else:
-                row_hashes1[row_hash1] = i
+        empty_rows2 = set()
+        row_hashes1, duplicated_rows1, empty_rows1 = ExcelDiffer._get_row_hashes(d1)
+        for i, first in duplicated_rows1.items():
+            data_diff['duplicated_src_rows'][i + self._start_row] = first + self._start_row
         for i in range(len(d2)):
-            if len(d2[i][0]) == 0:
+            if d2.id_at(i, 0) == 0:
                 empty_rows2.add(i)
                 continue
-            row_hash2 = '|||'.join(d2[i])
+            row_hash2 = d2.fingerprint(i)
             if row_hash2 in row_hashes2.keys():
                 data_diff['duplicated_dest_rows'][i + self._start_row] = \
                     row_hashes2[row_hash2] + self._start_row
@@ -284,6 +669,7 @@ class ExcelDiffer:
                 row_hashes2[row_hash2] = i
                 if row_hash2 in row_hashes1.keys():
                     kept_rows[row_hashes1[row_hash2]] = i
+        self._stats.add_seconds('hash', time.perf_counter() - t)
         # get valid rows
         left_rows1 = list(set(range(len(d1))).difference(empty_rows1))
         left_rows1.sort()
@@ -295,7 +681,8 @@ class ExcelDiffer:
             kept_indices1.sort()
             kept_indices2 = [kept_rows[idx] for idx in kept_indices1]
             # get LIS of kept indices 2
-            lis_indices2 = lis(kept_indices2)
+            with self._stats.timer('lis'):
+                lis_indices2 = lis(kept_indices2)
             if len(lis_indices2) == len(kept_indices2) and len(lis_indices2) == len(d2):
                 return None  # no change
             lis_indices1 = list()
@@ -317,80 +704,486 @@ class ExcelDiffer:
                               .difference(kept_rows.values())
                               .difference(set([idx - self._start_row for idx in data_diff['duplicated_dest_rows'].keys()])))
             left_rows2.sort()
-        rd1 = [d1[i] for i in left_rows1]
-        rd2 = [d2[i] for i in left_rows2]
-        # ppt(rd1)
-        # ppt(left_rows1)
-        # ppt(rd2)
-        # ppt(left_rows2)
-        diff = self._diff_modified_data(rd1, rd2, left_rows1, left_rows2)
-        # ppt(diff)
-        data_diff['modified_cells'] = [
-            dict(d, **{
-                'src_row': d['src_row'] + self._start_row,
-                'dest_row': d['dest_row'] + self._start_row,
-            })
-            for d in diff['modified_cells']
-        ]
+        diff = self._diff_modified_data(d1, d2, left_rows1, left_rows2, cells)
+        data_diff['modified_cells'] = cells.cells
         data_diff['removed_rows'] = [self._start_row + i for i in diff['removed_rows']]
         data_diff['added_rows'] = [self._start_row + i for i in diff['added_rows']]
         if len(data_diff['moved_rows'].keys()) > 0 or \
                 len(data_diff['added_rows']) > 0 or \
                 len(data_diff['removed_rows']) > 0 or \
-                len(data_diff['modified_cells']) > 0:
+                cells.count > 0:
             return data_diff
 
-    def _diff_modified_data(self, d1, d2, rows1, rows2):
+    @staticmethod
+    def _get_row_hashes(d: RowMatrix):
+        """
+        get fingerprints of valid rows, memoized on the matrix
+        :param d: row matrix
+        :return: fingerprint -> first row idx, duplicated row idx -> first row idx, indices of empty rows
+        """
+        memo = d.memo.get('row_hashes')
+        if memo is not None:
+            return memo
+        row_hashes, duplicated_rows, empty_rows = dict(), dict(), set()
+        for i in range(len(d)):
+            # check cell of first column to judge if the row is valid
+            if d.id_at(i, 0) == 0:
+                empty_rows.add(i)
+                continue
+            row_hash = d.fingerprint(i)
+            if row_hash in row_hashes:
+                duplicated_rows[i] = row_hashes[row_hash]
+            else:
+                row_hashes[row_hash] = i
+        memo = (row_hashes, duplicated_rows, empty_rows)
+        d.memo['row_hashes'] = memo
+        return memo
+
+    def diff_data_external(self, rows1, rows2, ncols: int, cells: ModifiedCells = None):
+        """
+        generate data diff out of core, same as diff_data
+        rows are spilled to disk as fingerprint records and payloads, records are sorted in runs within
+        memory budget and merged to find kept, duplicated and left rows,
+        then only left rows are loaded to match modified rows in memory
+        :param rows1: iterable of src rows of stringified values
+        :param rows2: iterable of dest rows of stringified values
+        :param ncols: num of cols, rows are padded or truncated to it
+        :param cells: collector of modified cells, cells are in data col indices if None
+        :return: data diff
+        """
+        if cells is None:
+            cells = ModifiedCells(row_offset=self._start_row)
+        return self._diff_data_external(rows1, rows2, ncols, cells)[0]
+
+    def _diff_data_external(self, rows1, rows2, ncols: int, cells: ModifiedCells):
+        """
+        see diff_data_external
+        :param rows1: iterable of src rows
+        :param rows2: iterable of dest rows
+        :param ncols: num of cols
+        :param cells: collector of modified cells
+        :return: data diff, num of src rows, num of dest rows
+        """
+        with RowSpiller(self._memory_budget) as spiller:
+            t = time.perf_counter()
+            for side, rows in [(1, rows1), (2, rows2)]:
+                idx = 0
+                for row in rows:
+                    row = [row[j] if j < len(row) else '' for j in range(ncols)]
+                    # check cell of first column to judge if the row is valid
+                    if row[0] != '':
+                        spiller.add(side, idx, row)
+                    idx += 1
+                spiller.nrows[side - 1] = idx
+            self._stats.add_seconds('spill', time.perf_counter() - t)
+            t = time.perf_counter()
+            nrows1, nrows2 = spiller.nrows
+            duplicated_rows = [dict(), dict()]
+            # src row idx -> dest row idx, -1 if not kept
+            kept = array('i', [-1]) * nrows1
+            left_rows = [[], []]
+            cur_fp, firsts = None, [None, None]
+            for fp, side, idx, offset in spiller.merged():
+                if fp != cur_fp:
+                    ExcelDiffer._add_fingerprint_group(firsts, kept, left_rows)
+                    cur_fp, firsts = fp, [None, None]
+                if firsts[side - 1] is None:
+                    firsts[side - 1] = (idx, offset)
+                else:
+                    duplicated_rows[side - 1][idx] = firsts[side - 1][0]
+            ExcelDiffer._add_fingerprint_group(firsts, kept, left_rows)
+            self._stats.add_seconds('merge', time.perf_counter() - t)
+            data_diff = {
+                'moved_rows': dict(),
+                'duplicated_src_rows': dict([(i + self._start_row, duplicated_rows[0][i] + self._start_row)
+                                             for i in sorted(duplicated_rows[0].keys())]),
+                'duplicated_dest_rows': dict([(i + self._start_row, duplicated_rows[1][i] + self._start_row)
+                                              for i in sorted(duplicated_rows[1].keys())]),
+            }
+            duplicated_rows = None
+            kept_indices1, kept_indices2 = array('I'), array('I')
+            for i in range(nrows1):
+                if kept[i] >= 0:
+                    kept_indices1.append(i)
+                    kept_indices2.append(kept[i])
+            kept = None
+            # same as diff_data
+            with self._stats.timer('lis'):
+                lis_indices2 = lis(kept_indices2)
+            if len(lis_indices2) == len(kept_indices2) and len(lis_indices2) == nrows2:
+                return None, nrows1, nrows2  # no change
+            i, j, l = 0, 0, len(kept_indices1)
+            while i < l and j < len(lis_indices2):
+                if kept_indices2[i] == lis_indices2[j]:
+                    j += 1
+                else:
+                    data_diff['moved_rows'][kept_indices1[i] + self._start_row] = \
+                        kept_indices2[i] + self._start_row
+                i += 1
+            kept_indices1, kept_indices2, lis_indices2 = None, None, None
+            # load left rows into memory and match modified rows
+            left_rows1, left_rows2 = sorted(left_rows[0]), sorted(left_rows[1])
+            LOGGER.debug('Load %d src rows and %d dest rows left' % (len(left_rows1), len(left_rows2)))
+            with self._stats.timer('load'):
+                pool = ValuePool()
+                d1 = RowMatrix.from_rows(pool, [spiller.load(1, offset) for _, offset in left_rows1], ncols)
+                d2 = RowMatrix.from_rows(pool, [spiller.load(2, offset) for _, offset in left_rows2], ncols)
+        rows1, rows2 = [i for i, _ in left_rows1], [i for i, _ in left_rows2]
+        cells.map_rows(rows1, rows2)
+        diff = self._diff_modified_data(d1, d2, list(range(len(d1))), list(range(len(d2))), cells)
+        cells.map_rows(None, None)
+        data_diff['modified_cells'] = cells.cells
+        data_diff['removed_rows'] = [self._start_row + rows1[i] for i in diff['removed_rows']]
+        data_diff['added_rows'] = [self._start_row + rows2[i] for i in diff['added_rows']]
+        if len(data_diff['moved_rows'].keys()) > 0 or \
+                len(data_diff['added_rows']) > 0 or \
+                len(data_diff['removed_rows']) > 0 or \
+                cells.count > 0:
+            return data_diff, nrows1, nrows2
+        return None, nrows1, nrows2
+
+    @staticmethod
+    def _add_fingerprint_group(firsts: list, kept: array, left_rows: list) -> None:
+        """
+        add rows of a fingerprint, the first src row and the first dest row are kept if both exist, else left
+        :param firsts: (row idx, payload offset) of the first src row and the first dest row, None if not exist
+        :param kept: src row idx -> dest row idx
+        :param left_rows: left src rows and left dest rows, as (row idx, payload offset)
+        :return: None
+        """
+        first1, first2 = firsts
+        if first1 is not None and first2 is not None:
+            kept[first1[0]] = first2[0]
+        elif first1 is not None:
+            left_rows[0].append(first1)
+        elif first2 is not None:
+            left_rows[1].append(first2)
+
+    def diff_keyed_data(self, d1, d2, key_indices: [int], cells: ModifiedCells = None):
+        """
+        generate data diff by matching rows with the same key
+        rows with empty key are skipped, rows with the key existed before are duplicated rows
+        :param d1: data 1, row matrix or list of rows
+        :param d2: data 2, row matrix or list of rows
+        :param key_indices: indices of key cols in data rows
+        :param cells: collector of modified cells, cells are in data col indices if None
+        :return: data diff
+        """
+        if cells is None:
+            cells = ModifiedCells(row_offset=self._start_row)
+        d1, d2 = ExcelDiffer._to_matrices(d1, d2)
+        data_diff = {
+            'moved_rows': dict(),
+            'duplicated_src_rows': dict(),
+            'duplicated_dest_rows': dict(),
+            'modified_cells': cells.cells,
+        }
+        t = time.perf_counter()
+        keys2 = dict()
+        kept_rows = dict()
+        keys1, duplicated_rows1 = ExcelDiffer._get_row_keys(d1, key_indices)
+        for i, first in duplicated_rows1.items():
+            data_diff['duplicated_src_rows'][i + self._start_row] = first + self._start_row
+        for i in range(len(d2)):
+            key = tuple(d2.id_at(i, k) for k in key_indices)
+            if not any(key):
+                continue
+            if key in keys2:
+                data_diff['duplicated_dest_rows'][i + self._start_row] = keys2[key] + self._start_row
+            else:
+                keys2[key] = i
+                if key in keys1:
+                    kept_rows[keys1[key]] = i
+        self._stats.add_seconds('keys', time.perf_counter() - t)
+        # moved rows
+        with self._stats.timer('lis'):
+            moved_rows = ExcelDiffer._get_moved_rows(kept_rows)
+        for i1, i2 in moved_rows.items():
+            data_diff['moved_rows'][i1 + self._start_row] = i2 + self._start_row
+        # modified cells of rows with the same key
+        rows1 = sorted(kept_rows.keys())
+        with self._stats.timer('cells'):
+            self._add_modified_cells(d1, d2, rows1, [kept_rows[i1] for i1 in rows1], cells)
+        kept_rows2 = set(kept_rows.values())
+        data_diff['removed_rows'] = [self._start_row + i for i in sorted(keys1.values()) if i not in kept_rows]
+        data_diff['added_rows'] = [self._start_row + i for i in sorted(keys2.values()) if i not in kept_rows2]
+        if len(data_diff['moved_rows'].keys()) > 0 or \
+                len(data_diff['added_rows']) > 0 or \
+                len(data_diff['removed_rows']) > 0 or \
+                cells.count > 0:
+            return data_diff
+
+    @staticmethod
+    def _get_row_keys(d: RowMatrix, key_indices: [int]):
+        """
+        get keys of rows, memoized on the matrix, rows with empty key are skipped
+        :param d: row matrix
+        :param key_indices: indices of key cols
+        :return: key -> first row idx, duplicated row idx -> first row idx
+        """
+        memo_key = ('row_keys', tuple(key_indices))
+        memo = d.memo.get(memo_key)
+        if memo is not None:
+            return memo
+        keys, duplicated_rows = dict(), dict()
+        for i in range(len(d)):
+            key = tuple(d.id_at(i, k) for k in key_indices)
+            if not any(key):
+                continue
+            if key in keys:
+                duplicated_rows[i] = keys[key]
+            else:
+                keys[key] = i
+        memo = (keys, duplicated_rows)
+        d.memo[memo_key] = memo
+        return memo
+
+    def _add_modified_cells(self, d1, d2, rows1: [int], rows2: [int], cells: ModifiedCells) -> None:
+        """
+        compare cells of matched row pairs and add modified cells, in order of pairs and cols
+        with numpy, pairs are compared as 2-D arrays in batches, and only modified cells are visited in python
+        :param d1: row matrix of data 1
+        :param d2: row matrix of data 2
+        :param rows1: indices of matched rows in data 1
+        :param rows2: indices of matched rows in data 2, paired with rows1
+        :param cells: collector of modified cells
+        :return: None
+        """
+        values = d1.pool.values
+        col_l = min(d1.ncols, d2.ncols)
+        if not self._use_numpy:
+            for i in range(len(rows1)):
+                r1, r2 = d1.ids(rows1[i]), d2.ids(rows2[i])
+                for j in range(col_l):
+                    if r1[j] != r2[j]:
+                        cells.add(rows1[i], rows2[i], j, values[r1[j]], values[r2[j]])
+            return
+        a1, a2 = d1.to_array()[:, :col_l], d2.to_array()[:, :col_l]
+        for start in range(0, len(rows1), NUMPY_BATCH_ROWS):
+            b1 = a1[rows1[start:start + NUMPY_BATCH_ROWS]]
+            b2 = a2[rows2[start:start + NUMPY_BATCH_ROWS]]
+            ks, js = numpy.nonzero(b1 != b2)
+            v1, v2 = b1[ks, js].tolist(), b2[ks, js].tolist()
+            ks, js = ks.tolist(), js.tolist()
+            for n in range(len(ks)):
+                k = start + ks[n]
+                cells.add(rows1[k], rows2[k], js[n], values[v1[n]], values[v2[n]])
+
+    @staticmethod
+    def _get_moved_rows(kept_rows: dict) -> dict:
+        """
+        get moved rows of kept rows, rows out of the LIS of dest indices are moved
+        :param kept_rows: src row idx -> dest row idx
+        :return: src row idx -> dest row idx of moved rows
+        """
+        moved_rows = dict()
+        kept_indices1 = sorted(kept_rows.keys())
+        kept_indices2 = [kept_rows[idx] for idx in kept_indices1]
+        lis_indices2 = lis(kept_indices2)
+        i, j = 0, 0
+        while i < len(kept_indices1):
+            if j < len(lis_indices2) and kept_indices2[i] == lis_indices2[j]:
+                j += 1
+            else:
+                moved_rows[kept_indices1[i]] = kept_indices2[i]
+            i += 1
+        return moved_rows
+
+    def _diff_modified_data(self, d1, d2, rows1, rows2, cells: ModifiedCells):
         """
         diff, assuming that data1 and data 2 must have diff
-        :param d1: data 1
-        :param d2: data 2
-        :return:
+        each src row is matched to the first unvisited dest row passing the row modify threshold,
+        candidates are looked up from an inverted index of (col, value) -> dest rows,
+        so that a src row is only compared with dest rows sharing cells with it
+        :param d1: row matrix of data 1
+        :param d2: row matrix of data 2
+        :param rows1: indices of left rows in data 1
+        :param rows2: indices of left rows in data 2
+        :param cells: collector of modified cells
+        :return: added rows and removed rows
         """
         diff = {
-            'modified_cells': [],
             'added_rows': [],
             'removed_rows': []
         }
-        i1 = 0
-        visited_i2 = set()
-        while i1 < len(rows1):
-            dest_row = -1
-            r1 = d1[i1]
-            i2 = 0
-            while i2 < len(rows2):
-                if i2 not in visited_i2:
-                    r2 = d2[i2]
-                    col_l = min(len(r1), len(r2))  # col len should be same in fact
-                    same_cnt, diffs = 0, []
-                    for j in range(col_l):
-                        if r1[j] == r2[j]:
-                            same_cnt += 1
-                        else:
-                            diffs.append({
-                                'src_row': rows1[i1],
-                                'dest_row': rows2[i2],
-                                'src_col': j,
-                                'dest_col': j,
-                                'src_val': r1[j],
-                                'dest_val': r2[j]
-                            })
-                    if same_cnt / col_l >= self._row_modify_threshold:
-                        diff['modified_cells'].extend(diffs)
-                        dest_row = rows2[i2]
-                        break
-                i2 += 1
-            if dest_row >= 0:
-                visited_i2.add(i2)
+        t = time.perf_counter()
+        if self._use_numpy:
+            # value ids of left rows
+            ad2 = d2.to_array()[rows2]
+            index = ExcelDiffer._get_numpy_index(ad2, len(d2.pool))
+            visited = numpy.zeros(len(rows2), dtype=bool)
+
+            def match_row(r):
+                return self._match_row_numpy(r, ad2, index, visited)
+        else:
+            # value ids of left rows
+            rd2 = [d2.ids(i) for i in rows2]
+            index = dict()
+            for i2 in range(len(rows2)):
+                r2 = rd2[i2]
+                for j in range(len(r2)):
+                    k = (j, r2[j])
+                    if k not in index:
+                        index[k] = list()
+                    index[k].append(i2)
+            visited = set()
+
+            def match_row(r):
+                return self._match_row(r, rd2, index, visited)
+        self._stats.add_seconds('index', time.perf_counter() - t)
+        t = time.perf_counter()
+        matched_rows1, matched_rows2 = [], []
+        for i1 in range(len(rows1)):
+            i2 = match_row(d1.ids(rows1[i1]))
+            if i2 >= 0:
+                if self._use_numpy:
+                    visited[i2] = True
+                else:
+                    visited.add(i2)
+                matched_rows1.append(rows1[i1])
+                matched_rows2.append(rows2[i2])
             else:
                 diff['removed_rows'].append(rows1[i1])
-            i1 += 1
         for i2 in range(len(rows2)):
-            if i2 not in visited_i2:
+            if not (visited[i2] if self._use_numpy else i2 in visited):
                 diff['added_rows'].append(rows2[i2])
+        self._stats.add_seconds('match', time.perf_counter() - t)
+        self._stats.count('matched_rows', len(matched_rows1))
+        with self._stats.timer('cells'):
+            self._add_modified_cells(d1, d2, matched_rows1, matched_rows2, cells)
         return diff
 
-    def get_diff_report(self, src_dir: str, dest_dir: str) -> (dict, str):
+    def _get_min_same(self, col_l: int) -> int:
+        """
+        get min num of same cells for a row pair of col_l cols to pass the row modify threshold
+        :param col_l: num of cols
+        :return: min num of same cells, col_l + 1 if no row pair can pass
+        """
+        # start near the answer, then step with the same comparison as the ratio check
+        min_same = min(max(int(self._row_modify_threshold * col_l), 0), col_l + 1)
+        while min_same > 0 and (min_same - 1) / col_l >= self._row_modify_threshold:
+            min_same -= 1
+        while min_same <= col_l and min_same / col_l < self._row_modify_threshold:
+            min_same += 1
+        return min_same
+
+    @staticmethod
+    def _get_numpy_index(a2, pool_size: int):
+        """
+        get inverted index of dest rows as numpy arrays
+        cells are keyed by col * pool_size + value id, and sorted by key then row,
+        so that the posting list of a cell is a slice of sorted rows
+        :param a2: value ids of dest rows
+        :param pool_size: size of value pool
+        :return: sorted keys, sorted row indices, key base of each col
+        """
+        nrows, col_l = a2.shape
+        dtype = numpy.uint32 if col_l * pool_size < (1 << 32) else numpy.uint64
+        base = numpy.arange(col_l, dtype=dtype) * dtype(pool_size)
+        keys = (base + a2.astype(dtype)).ravel()
+        order = numpy.argsort(keys, kind='stable')
+        return keys[order], (order // max(col_l, 1)).astype(numpy.uint32), base
+
+    def _match_row_numpy(self, r1, a2, index, visited):
+        """
+        same as _match_row, with posting lists looked up, counted and verified in numpy batches
+        :param r1: value ids of src row
+        :param a2: value ids of dest rows
+        :param index: inverted index of dest rows, see _get_numpy_index
+        :param visited: bool array, if dest rows have been matched
+        :return: index of matched dest row, -1 if not found
+        """
+        col_l = len(r1)
+        if col_l == 0:
+            return -1
+        min_same = self._get_min_same(col_l)
+        if min_same > col_l:
+            return -1
+        if min_same == 0:
+            # every dest row passes the threshold
+            left = numpy.nonzero(~visited)[0]
+            return int(left[0]) if len(left) > 0 else -1
+        keys, rows, base = index
+        v1 = numpy.frombuffer(r1, dtype=numpy.uint32)
+        q = base + v1
+        lo = numpy.searchsorted(keys, q, side='left')
+        lens = numpy.searchsorted(keys, q, side='right') - lo
+        by_len = numpy.argsort(lens, kind='stable')
+        sorted_lens = lens[by_len]
+        # any (col_l - min_same + 1) posting lists must cover candidates,
+        # more posting lists are counted to filter candidates while not longer than counted ones
+        total = numpy.cumsum(sorted_lens)
+        k = col_l - min_same + 1
+        longer = numpy.nonzero(sorted_lens[k:] > total[k - 1:-1])[0]
+        k = k + int(longer[0]) if len(longer) > 0 else col_l
+        # gather the counted posting lists as one array
+        starts, lens = lo[by_len[:k]], sorted_lens[:k]
+        offsets = total[:k] - lens
+        gathered = rows[numpy.arange(total[k - 1]) + numpy.repeat(starts - offsets, lens)]
+        candidates, counts = numpy.unique(gathered, return_counts=True)
+        # a candidate shares at most (col_l - k) cells in the uncounted cols
+        candidates = candidates[(counts >= min_same - (col_l - k)) & ~visited[candidates]]
+        self._stats.count('candidates', len(candidates))
+        for start in range(0, len(candidates), NUMPY_BATCH_CANDIDATES):
+            batch = candidates[start:start + NUMPY_BATCH_CANDIDATES]
+            same_cnts = (a2[batch] == v1).sum(axis=1)
+            passed = numpy.nonzero(same_cnts / col_l >= self._row_modify_threshold)[0]
+            if len(passed) > 0:
+                return int(batch[passed[0]])
+        return -1
+
+    def _match_row(self, r1, d2, index, visited_i2):
+        """
+        find the first unvisited dest row that the src row may be modified to
+        a dest row passing the threshold shares at least min_same cells with the src row,
+        so it must share one of any (col_l - min_same + 1) cells of the src row,
+        dest rows in the shortest posting lists of such cells are candidates,
+        other short posting lists are counted as well to filter candidates before comparing cells
+        :param r1: value ids of src row
+        :param d2: value ids of dest rows
+        :param index: (col, value id) -> indices of dest rows in ascending order
+        :param visited_i2: indices of dest rows that have been matched
+        :return: index of matched dest row, -1 if not found
+        """
+        col_l = len(r1)
+        if col_l == 0:
+            return -1
+        min_same = self._get_min_same(col_l)
+        if min_same > col_l:
+            return -1
+        if min_same == 0:
+            # every dest row passes the threshold
+            for i2 in range(len(d2)):
+                if i2 not in visited_i2:
+                    return i2
+            return -1
+        postings = [index.get((j, r1[j]), []) for j in range(col_l)]
+        postings.sort(key=len)
+        counts = Counter()
+        k = 0
+        while k < col_l:
+            if k > col_l - min_same and len(postings[k]) > len(counts):
+                break
+            counts.update(postings[k])
+            k += 1
+        # a candidate shares at most (col_l - k) cells in the uncounted cols
+        min_cnt = min_same - (col_l - k)
+        candidates = [i2 for i2, cnt in counts.items() if cnt >= min_cnt and i2 not in visited_i2]
+        candidates.sort()
+        self._stats.count('candidates', len(candidates))
+        for i2 in candidates:
+            r2 = d2[i2]
+            l = min(col_l, len(r2))  # col len should be same in fact
+            same_cnt = 0
+            for j in range(l):
+                if r1[j] == r2[j]:
+                    same_cnt += 1
+            if same_cnt / l >= self._row_modify_threshold:
+                return i2
+        return -1
+
+    def get_diff_report(self, src_dir: str, dest_dir: str, workers: int = 1,
+                        src_manifest: ExcelManifest = None, dest_manifest: ExcelManifest = None) -> (dict, str):
         """
         generate diff report from directories including excel files
         input 2 directories of excel files, output diff of 2 directories
@@ -443,40 +1236,404 @@ class ExcelDiffer:
                         }
                     ]
                 }
-            ]
+            ],
+            errors: [(str) error message of files failed to diff]
         }
         :param src_dir: directory containing source excel files
         :param dest_dir: directory containing destination excel files
+        :param workers: num of worker processes to diff files with, diff files one by one if <= 1
+        :param src_manifest: manifest of src dir (see excel_manifest), src dir is not scanned again if specified
+        :param dest_manifest: manifest of dest dir, dest dir is not scanned again if specified
         :return: report dict and string
         """
+        return self._get_diff_report(src_dir, dest_dir, workers, None, src_manifest, dest_manifest)
+
+    def write_diff_report(self, src_dir: str, dest_dir: str, fp, workers: int = 1,
+                          src_manifest: ExcelManifest = None, dest_manifest: ExcelManifest = None) -> dict:
+        """
+        generate diff report from directories including excel files, and write it as newline-delimited json
+        events are written while differing, so that memory does not grow with num of modified cells,
+        see excel_report for the events, and excel_report.read_report to rebuild the nested report
+        :param src_dir: directory containing source excel files
+        :param dest_dir: directory containing destination excel files
+        :param fp: text file object to write
+        :param workers: num of worker processes to diff files with, diff files one by one if <= 1
+        :param src_manifest: manifest of src dir, see get_diff_report
+        :param dest_manifest: manifest of dest dir, see get_diff_report
+        :return: report dict in which modified sheets only contain names
+        """
+        return self._get_diff_report(src_dir, dest_dir, workers, ReportWriter(fp), src_manifest, dest_manifest)
+
+    def _get_diff_report(self, src_dir: str, dest_dir: str, workers: int = 1, writer: ReportWriter = None,
+                         src_manifest: ExcelManifest = None, dest_manifest: ExcelManifest = None) -> dict:
+        """
+        generate diff report, see get_diff_report and write_diff_report
+        :param src_dir: directory containing source excel files
+        :param dest_dir: directory containing destination excel files
+        :param workers: num of worker processes
+        :param writer: report writer
+        :param src_manifest: manifest of src dir
+        :param dest_manifest: manifest of dest dir
+        :return: report dict
+        """
         LOGGER.info('Get excel diff report --- src: %s, dest: %s' % (src_dir, dest_dir))
         report = {
             'added_files': [],
             'removed_files': [],
             'modified_files': [],
+            'errors': [],
         }
-        src_files = ExcelDiffer.get_excel_files(src_dir)
-        dest_files = ExcelDiffer.get_excel_files(dest_dir)
+        with self._stats.timer('scan'):
+            src_files = src_manifest.files() if src_manifest is not None else ExcelDiffer.get_excel_files(src_dir)
+            dest_files = dest_manifest.files() if dest_manifest is not None else ExcelDiffer.get_excel_files(dest_dir)
         LOGGER.info('Src excel files: %s' % list(src_files))
         LOGGER.info('Dest excel files: %s' % list(dest_files))
         rm, kp, ad = get_iter_diff(src_files, dest_files)
         report['removed_files'] = rm
         report['added_files'] = ad
-        for kf in kp:
-            f1 = os.path.join(src_dir, kf)
+        if writer is not None:
+            writer.write('report', added_files=ad, removed_files=rm)
+        if src_manifest is not None and dest_manifest is not None:
+            # skip files with equal hashes in manifests, without reading them
+            same = set([kf for kf in kp if src_manifest.is_same_file(kf, dest_manifest)])
+            for kf in kp:
+                if kf in same:
+                    with self._stats.scope(file=os.path.join(src_dir, kf)):
+                        self._stats.count('skipped_files')
+                    LOGGER.info("File %s did not change...", kf)
+            kp = [kf for kf in kp if kf not in same]
+        self.add_file_diffs(report, self.diff_files(src_dir, dest_dir, kp, workers, writer), writer)
+        return report
+
+    def get_commit_diff_report(self, commit1, commit2) -> dict:
+        """
+        generate diff report of excel files between 2 git commits, without checking out any working tree
+        changed excel files are listed from the tree diff, and only their blobs are read into memory
+        file names are paths from repo root, renamed files are reported as removed and added files
+        :param commit1: source commit object of GitPython
+        :param commit2: destination commit object of GitPython
+        :return: report dict, same as get_diff_report
+        """
+        LOGGER.info('Get excel diff report --- src: %s, dest: %s' % (commit1.hexsha, commit2.hexsha))
+        report = {
+            'added_files': [],
+            'removed_files': [],
+            'modified_files': [],
+            'errors': [],
+        }
+        modified = []
+        for d in commit1.diff(commit2):
+            a_path = d.a_path if d.a_blob is not None and ExcelDiffer._is_excel_path(d.a_path) else ''
+            b_path = d.b_path if d.b_blob is not None and ExcelDiffer._is_excel_path(d.b_path) else ''
+            if a_path and a_path == b_path:
+                modified.append((a_path, d.a_blob, d.b_blob))
+                continue
+            if a_path:
+                report['removed_files'].append(a_path)
+            if b_path:
+                report['added_files'].append(b_path)
+        report['removed_files'].sort()
+        report['added_files'].sort()
+        modified.sort(key=lambda m: m[0])
+        LOGGER.info('Modified excel files: %s' % [m[0] for m in modified])
+        self.add_file_diffs(report, self._diff_blobs(commit1, commit2, modified))
+        return report
+
+    def get_multi_diff_report(self, src_dir: str, dest_dirs: [str], workers: int = 1) -> [dict]:
+        """
+        generate diff reports of one baseline directory against many target directories
+        the baseline is hashed and parsed once for all targets, and row fingerprints and key indexes of a baseline
+        sheet are built once for all targets with the same col mapping. values of each target are kept in a pool
+        of its own diff, so memory of baseline does not grow with num of targets
+        targets are diffed one by one, sheets of baseline are parsed on first use,
+        or in a process pool if workers > 1, then all sheets of baseline files changed in any target are parsed
+        and indexed for targets keeping all cols before workers start, and each worker receives the indexed
+        baseline once, targets with other cols build their own indexes in workers
+        :param src_dir: directory containing baseline excel files
+        :param dest_dirs: directories containing target excel files
+        :param workers: num of worker processes to diff targets with
+        :return: report dicts of targets, same order as dest_dirs, see get_diff_report
+        """
+        LOGGER.info('Get excel diff reports --- src: %s, dest: %s' % (src_dir, dest_dirs))
+        with self._stats.timer('scan'):
+            src_files = ExcelDiffer.get_excel_files(src_dir)
+        reports, changed = [], []
+        baseline = dict()
+        try:
+            for dest_dir in dest_dirs:
+                with self._stats.timer('scan'):
+                    dest_files = ExcelDiffer.get_excel_files(dest_dir)
+                rm, kp, ad = get_iter_diff(src_files, dest_files)
+                reports.append({
+                    'added_files': ad,
+                    'removed_files': rm,
+                    'modified_files': [],
+                    'errors': [],
+                })
+                changed.append(self._get_changed_files(baseline, src_dir, dest_dir, kp))
+            if workers <= 1 or len(dest_dirs) <= 1:
+                for i in range(len(dest_dirs)):
+                    self.add_file_diffs(reports[i], self._diff_target(baseline, dest_dirs[i], changed[i]))
+                return reports
+            for kf in sorted(set([kf for files in changed for kf, _ in files])):
+                try:
+                    with self._stats.scope(file=baseline[kf].path):
+                        baseline[kf].load()
+                        self._index_snapshot(baseline[kf])
+                except Exception as e:
+                    # reported by each target
+                    LOGGER.exception('Error while loading excel file %s! %s' % (baseline[kf].path, e))
+            with ProcessPoolExecutor(max_workers=min(workers, len(dest_dirs)),
+                                     initializer=_init_baseline, initargs=(baseline, )) as executor:
+                futures = [executor.submit(self._run_with_stats, '_diff_target_of_baseline', dest_dirs[i], changed[i])
+                           for i in range(len(dest_dirs))]
+                for i in range(len(dest_dirs)):
+                    try:
+                        results, stats = futures[i].result()
+                        self._stats.merge(stats)
+                    except Exception as e:
+                        # worker process crashed or result could not be transferred
+                        results = []
+                        for kf, _ in changed[i]:
+                            err = 'Error while differing excel file %s and %s! %s' \
+                                  % (baseline[kf].path, os.path.join(dest_dirs[i], kf), e)
+                            LOGGER.exception(err)
+                            results.append((kf, None, err))
+                    self.add_file_diffs(reports[i], results)
+        finally:
+            for snapshot in baseline.values():
+                snapshot.close()
+        return reports
+
+    def _get_changed_files(self, baseline: dict, src_dir: str, dest_dir: str, files: [str]) -> [(str, str)]:
+        """
+        find kept files of a target whose content differs from baseline, without parsing
+        snapshots of baseline files are added to baseline, hashes of them are calculated once
+        :param baseline: file name -> workbook snapshot
+        :param src_dir: directory containing baseline excel files
+        :param dest_dir: directory containing target excel files
+        :param files: relative paths of files kept in both directories
+        :return: list of (file name, content hash of target file, empty if not calculated)
+        """
+        changed = []
+        for kf in files:
+            snapshot = baseline.get(kf)
+            if snapshot is None:
+                snapshot = self.get_snapshot(os.path.join(src_dir, kf))
+                baseline[kf] = snapshot
             f2 = os.path.join(dest_dir, kf)
-            try:
-                ret = self.diff_file(f1, f2)
-                if ret:
-                    ret['name'] = kf
-                    report['modified_files'].append(ret)
+            with self._stats.scope(file=snapshot.path):
+                h2 = ''
+                try:
+                    size2 = os.path.getsize(f2)
+                    if size2 == snapshot.size:
+                        with self._stats.timer('hash_file'):
+                            if not snapshot.file_hash:
+                                snapshot.file_hash = md5_file(snapshot.path)
+                            h2 = md5_file(f2)
+                        if h2 == snapshot.file_hash:
+                            self._stats.count('skipped_files')
+                            LOGGER.info("File %s did not change...", kf)
+                            continue
+                except OSError as e:
+                    # reported while differing
+                    LOGGER.warning('Failed to hash excel file %s and %s! %s' % (snapshot.path, f2, e))
+            changed.append((kf, h2))
+        return changed
+
+    def get_snapshot(self, f: str) -> WorkbookSnapshot:
+        """
+        get lazily opened snapshot of a baseline file, which is parsed once and can be diffed with many targets
+        :param f: file path
+        :return: workbook snapshot
+        """
+        def open_book():
+            return self.open_workbook(f, snapshot.file_hash)
+        snapshot = WorkbookSnapshot(f, os.path.getsize(f), open_book,
+                                    self._header_row, self._start_row, self._start_col)
+        return snapshot
+
+    def _index_snapshot(self, snapshot: WorkbookSnapshot) -> None:
+        """
+        build data matrices and row indexes of all sheets of a baseline snapshot, for targets keeping all cols
+        :param snapshot: loaded workbook snapshot
+        :return: None
+        """
+        for sheet_name in snapshot.sheet_names():
+            s = snapshot.sheet(sheet_name)
+            headers = [str(v) for v in s.row_values(self._header_row, start_colx=self._start_col)]
+            indices = list(range(len(headers)))
+            key_indices = self._get_key_indices(headers, indices, sheet_name)
+            if self._memory_budget > 0 and not key_indices:
+                # diffed out of core, matrices are not used
+                continue
+            with self._stats.scope(sheet=sheet_name), self._stats.timer('index'):
+                d = s.matrix(self._start_row, [c + self._start_col for c in indices])
+                if key_indices:
+                    ExcelDiffer._get_row_keys(d, key_indices)
                 else:
-                    LOGGER.info("File %s did not change...", kf)
+                    ExcelDiffer._get_row_hashes(d)
+
+    def _diff_target(self, baseline: dict, dest_dir: str, changed: [(str, str)]):
+        """
+        diff changed files of a target against baseline
+        :param baseline: file name -> workbook snapshot
+        :param dest_dir: directory containing target excel files
+        :param changed: list of (file name, content hash of target file), see _get_changed_files
+        :return: generator of (file name, file diff, error msg)
+        """
+        for kf, h2 in changed:
+            snapshot = baseline[kf]
+            f1, f2 = snapshot.path, os.path.join(dest_dir, kf)
+            LOGGER.info('Get file diff --- src: %s, dest: %s' % (f1, f2))
+            try:
+                with self._stats.scope(file=f1), self.open_workbook(f2, h2) as d2:
+                    ret = self.diff_workbooks(snapshot, d2, f1, f2, h1=snapshot.file_hash, h2=h2)
+                yield kf, ret, ''
             except Exception as e:
                 msg = 'Error while differing excel file %s and %s! %s' % (f1, f2, e)
                 LOGGER.exception(msg)
-                report['errors'].append(msg)
-        return report
+                yield kf, None, msg
+
+    def _diff_target_of_baseline(self, dest_dir: str, changed: [(str, str)]) -> list:
+        """
+        diff changed files of a target against baseline set by _init_baseline, run in worker process
+        :param dest_dir: directory containing target excel files
+        :param changed: list of (file name, content hash of target file)
+        :return: list of (file name, file diff, error msg)
+        """
+        return list(self._diff_target(_BASELINE, dest_dir, changed))
+
+    @staticmethod
+    def _is_excel_path(path: str) -> bool:
+        """
+        check if a path is an excel file, office lock files are excluded
+        :param path: file path
+        :return: if it is an excel file
+        """
+        return ExcelManifest.is_excel_file(os.path.basename(path))
+
+    def _diff_blobs(self, commit1, commit2, blobs: list):
+        """
+        diff excel file blobs one by one, blobs are streamed from object database into memory
+        :param commit1: source commit
+        :param commit2: destination commit
+        :param blobs: list of (file path, src blob, dest blob)
+        :return: generator of (file name, file diff, error msg)
+        """
+        for name, blob1, blob2 in blobs:
+            f1 = '%s:%s' % (commit1.hexsha, name)
+            f2 = '%s:%s' % (commit2.hexsha, name)
+            try:
+                data1 = blob1.data_stream.read()
+                data2 = blob2.data_stream.read()
+            except Exception as e:
+                msg = 'Error while reading excel file %s and %s! %s' % (f1, f2, e)
+                LOGGER.exception(msg)
+                yield name, None, msg
+                continue
+            ret, err = self._diff_file_safely(f1, f2, data1=data1, data2=data2)
+            yield name, ret, err
+
+    @staticmethod
+    def add_file_diffs(report: dict, results, writer: ReportWriter = None) -> None:
+        """
+        add results of differing kept files to report
+        :param report: report dict
+        :param results: iterable of (file name, file diff, error msg)
+        :param writer: report writer
+        :return: None
+        """
+        for kf, ret, err in results:
+            if err:
+                report['errors'].append(err)
+                if writer is not None:
+                    writer.write('error', file=kf, message=err)
+            elif ret:
+                ret['name'] = kf
+                report['modified_files'].append(ret)
+                if writer is not None:
+                    writer.write('file', name=kf, added_sheets=ret['added_sheets'],
+                                 removed_sheets=ret['removed_sheets'])
+            else:
+                LOGGER.info("File %s did not change...", kf)
+
+    def diff_files(self, src_dir: str, dest_dir: str, files: [str], workers: int = 1,
+                   writer: ReportWriter = None):
+        """
+        diff kept files, in a process pool if workers > 1
+        results are yielded in the same order as files
+        if writer is specified, each worker writes events to a part file, which is appended to writer in order
+        :param src_dir: directory containing source excel files
+        :param dest_dir: directory containing destination excel files
+        :param files: relative paths of files kept in both directories
+        :param workers: num of worker processes
+        :param writer: report writer
+        :return: generator of (file name, file diff, error msg)
+        """
+        pairs = [(kf, os.path.join(src_dir, kf), os.path.join(dest_dir, kf)) for kf in files]
+        if workers <= 1 or len(pairs) <= 1:
+            for kf, f1, f2 in pairs:
+                ret, err = self._diff_file_safely(f1, f2, writer.scope(file=kf) if writer is not None else None)
+                yield kf, ret, err
+            return
+        part_dir = tempfile.mkdtemp(prefix='excel_diff_') if writer is not None else ''
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pairs))) as executor:
+                futures = []
+                for i in range(len(pairs)):
+                    kf, f1, f2 = pairs[i]
+                    if writer is not None:
+                        part = os.path.join(part_dir, '%d.ndjson' % i)
+                        futures.append(executor.submit(self._run_with_stats, '_diff_file_to_part', f1, f2, part, kf))
+                    else:
+                        futures.append(executor.submit(self._run_with_stats, '_diff_file_safely', f1, f2))
+                for i in range(len(pairs)):
+                    kf, f1, f2 = pairs[i]
+                    try:
+                        (ret, err), stats = futures[i].result()
+                        self._stats.merge(stats)
+                        if writer is not None:
+                            writer.write_part(os.path.join(part_dir, '%d.ndjson' % i))
+                    except Exception as e:
+                        # worker process crashed or result could not be transferred
+                        err = 'Error while differing excel file %s and %s! %s' % (f1, f2, e)
+                        LOGGER.exception(err)
+                        ret = None
+                    yield kf, ret, err
+        finally:
+            if part_dir:
+                shutil.rmtree(part_dir, ignore_errors=True)
+
+    def _diff_file_to_part(self, f1: str, f2: str, part: str, name: str):
+        """
+        diff file and write events to a part file
+        :param f1: file path 1
+        :param f2: file path 2
+        :param part: path of part file
+        :param name: file name in report
+        :return: file diff report dict, error msg
+        """
+        with open(part, 'w', encoding='utf-8') as fp:
+            return self._diff_file_safely(f1, f2, ReportWriter(fp, file=name))
+
+    def _diff_file_safely(self, f1: str, f2: str, writer: ReportWriter = None,
+                          data1: bytes = None, data2: bytes = None):
+        """
+        diff file and catch the error
+        :param f1: file path 1
+        :param f2: file path 2
+        :param writer: report writer
+        :param data1: content of file 1 in memory
+        :param data2: content of file 2 in memory
+        :return: file diff report dict, error msg
+        """
+        try:
+            return self.diff_file(f1, f2, writer, data1, data2), ''
+        except Exception as e:
+            msg = 'Error while differing excel file %s and %s! %s' % (f1, f2, e)
+            LOGGER.exception(msg)
+            return None, msg
 
 
 if __name__ == '__main__':
@@ -0,0 +1,353 @@
+import logger
+import os
+import pickle
+import time
+import zlib
+import util
+from lib.excel_cache import CACHE_VERSION, CachedSheet
+from lib.excel_differ import ExcelDiffer
+from lib.excel_reader import get_reader_name
+
+LOGGER = logger.get_logger('EXCEL_HISTORY')
+# bump it if the format of cached history changes
+HISTORY_VERSION = 2
+HISTORY_EXT = '.history'
+
+"""
+Cell-level history (blame) of an excel table in a git repo
+versions of the table are read from blobs in commit order, each version is parsed once,
+and only sheets whose signature changed are parsed and compared with the previous version
+rows are identified by key cols and cols by header names, so a cell is (sheet, row key, col name)
+"""
+
+
+class _SheetVersion:
+    """
+    keyed rows of a sheet version
+    """
+    def __init__(self, signature, headers: [str], rows: dict):
+        """
+        :param signature: sheet signature (see excel_reader), None if not available
+        :param headers: header names
+        :param rows: row key -> stringified values, same order as headers
+        """
+        self.signature = signature
+        self.headers = headers
+        self.rows = rows
+
+
+class CellHistory:
+    """
+    per-cell change index, answers which commits changed a cell
+    a removed cell (removed row, col or sheet) is recorded as a change to None
+    """
+    def __init__(self, path: str, key_cols: list):
+        """
+        :param path: table path from repo root
+        :param key_cols: key cols of rows
+        """
+        self.path = path
+        self.key_cols = key_cols
+        # [{id, author, time, message}] of walked commits, oldest first
+        self.commits = []
+        # (sheet, row key, col) -> [(commit idx, value)]
+        self._cells = dict()
+
+    @staticmethod
+    def _key(key) -> tuple:
+        """
+        normalize row key, values are compared as stringified in reports, numbers are read as floats
+        :param key: key value, or list of values of composite key
+        :return: key tuple
+        """
+        if not isinstance(key, (list, tuple)):
+            key = [key]
+        return tuple([str(float(v)) if isinstance(v, (int, float)) and not isinstance(v, bool) else str(v)
+                      for v in key])
+
+    def add_commit(self, commit) -> int:
+        """
+        add a walked commit
+        :param commit: git Commit Object
+        :return: commit idx
+        """
+        self.commits.append({
+            'id': commit.hexsha,
+            'author': commit.author.name,
+            'time': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(commit.committed_date)),
+            'message': commit.message,
+        })
+        return len(self.commits) - 1
+
+    def add_change(self, commit_idx: int, sheet: str, key: tuple, col: str, value) -> None:
+        cell = (sheet, key, col)
+        changes = self._cells.get(cell)
+        if changes is None:
+            changes = []
+            self._cells[cell] = changes
+        changes.append((commit_idx, value))
+
+    def get_cell_history(self, sheet: str, key, col: str) -> [dict]:
+        """
+        get all changes of a cell
+        :param sheet: sheet name
+        :param key: row key, a value or list of values of composite key
+        :param col: col (header) name
+        :return: [{id, author, time, message, value}], oldest first, value is None if the cell is removed
+        """
+        changes = self._cells.get((sheet, CellHistory._key(key), col), [])
+        return [dict(self.commits[i], value=v) for i, v in changes]
+
+    def get_last_change(self, sheet: str, key, col: str):
+        """
+        get the last change of a cell
+        :param sheet: sheet name
+        :param key: row key, a value or list of values of composite key
+        :param col: col (header) name
+        :return: {id, author, time, message, value}, None if the cell never existed
+        """
+        changes = self._cells.get((sheet, CellHistory._key(key), col))
+        if not changes:
+            return None
+        i, v = changes[-1]
+        return dict(self.commits[i], value=v)
+
+    def __len__(self):
+        return len(self._cells)
+
+
+class ExcelHistory:
+    """
+    walk history of excel tables in a git repo, and build cell histories
+    parsing options (header row, start row, start col, readers, cache) are taken from the differ
+    """
+    def __init__(self, differ: ExcelDiffer = None, key_cols=None, cache_dir: str = './tmp/excel_history'):
+        """
+        :param differ: excel differ, default options are used if None
+        :param key_cols: header name or col idx (same base as report indices) of key cols, or a list of them,
+            key cols of differ are used if None
+        :param cache_dir: directory to cache built histories, cache is disabled if empty
+        """
+        self._differ = differ if differ is not None else ExcelDiffer()
+        if key_cols is None:
+            key_cols = self._differ.key_cols
+        elif not isinstance(key_cols, (list, tuple)):
+            key_cols = [key_cols]
+        if not key_cols:
+            raise ValueError('Key cols are required to identify rows in history!')
+        self._key_cols = list(key_cols)
+        self._cache_dir = cache_dir
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_cache_path(self, repo, path: str) -> str:
+        d = self._differ
+        # sheets may be parsed differently by another reader, or by another version of cached sheets
+        key = util.md5('%s|%s|%s|%d|%d|%d|%s|%s|%s' % (os.path.abspath(repo.git_dir), path, self._key_cols,
+                                                       d.header_row, d.start_row, d.start_col, d.use_excel_indices,
+                                                       get_reader_name(path, d.readers),
+                                                       CACHE_VERSION if d.cache is not None else ''))
+        return os.path.join(self._cache_dir, key + HISTORY_EXT)
+
+    def _load_cache(self, p: str):
+        """
+        load cached history
+        :param p: cache path
+        :return: (cell history, blob ids of walked commits, commit of last parsed version), None if missed
+        """
+        try:
+            with open(p, 'rb') as f:
+                version, obj = pickle.loads(zlib.decompress(f.read()))
+            return obj if version == HISTORY_VERSION else None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            LOGGER.exception('Failed to load history cache %s! %s' % (p, e))
+            return None
+
+    def _save_cache(self, p: str, obj) -> None:
+        tmp = '%s.%d.tmp' % (p, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps((HISTORY_VERSION, obj), protocol=pickle.HIGHEST_PROTOCOL)))
+            os.replace(tmp, p)
+        except Exception as e:
+            LOGGER.exception('Failed to cache history %s! %s' % (p, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def build(self, repo, path: str, rev: str = 'HEAD', max_count: int = 500) -> CellHistory:
+        """
+        build cell history of a table over commits changing it
+        if the last cached commit is in the commits to walk, only commits after it are walked,
+        and cached commits which dropped out of the latest max_count commits are kept in history
+        :param repo: git Repo Object
+        :param path: table path from repo root
+        :param rev: revision or range of commits to walk, e.g. HEAD, v1.0..v2.0
+        :param max_count: max num of latest commits to walk
+        :return: cell history
+        """
+        commits = list(repo.iter_commits(rev, paths=path, max_count=max_count))
+        commits.reverse()
+        LOGGER.info('Build history of %s over %d commits' % (path, len(commits)))
+        history, blobs = CellHistory(path, self._key_cols), []
+        p = self._get_cache_path(repo, path) if self._cache_dir else ''
+        cached = self._load_cache(p) if p else None
+        start = 0
+        # commit of the last parsed version, None if the table did not exist
+        prev_id = None
+        if cached is not None:
+            cached_history, cached_blobs, cached_prev_id = cached
+            start = ExcelHistory._get_resume_idx([c['id'] for c in cached_history.commits],
+                                                 [c.hexsha for c in commits])
+            if start > 0:
+                history, blobs, prev_id = cached_history, cached_blobs, cached_prev_id
+                LOGGER.info('History of %s is cached for %d commits' % (path, start))
+        prev = dict()
+        if prev_id is not None:
+            # parse the last parsed version again to continue
+            try:
+                prev = self._load_version(repo.commit(prev_id), path, dict())
+            except Exception as e:
+                LOGGER.exception('Failed to read %s at %s, history is rebuilt! %s' % (path, prev_id, e))
+                history, blobs, prev_id, start = CellHistory(path, self._key_cols), [], None, 0
+        for commit in commits[start:]:
+            idx = history.add_commit(commit)
+            blob = ExcelHistory._get_blob(commit, path)
+            blob_id = blob.hexsha if blob is not None else None
+            if blobs and blob_id == blobs[-1]:
+                blobs.append(blob_id)
+                continue
+            blobs.append(blob_id)
+            try:
+                cur = self._load_version(commit, path, prev) if blob is not None else dict()
+            except Exception as e:
+                LOGGER.exception('Failed to read %s at %s, skipped! %s' % (path, commit.hexsha, e))
+                continue
+            self._add_changes(history, idx, prev, cur)
+            prev = cur
+            prev_id = commit.hexsha if blob is not None else None
+        if p and len(commits) > start:
+            self._save_cache(p, (history, blobs, prev_id))
+        return history
+
+    @staticmethod
+    def _get_resume_idx(ids: [str], shas: [str]) -> int:
+        """
+        get num of commits to walk which are walked by cached history
+        the cached commits must end with the commits to walk up to the last cached one, older commits to walk
+        may drop out of the window of latest commits as new commits are added
+        :param ids: ids of cached commits, oldest first
+        :param shas: ids of commits to walk, oldest first
+        :return: idx of the first commit to walk, 0 if cached history can not be resumed
+        """
+        if not ids or ids[-1] not in shas:
+            return 0
+        n = shas.index(ids[-1]) + 1
+        return n if n <= len(ids) and ids[-n:] == shas[:n] else 0
+
+    @staticmethod
+    def _get_blob(commit, path: str):
+        try:
+            return commit.tree / path
+        except KeyError:
+            return None
+
+    def _load_version(self, commit, path: str, prev: dict) -> dict:
+        """
+        parse a version of the table, sheets with the same signature as previous version are reused
+        :param commit: git Commit Object
+        :param path: table path
+        :param prev: sheet name -> sheet version of previous version
+        :return: sheet name -> sheet version
+        """
+        d = self._differ
+        data = (commit.tree / path).data_stream.read()
+        name = '%s:%s' % (commit.hexsha, path)
+        versions = dict()
+        with d.open_workbook(name, util.md5_bytes(data) if d.cache is not None else '', data) as book:
+            for sheet_name in book.sheet_names():
+                sig = book.sheet_signature(sheet_name) if hasattr(book, 'sheet_signature') else None
+                p = prev.get(sheet_name)
+                if sig is not None and p is not None and p.signature == sig:
+                    versions[sheet_name] = p
+                    continue
+                s = book.sheet(sheet_name)
+                if not isinstance(s, CachedSheet):
+                    s = CachedSheet.from_sheet(s, d.header_row, d.start_row, d.start_col)
+                    ExcelDiffer.unload_sheet(book, sheet_name)
+                version = self._get_sheet_version(s, sig)
+                if version is not None:
+                    versions[sheet_name] = version
+        return versions
+
+    def _get_sheet_version(self, s: CachedSheet, signature):
+        """
+        get keyed rows of a sheet, rows with empty or duplicated key are skipped
+        :param s: parsed sheet
+        :param signature: sheet signature
+        :return: sheet version, None if any key col is missing
+        """
+        d = self._differ
+        headers = [str(v) for v in s.row_values(d.header_row, start_colx=d.start_col)]
+        key_indices = []
+        for k in self._key_cols:
+            if isinstance(k, int):
+                col = k - d.start_col - (1 if d.use_excel_indices else 0)
+            else:
+                col = headers.index(k) if k in headers else -1
+            if col < 0 or col >= len(headers):
+                LOGGER.warning('Sheet %s: key col %s is missing, skipped in history!' % (s.name, k))
+                return None
+            key_indices.append(col)
+        rows = dict()
+        for row in s.iter_rows(d.start_row, list(range(d.start_col, d.start_col + len(headers)))):
+            key = tuple([row[k] for k in key_indices])
+            if not any(key) or key in rows:
+                continue
+            rows[key] = tuple(row)
+        return _SheetVersion(signature, headers, rows)
+
+    @staticmethod
+    def _add_changes(history: CellHistory, idx: int, prev: dict, cur: dict) -> None:
+        """
+        add changed cells between versions to history
+        :param history: cell history
+        :param idx: commit idx of current version
+        :param prev: sheet name -> sheet version of previous version
+        :param cur: sheet name -> sheet version of current version
+        :return: None
+        """
+        empty = _SheetVersion(None, [], dict())
+        for sheet_name in sorted(set(prev.keys()) | set(cur.keys())):
+            v1, v2 = prev.get(sheet_name, empty), cur.get(sheet_name, empty)
+            if v1 is v2:
+                continue
+            # first col of the same name is tracked
+            cols1, cols2 = dict(), dict()
+            for j in range(len(v1.headers) - 1, -1, -1):
+                cols1[v1.headers[j]] = j
+            for j in range(len(v2.headers) - 1, -1, -1):
+                cols2[v2.headers[j]] = j
+            same_cols = v1.headers == v2.headers
+            for key, row2 in v2.rows.items():
+                row1 = v1.rows.get(key)
+                if row1 is not None and same_cols:
+                    if row1 == row2:
+                        continue
+                    for j in range(len(row2)):
+                        if row1[j] != row2[j] and cols2[v2.headers[j]] == j:
+                            history.add_change(idx, sheet_name, key, v2.headers[j], row2[j])
+                    continue
+                for col, j in cols2.items():
+                    j1 = cols1.get(col, -1) if row1 is not None else -1
+                    if j1 < 0 or row1[j1] != row2[j]:
+                        history.add_change(idx, sheet_name, key, col, row2[j])
+                if row1 is not None:
+                    for col in cols1.keys():
+                        if col not in cols2:
+                            history.add_change(idx, sheet_name, key, col, None)
+            for key in v1.rows.keys():
+                if key not in v2.rows:
+                    for col in cols1.keys():
+                        history.add_change(idx, sheet_name, key, col, None)
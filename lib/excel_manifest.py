@@ -0,0 +1,231 @@
+import json
+import logger
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from util import md5_file
+
+LOGGER = logger.get_logger('EXCEL_MANIFEST')
+
+"""
+Manifest of excel files in a directory tree
+files: relative path -> (size, mtime in ns, content hash, empty if not hashed)
+dirs: relative path ('' for root) -> (mtime in ns, excel file names, sub dir names)
+"""
+
+EXCEL_EXTENSIONS = ['xls', 'xlsx']
+LOCK_PREFIX = '~$'
+
+
+class ExcelManifest:
+    """
+    manifest of excel files, scanned by os.scandir, optionally across threads
+    manifests can be saved, loaded and compared with the previous run,
+    and content hashes of unchanged files (same size and mtime) are reused from the previous manifest
+    """
+    def __init__(self, root: str, files: dict = None, dirs: dict = None):
+        """
+        :param root: root directory
+        :param files: relative path -> (size, mtime in ns, content hash)
+        :param dirs: relative path -> (mtime in ns, excel file names, sub dir names)
+        """
+        self.root = root
+        self._files = files if files is not None else dict()
+        self._dirs = dirs if dirs is not None else dict()
+
+    @staticmethod
+    def is_excel_file(name: str) -> bool:
+        """
+        check if a file name is an excel file, office lock files are excluded
+        :param name: file name
+        :return: if it is an excel file
+        """
+        _, f_ext = os.path.splitext(name)
+        return f_ext.replace('.', '') in EXCEL_EXTENSIONS and not name.startswith(LOCK_PREFIX)
+
+    @staticmethod
+    def scan(root: str, workers: int = 1, hash_files: bool = False, previous=None,
+             trust_dir_mtime: bool = False):
+        """
+        scan excel files recursively
+        :param root: root directory
+        :param workers: num of threads to scan directories and hash files with, helps on network mounted trees
+        :param hash_files: calculate content hashes (md5) of files
+        :param previous: manifest of previous run, hashes of files with the same size and mtime are reused
+        :param trust_dir_mtime: reuse file list and stats of a directory in previous manifest if its mtime
+            did not change, sub dirs are still checked. a directory mtime only changes if entries are added,
+            removed or renamed, so only enable it if files are replaced on save (as excel and git do),
+            not modified in place
+        :return: manifest
+        """
+        manifest = ExcelManifest(root)
+        if not os.path.isdir(root):
+            return manifest
+        if previous is not None and previous.root != root:
+            # relative paths are still comparable, e.g. a moved checkout
+            LOGGER.debug('Previous manifest root changed: %s -> %s' % (previous.root, root))
+        if workers <= 1:
+            pending = ['']
+            while pending:
+                rel = pending.pop()
+                pending.extend(manifest._scan_dir(rel, hash_files, previous, trust_dir_mtime))
+            return manifest
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(manifest._scan_dir, '', hash_files, previous, trust_dir_mtime)}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for rel in future.result():
+                        futures.add(executor.submit(manifest._scan_dir, rel, hash_files, previous, trust_dir_mtime))
+        return manifest
+
+    def _scan_dir(self, rel: str, hash_files: bool, previous, trust_dir_mtime: bool) -> [str]:
+        """
+        scan excel files of a directory, may run in threads, entries of different dirs never conflict
+        :param rel: relative path of directory
+        :param hash_files: calculate content hashes
+        :param previous: previous manifest
+        :param trust_dir_mtime: reuse entries of directory if its mtime did not change
+        :return: relative paths of sub dirs
+        """
+        d = os.path.join(self.root, rel) if rel else self.root
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except OSError as e:
+            LOGGER.warning('Failed to stat directory %s! %s' % (d, e))
+            return []
+        prev_dir = previous.get_dir(rel) if previous is not None else None
+        prev_files = None
+        if trust_dir_mtime and prev_dir is not None and prev_dir[0] == mtime:
+            prev_files = [(name, previous.get(os.path.join(rel, name) if rel else name)) for name in prev_dir[1]]
+            if not all(e is not None for _, e in prev_files):
+                prev_files = None
+        if prev_files is not None:
+            files, dirs = prev_dir[1], prev_dir[2]
+            for name, entry in prev_files:
+                if hash_files and not entry[2]:
+                    entry = (entry[0], entry[1], md5_file(os.path.join(d, name)))
+                self._files[os.path.join(rel, name) if rel else name] = entry
+        else:
+            files, dirs = [], []
+            try:
+                with os.scandir(d) as it:
+                    for e in it:
+                        if e.name.startswith(LOCK_PREFIX):
+                            continue
+                        try:
+                            if e.is_file():
+                                if ExcelManifest.is_excel_file(e.name):
+                                    st = e.stat()
+                                    files.append((e.name, st.st_size, st.st_mtime_ns))
+                            elif e.is_dir():
+                                dirs.append(e.name)
+                        except OSError as err:
+                            # e.g. removed while scanning
+                            LOGGER.warning('Failed to stat %s! %s' % (e.path, err))
+            except OSError as e:
+                LOGGER.warning('Failed to scan directory %s! %s' % (d, e))
+                return []
+            for name, size, file_mtime in files:
+                p = os.path.join(rel, name) if rel else name
+                file_hash = ''
+                if hash_files:
+                    entry = previous.get(p) if previous is not None else None
+                    if entry is not None and entry[0] == size and entry[1] == file_mtime and entry[2]:
+                        file_hash = entry[2]
+                    else:
+                        file_hash = md5_file(os.path.join(d, name))
+                self._files[p] = (size, file_mtime, file_hash)
+            files = [f[0] for f in files]
+        self._dirs[rel] = (mtime, files, dirs)
+        return [os.path.join(rel, name) if rel else name for name in dirs]
+
+    def files(self) -> set:
+        """
+        get relative paths of excel files
+        :return: set of relative paths
+        """
+        return set(self._files.keys())
+
+    def get(self, path: str):
+        """
+        get entry of a file
+        :param path: relative path
+        :return: (size, mtime in ns, content hash), None if not existed
+        """
+        return self._files.get(path)
+
+    def get_dir(self, path: str):
+        """
+        get entry of a directory
+        :param path: relative path, '' for root
+        :return: (mtime in ns, excel file names, sub dir names), None if not existed
+        """
+        return self._dirs.get(path)
+
+    def is_same_file(self, path: str, other, path2: str = None) -> bool:
+        """
+        check if a file is identical to a file in another manifest, by known hashes only
+        :param path: relative path
+        :param other: another manifest
+        :param path2: relative path in other manifest, same as path if None
+        :return: True if both are hashed and hashes are equal
+        """
+        e1 = self.get(path)
+        e2 = other.get(path if path2 is None else path2)
+        return e1 is not None and e2 is not None and e1[0] == e2[0] and bool(e1[2]) and e1[2] == e2[2]
+
+    def compare(self, previous) -> (list, list, list):
+        """
+        compare with manifest of previous run
+        files are modified if sizes or hashes differ, or mtimes differ when either is not hashed
+        :param previous: previous manifest
+        :return: removed, modified, added relative paths, sorted
+        """
+        removed, modified, added = [], [], []
+        for p, e in self._files.items():
+            prev = previous.get(p)
+            if prev is None:
+                added.append(p)
+            elif prev[0] != e[0]:
+                modified.append(p)
+            elif prev[2] and e[2]:
+                if prev[2] != e[2]:
+                    modified.append(p)
+            elif prev[1] != e[1]:
+                modified.append(p)
+        for p in previous.files():
+            if p not in self._files:
+                removed.append(p)
+        removed.sort()
+        modified.sort()
+        added.sort()
+        return removed, modified, added
+
+    def save(self, path: str) -> None:
+        """
+        save manifest as json
+        :param path: file path
+        :return: None
+        """
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({
+                'root': self.root,
+                'files': self._files,
+                'dirs': self._dirs,
+            }, ensure_ascii=False))
+
+    @staticmethod
+    def load(path: str):
+        """
+        load manifest saved by save
+        :param path: file path
+        :return: manifest
+        """
+        with open(path, encoding='utf-8') as f:
+            d = json.load(f)
+        files = dict([(p, tuple(e)) for p, e in d['files'].items()])
+        dirs = dict([(p, tuple(e)) for p, e in d['dirs'].items()])
+        return ExcelManifest(d['root'], files, dirs)
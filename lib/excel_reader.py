@@ -0,0 +1,549 @@
+import hashlib
+import io
+import logger
+import os
+import posixpath
+import re
+import zipfile
+import struct
+import xlrd
+from xml.etree import ElementTree
+
+LOGGER = logger.get_logger('EXCEL_READER')
+
+# same as error_text_from_code of xlrd
+ERROR_CODES = {
+    '#NULL!': 0x00,
+    '#DIV/0!': 0x07,
+    '#VALUE!': 0x0F,
+    '#REF!': 0x17,
+    '#NAME?': 0x1D,
+    '#NUM!': 0x24,
+    '#N/A': 0x2A,
+}
+XML_WHITESPACE = '\t\n \r'
+XML_SPACE_ATTR = '{http://www.w3.org/XML/1998/namespace}space'
+REL_OFFICE_DOCUMENT = '/officeDocument'
+REL_WORKSHEET = '/worksheet'
+REL_SHARED_STRINGS = '/sharedStrings'
+# biff record types
+BIFF_BOF_CODES = (0x0009, 0x0209, 0x0409, 0x0809)
+BIFF_EOF = 0x000A
+BIFF_LABELSST = 0x00FD
+BIFF_INDEX = 0x020B
+BIFF_HEADER = struct.Struct('<HH')
+BIFF_SST_INDEX = struct.Struct('<I')
+
+
+def _tag(elem) -> str:
+    """
+    get tag name without namespace, both transitional and strict ooxml are supported
+    :param elem: xml element
+    :return: local tag name
+    """
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def _unescape(s: str, subber=re.compile(r'_x[0-9A-Fa-f]{4}_').sub) -> str:
+    """
+    unescape _xHHHH_ in xlsx text
+    :param s: text
+    :return: unescaped text
+    """
+    if '_' in s:
+        return subber(lambda m: chr(int(m.group(0)[2:6], 16)), s)
+    return s
+
+
+def _text(elem) -> str:
+    """
+    get text of <t> or <v> element as xlrd does
+    :param elem: xml element
+    :return: text
+    """
+    t = elem.text
+    if t is None:
+        return ''
+    if elem.get(XML_SPACE_ATTR) != 'preserve':
+        t = t.strip(XML_WHITESPACE)
+    return _unescape(t)
+
+
+def _rich_text(elem) -> str:
+    """
+    get text of <si> or <is> element, phonetic runs are excluded
+    :param elem: xml element
+    :return: text
+    """
+    accum = []
+    for child in elem:
+        tag = _tag(child)
+        if tag == 't':
+            accum.append(_text(child))
+        elif tag == 'r':
+            for t in child:
+                if _tag(t) == 't':
+                    accum.append(_text(t))
+    return ''.join(accum)
+
+
+def _col_idx(cell_name: str) -> int:
+    """
+    get col idx from cell name, A1 -> 0, AA3 -> 26
+    :param cell_name: cell name
+    :return: col idx
+    """
+    col = 0
+    for c in cell_name:
+        if 'A' <= c <= 'Z':
+            col = col * 26 + ord(c) - 64
+        elif c != '$':
+            break
+    return col - 1
+
+
+class XlrdSheet:
+    """
+    sheet reader based on xlrd sheet
+    """
+    def __init__(self, sheet: xlrd.sheet.Sheet):
+        self._sheet = sheet
+
+    @property
+    def name(self) -> str:
+        return self._sheet.name
+
+    def row_values(self, rowx: int, start_colx: int = 0) -> list:
+        """
+        get values of a row
+        :param rowx: row idx
+        :param start_colx: start col idx
+        :return: cell values
+        """
+        return self._sheet.row_values(rowx, start_colx=start_colx)
+
+    def iter_rows(self, start_rowx: int, colxs: [int]):
+        """
+        iterate rows from start row, only values of specific cols are read
+        :param start_rowx: start row idx
+        :param colxs: col indices
+        :return: generator of stringified cell values
+        """
+        for i in range(start_rowx, self._sheet.nrows):
+            yield [str(self._sheet.cell_value(i, c)) for c in colxs]
+
+
+def _hash_biff_sheet(mem, pos: int, sst: [str]) -> str:
+    """
+    hash records of a sheet substream without decoding cells
+    shared string indices of LABELSST records are replaced by the strings, so that the hash does not change
+    if only other sheets added shared strings, and INDEX records are skipped as they hold absolute stream offsets
+    :param mem: workbook stream
+    :param pos: position of BOF record of the sheet
+    :param sst: shared strings
+    :return: md5 hex digest, None if the substream is malformed
+    """
+    hl = hashlib.md5()
+    end = len(mem)
+    chunk = pos
+    depth = 0
+    while pos + 4 <= end:
+        code, length = BIFF_HEADER.unpack_from(mem, pos)
+        nxt = pos + 4 + length
+        if code in BIFF_BOF_CODES:
+            depth += 1
+        elif code == BIFF_EOF:
+            depth -= 1
+            if depth <= 0:
+                hl.update(mem[chunk:nxt])
+                return hl.hexdigest()
+        elif code == BIFF_LABELSST and length >= 10:
+            # row, col, xf, then sst index
+            hl.update(mem[chunk:pos + 10])
+            idx = BIFF_SST_INDEX.unpack_from(mem, pos + 10)[0]
+            hl.update(sst[idx].encode('utf-8') if idx < len(sst) else b'\xff')
+            chunk = nxt
+        elif code == BIFF_INDEX:
+            hl.update(mem[chunk:pos])
+            chunk = nxt
+        pos = nxt
+    return None
+
+
+class XlrdWorkbook:
+    """
+    workbook reader based on xlrd, used for legacy .xls
+    sheets are loaded on demand, so that only sheets read by sheet are decoded, release them by unload_sheet
+    """
+    def __init__(self, path: str, data: bytes = None):
+        """
+        :param path: file path
+        :param data: file content, read from memory instead of path if specified
+        """
+        self._book = xlrd.open_workbook(path, file_contents=data, on_demand=True)
+        self._signatures = dict()
+
+    def sheet_names(self) -> [str]:
+        return self._book.sheet_names()
+
+    def sheet_signature(self, name: str):
+        """
+        get signature of sheet data by hashing its raw record substream, no cell is decoded
+        only available for biff8 (excel 97 and later) workbooks, in which strings are kept in the shared strings,
+        and for xlrd versions keeping the workbook stream and sheet offsets
+        :param name: sheet name
+        :return: md5 hex digest, None if not available
+        """
+        if name not in self._signatures:
+            sig = None
+            book = self._book
+            # private fields of xlrd, no signature if missing in other xlrd versions
+            positions = getattr(book, '_sh_abs_posn', None)
+            sst = getattr(book, '_sharedstrings', None)
+            released = getattr(book, '_resources_released', None)
+            mem = getattr(book, 'mem', None)
+            try:
+                if None not in (positions, sst, released, mem) and not released \
+                        and getattr(book, 'biff_version', 0) >= 80:
+                    pos = positions[book.sheet_names().index(name)]
+                    if pos >= 0:
+                        sig = _hash_biff_sheet(mem, pos, sst)
+            except Exception as e:
+                LOGGER.warning('Failed to get signature of sheet %s! %s' % (name, e))
+            self._signatures[name] = sig
+        return self._signatures[name]
+
+    def sheet(self, name: str) -> XlrdSheet:
+        return XlrdSheet(self._book.sheet_by_name(name))
+
+    def unload_sheet(self, name: str) -> None:
+        """
+        release a loaded sheet, it is loaded again if read later
+        :param name: sheet name
+        :return: None
+        """
+        self._book.unload_sheet(name)
+
+    def close(self):
+        self._book.release_resources()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class XlsxSheet:
+    """
+    streaming sheet reader of xlsx, rows are parsed from sheet xml one by one,
+    values are converted as xlrd does (numbers as float, booleans and errors as int)
+    """
+    def __init__(self, book, name: str, part: str):
+        self._book = book
+        self._name = name
+        self._part = part
+        # (nrows, ncols), scanned on first use
+        self._dims = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def _iter_row_elems(self):
+        """
+        iterate <row> elements of sheet xml, parsed rows are released after yielded
+        :return: generator of (row idx, row element)
+        """
+        rowx = -1
+        sheet_data = None
+        with self._book.open_part(self._part) as f:
+            for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+                tag = _tag(elem)
+                if event == 'start':
+                    if tag == 'sheetData':
+                        sheet_data = elem
+                    continue
+                if tag != 'row':
+                    continue
+                r = elem.get('r')
+                rowx = int(r) - 1 if r is not None else rowx + 1
+                yield rowx, elem
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+    def _iter_cells(self, colxs=None):
+        """
+        iterate cells of rows containing any value, blank cells are skipped as xlrd does
+        :param colxs: col indices to read values, all cols if None
+        :return: generator of (row idx, {col idx: value}, last col idx with value)
+        """
+        for rowx, row in self._iter_row_elems():
+            cells = dict()
+            has_value = False
+            last_colx = -1
+            colx = -1
+            for c in row:
+                r = c.get('r')
+                colx = _col_idx(r) if r is not None else colx + 1
+                t = c.get('t', 'n')
+                v = None
+                for child in c:
+                    tag = _tag(child)
+                    if tag == 'v' or tag == 'is':
+                        v = child
+                if t in ('n', 's') and (v is None or not v.text):
+                    continue
+                if t == 'inlineStr' and (v is None or not self._cell_value(t, v)):
+                    continue
+                has_value = True
+                last_colx = max(last_colx, colx)
+                if colxs is not None and colx not in colxs:
+                    continue
+                cells[colx] = self._cell_value(t, v)
+            if has_value:
+                yield rowx, cells, last_colx
+
+    def _cell_value(self, t: str, v):
+        """
+        convert cell value as xlrd does
+        :param t: cell type
+        :param v: <v> or <is> element
+        :return: cell value
+        """
+        if t == 'n':
+            return float(v.text)
+        if t == 's':
+            return self._book.shared_strings()[int(v.text)]
+        if t == 'str':
+            # formula cell without cached value
+            return _text(v) if v is not None else ''
+        if t == 'b':
+            return 1 if v is not None and v.text in ('1', 'true', 'on') else 0
+        if t == 'e':
+            return ERROR_CODES.get(v.text if v is not None else '#N/A', ERROR_CODES['#N/A'])
+        if t == 'inlineStr':
+            return _rich_text(v) if _tag(v) == 'is' else (v.text or '')
+        return _text(v) if v is not None else ''
+
+    @property
+    def nrows(self) -> int:
+        return self._get_dims()[0]
+
+    @property
+    def ncols(self) -> int:
+        return self._get_dims()[1]
+
+    def _get_dims(self) -> (int, int):
+        """
+        get num of rows and cols as xlrd does, by the last row and col with value
+        the whole sheet is scanned on first call, values are not converted
+        :return: (nrows, ncols)
+        """
+        if self._dims is None:
+            nrows, ncols = 0, 0
+            for rowx, _, last_colx in self._iter_cells(set()):
+                nrows = rowx + 1
+                ncols = max(ncols, last_colx + 1)
+            self._dims = (nrows, ncols)
+        return self._dims
+
+    def row_values(self, rowx: int, start_colx: int = 0) -> list:
+        """
+        get values of a row, padded to num of cols of the sheet as xlrd does
+        :param rowx: row idx
+        :param start_colx: start col idx
+        :return: cell values, empty if the row is out of sheet
+        """
+        nrows, ncols = self._get_dims()
+        if rowx >= nrows:
+            return []
+        for i, cells, _ in self._iter_cells():
+            if i < rowx:
+                continue
+            if i > rowx:
+                break
+            return [cells.get(c, '') for c in range(start_colx, ncols)]
+        return [''] * max(ncols - start_colx, 0)
+
+    def iter_rows(self, start_rowx: int, colxs: [int]):
+        """
+        iterate rows from start row, only values of specific cols are read
+        :param start_rowx: start row idx
+        :param colxs: col indices
+        :return: generator of stringified cell values
+        """
+        next_rowx = start_rowx
+        for rowx, cells, _ in self._iter_cells(set(colxs)):
+            if rowx < start_rowx:
+                continue
+            while next_rowx < rowx:
+                yield [''] * len(colxs)
+                next_rowx += 1
+            yield [str(cells[c]) if c in cells else '' for c in colxs]
+            next_rowx = rowx + 1
+
+
+class XlsxWorkbook:
+    """
+    streaming workbook reader of xlsx
+    only workbook structure is parsed on open, shared strings are parsed on the first read of sheet data
+    """
+    def __init__(self, path: str, data: bytes = None):
+        """
+        :param path: file path
+        :param data: file content, read from memory instead of path if specified
+        """
+        self._zip = zipfile.ZipFile(io.BytesIO(data) if data is not None else path)
+        self._parts = dict([(n.lower(), n) for n in self._zip.namelist()])
+        self._sheet_parts = dict()
+        self._sst_part = ''
+        self._sst = None
+        self._load_workbook()
+
+    def open_part(self, part: str):
+        """
+        open a part of the xlsx package
+        :param part: part name
+        :return: file object
+        """
+        return self._zip.open(self._parts[part.lower()])
+
+    def _load_rels(self, part: str) -> dict:
+        """
+        load relationships of a part
+        :param part: part name
+        :return: {id: (type, target part name)}
+        """
+        d, f = posixpath.split(part)
+        rels_part = posixpath.join(d, '_rels', f + '.rels')
+        rels = dict()
+        if rels_part.lower() not in self._parts:
+            return rels
+        with self.open_part(rels_part) as fp:
+            for elem in ElementTree.parse(fp).getroot():
+                target = elem.get('Target', '')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join(d, target))
+                rels[elem.get('Id')] = (elem.get('Type', ''), target)
+        return rels
+
+    def _load_workbook(self) -> None:
+        """
+        load worksheet names and parts in workbook order, and the shared strings part
+        :return: None
+        """
+        wb_part = 'xl/workbook.xml'
+        for rel_type, target in self._load_rels('').values():
+            if rel_type.endswith(REL_OFFICE_DOCUMENT):
+                wb_part = target
+        rels = self._load_rels(wb_part)
+        for rel_type, target in rels.values():
+            if rel_type.endswith(REL_SHARED_STRINGS):
+                self._sst_part = target
+        with self.open_part(wb_part) as fp:
+            for elem in ElementTree.parse(fp).iter():
+                if _tag(elem) != 'sheet':
+                    continue
+                # r:id is the only namespaced attribute of <sheet>
+                rids = [v for k, v in elem.attrib.items() if k.startswith('{') and k.endswith('}id')]
+                if len(rids) == 0 or rids[0] not in rels:
+                    continue
+                rel_type, target = rels[rids[0]]
+                if rel_type.endswith(REL_WORKSHEET):
+                    self._sheet_parts[elem.get('name')] = target
+
+    def shared_strings(self) -> [str]:
+        """
+        get shared strings, parsed on first call
+        :return: shared strings
+        """
+        if self._sst is not None:
+            return self._sst
+        self._sst = []
+        if self._sst_part.lower() not in self._parts:
+            return self._sst
+        with self.open_part(self._sst_part) as fp:
+            for _, elem in ElementTree.iterparse(fp):
+                if _tag(elem) == 'si':
+                    self._sst.append(_rich_text(elem))
+                    elem.clear()
+        return self._sst
+
+    def sheet_names(self) -> [str]:
+        return list(self._sheet_parts.keys())
+
+    def sheet_signature(self, name: str):
+        """
+        get signature of sheet data from the zip central directory, nothing is decompressed
+        values of a sheet are unchanged if both its sheet part and the shared strings part are unchanged
+        :param name: sheet name
+        :return: (crc, size) of sheet part and shared strings part
+        """
+        sig = []
+        for part in [self._sheet_parts[name], self._sst_part]:
+            if part.lower() in self._parts:
+                info = self._zip.getinfo(self._parts[part.lower()])
+                sig.append((info.CRC, info.file_size))
+            else:
+                sig.append(None)
+        return tuple(sig)
+
+    def sheet(self, name: str) -> XlsxSheet:
+        if name not in self._sheet_parts:
+            raise KeyError('No sheet named <%r>' % name)
+        return XlsxSheet(self, name, self._sheet_parts[name])
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+READERS = {
+    'xls': XlrdWorkbook,
+    'xlsx': XlsxWorkbook,
+}
+
+
+def get_reader(path: str, readers: dict = None):
+    """
+    get the reader registered for extension of a file, xlrd is used for unknown extensions
+    :param path: file path
+    :param readers: extension -> workbook reader class, overriding default READERS
+    :return: workbook reader class
+    """
+    _, ext = os.path.splitext(path)
+    ext = ext.replace('.', '').lower()
+    return (readers or {}).get(ext, READERS.get(ext, XlrdWorkbook))
+
+
+def get_reader_name(path: str, readers: dict = None) -> str:
+    """
+    get full name of the reader of a file, e.g. to key parsed data by reader
+    :param path: file path
+    :param readers: extension -> workbook reader class
+    :return: module and qualified name of reader class
+    """
+    reader = get_reader(path, readers)
+    return '%s.%s' % (reader.__module__, reader.__qualname__)
+
+
+def open_workbook(path: str, readers: dict = None, data: bytes = None):
+    """
+    open workbook with the reader registered for its extension, xlrd is used for unknown extensions
+    :param path: file path
+    :param readers: extension -> workbook reader class, overriding default READERS
+    :param data: file content in memory, passed to reader as the second arg if specified
+    :return: workbook reader
+    """
+    reader = get_reader(path, readers)
+    if data is not None:
+        return reader(path, data)
+    return reader(path)
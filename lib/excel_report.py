@@ -0,0 +1,118 @@
+import json
+import logger
+import shutil
+
+LOGGER = logger.get_logger('EXCEL_REPORT')
+
+"""
+Streaming excel diff report as newline-delimited json, one event per line:
+{"event": "report", "added_files": [...], "removed_files": [...]}
+{"event": "cell", "file": file name, "sheet": sheet name, src_row, dest_row, src_col, dest_col, src_val, dest_val}
+{"event": "sheet", "file": file name, "name": sheet name, added_cols, removed_cols, modified_data (no modified_cells)}
+{"event": "file", "name": file name, added_sheets, removed_sheets}
+{"event": "error", "file": file name, "message": error message}
+cells of a sheet are written before the sheet, and sheets of a file are written before the file
+"""
+
+
+class ReportWriter:
+    """
+    streaming report writer, writes report events as newline-delimited json
+    """
+    def __init__(self, fp, **tags):
+        """
+        :param fp: text file object to write
+        :param tags: fields written with every event, e.g. file and sheet
+        """
+        self._fp = fp
+        self._tags = tags
+
+    @property
+    def tags(self) -> dict:
+        return dict(self._tags)
+
+    def scope(self, **tags):
+        """
+        get a writer sharing the file object with more tags
+        :param tags: more tags
+        :return: report writer
+        """
+        return ReportWriter(self._fp, **dict(self._tags, **tags))
+
+    def write(self, event: str, **fields) -> None:
+        """
+        write an event
+        :param event: event type
+        :param fields: event fields
+        :return: None
+        """
+        e = dict(event=event)
+        e.update(self._tags)
+        e.update(fields)
+        self._fp.write(json.dumps(e, ensure_ascii=False))
+        self._fp.write('\n')
+
+    def write_part(self, path: str) -> None:
+        """
+        append events in a part file written by another writer
+        :param path: path of part file
+        :return: None
+        """
+        with open(path, encoding='utf-8') as f:
+            shutil.copyfileobj(f, self._fp)
+
+
+def read_report(fp) -> dict:
+    """
+    rebuild the nested report (see ExcelDiffer.get_diff_report) from report events
+    cells and sheets of files failed to diff are dropped
+    :param fp: text file object to read
+    :return: report dict, same as the json loaded report of get_diff_report
+    """
+    report = {
+        'added_files': [],
+        'removed_files': [],
+        'modified_files': [],
+        'errors': [],
+    }
+    cells = dict()
+    sheets = dict()
+    for line in fp:
+        line = line.strip()
+        if not line:
+            continue
+        e = json.loads(line)
+        event = e.pop('event')
+        if event == 'report':
+            report['added_files'] = e['added_files']
+            report['removed_files'] = e['removed_files']
+        elif event == 'cell':
+            key = (e.pop('file'), e.pop('sheet'))
+            if key not in cells:
+                cells[key] = list()
+            cells[key].append(e)
+        elif event == 'sheet':
+            f = e.pop('file')
+            sheet_cells = cells.pop((f, e['name']), [])
+            if e['modified_data']:
+                e['modified_data']['modified_cells'] = sheet_cells
+            if f not in sheets:
+                sheets[f] = list()
+            sheets[f].append(e)
+        elif event == 'file':
+            f = e['name']
+            report['modified_files'].append({
+                'added_sheets': e['added_sheets'],
+                'removed_sheets': e['removed_sheets'],
+                'modified_sheets': sheets.pop(f, []),
+                'name': f,
+            })
+        elif event == 'error':
+            f = e.get('file')
+            sheets.pop(f, None)
+            for key in [k for k in cells.keys() if k[0] == f]:
+                cells.pop(key)
+            report['errors'].append(e['message'])
+        else:
+            LOGGER.warning('Unknown report event: %s' % event)
+    return report
@@ -0,0 +1,164 @@
+import hashlib
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # optional, cells are compared in pure python without it
+    numpy = None
+
+"""
+Compact row storage for excel diff
+"""
+
+FINGERPRINT_SIZE = 16
+
+
+class ValuePool:
+    """
+    pool of interned cell values, each distinct value has an int id, '' is always 0
+    matrices compared with each other must share the same pool,
+    so that cells are equal if and only if their ids are equal
+    """
+    def __init__(self):
+        self.values = ['']
+        self._ids = {'': 0}
+
+    def get_id(self, value: str) -> int:
+        """
+        get id of value, add it to pool if not existed
+        :param value: cell value
+        :return: value id
+        """
+        i = self._ids.get(value)
+        if i is None:
+            i = len(self.values)
+            self._ids[value] = i
+            self.values.append(value)
+        return i
+
+    def __len__(self):
+        return len(self.values)
+
+
+class LayeredValuePool(ValuePool):
+    """
+    pool layered on a base pool, values not in the base pool are added to this pool only,
+    so that a base pool shared by many diffs does not grow with each of them
+    the base pool must not grow while it is layered
+    """
+    def __init__(self, base: ValuePool):
+        """
+        :param base: base pool
+        """
+        self.values = list(base.values)
+        self._base_ids = base._ids
+        self._ids = dict()
+
+    def get_id(self, value: str) -> int:
+        i = self._base_ids.get(value)
+        if i is None:
+            i = self._ids.get(value)
+            if i is None:
+                i = len(self.values)
+                self._ids[value] = i
+                self.values.append(value)
+        return i
+
+
+class RowMatrix:
+    """
+    row matrix of stringified cell values, stored as a flat array of value ids
+    rows are fingerprinted as 128-bit digests of their value ids
+    indexes derived from rows can be memoized in memo, which is cleared once a row is appended
+    """
+    def __init__(self, pool: ValuePool, ncols: int):
+        """
+        :param pool: value pool shared with matrices to compare
+        :param ncols: num of cols
+        """
+        self.pool = pool
+        self.ncols = ncols
+        self._ids = array('I')
+        self._nrows = 0
+        self.memo = dict()
+
+    @staticmethod
+    def from_rows(pool: ValuePool, rows, ncols: int = -1):
+        """
+        build matrix from rows
+        :param pool: value pool
+        :param rows: iterable of rows of stringified values
+        :param ncols: num of cols, length of the first row if < 0
+        :return: row matrix
+        """
+        m = None
+        for row in rows:
+            if m is None:
+                m = RowMatrix(pool, ncols if ncols >= 0 else len(row))
+            m.append(row)
+        return m if m is not None else RowMatrix(pool, max(ncols, 0))
+
+    def append(self, row: [str]) -> None:
+        """
+        append a row, values out of ncols are dropped and missing values are ''
+        :param row: stringified values
+        :return: None
+        """
+        get_id = self.pool.get_id
+        ids = [get_id(row[j]) if j < len(row) else 0 for j in range(self.ncols)]
+        self._ids.extend(ids)
+        self._nrows += 1
+        if self.memo:
+            self.memo = dict()
+
+    def __len__(self):
+        return self._nrows
+
+    def __getitem__(self, i: int) -> [str]:
+        values = self.pool.values
+        return [values[v] for v in self.ids(i)]
+
+    def ids(self, i: int) -> array:
+        """
+        get value ids of a row
+        :param i: row idx
+        :return: array of value ids
+        """
+        if i < 0 or i >= self._nrows:
+            raise IndexError('row index out of range')
+        return self._ids[i * self.ncols:(i + 1) * self.ncols]
+
+    def id_at(self, i: int, j: int) -> int:
+        """
+        get value id of a cell
+        :param i: row idx
+        :param j: col idx
+        :return: value id
+        """
+        if j < 0 or j >= self.ncols:
+            raise IndexError('col index out of range')
+        return self._ids[i * self.ncols + j]
+
+    def value(self, i: int, j: int) -> str:
+        return self.pool.values[self.id_at(i, j)]
+
+    def to_array(self):
+        """
+        get value ids as a 2-D numpy array sharing memory with the matrix, no copy is made
+        rows can not be appended while the array is alive, as resizing an exported buffer raises BufferError
+        :return: numpy array of shape (nrows, ncols), None if numpy is not installed
+        """
+        if numpy is None:
+            return None
+        a = numpy.frombuffer(self._ids, dtype=numpy.uint32) if len(self._ids) > 0 \
+            else numpy.zeros(0, dtype=numpy.uint32)
+        return a.reshape(self._nrows, self.ncols)
+
+    def fingerprint(self, i: int) -> bytes:
+        """
+        get fingerprint of a row, a 128-bit blake2b digest of its value ids
+        :param i: row idx
+        :return: digest bytes
+        """
+        return hashlib.blake2b(self.ids(i).tobytes(), digest_size=FINGERPRINT_SIZE).digest()
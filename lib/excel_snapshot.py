@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from lib.excel_cache import CachedSheet
+from lib.excel_rows import RowMatrix, ValuePool
+
+"""
+Parsed snapshots of baseline workbooks, shared by diffs against many targets
+"""
+
+# max num of memoized matrices (col mappings) of a sheet, least recently used ones are dropped
+MAX_MATRICES = 4
+
+
+class SheetSnapshot:
+    """
+    parsed sheet, offering the same apis as readers in excel_reader
+    matrices of data are memoized by cols, so that row fingerprints and key indexes memoized on them
+    (see RowMatrix.memo) are reused by every target with the same col mapping
+    values of targets must be kept in pools layered on the pool of snapshot (see LayeredValuePool),
+    so that the pool only holds values of the snapshot
+    """
+    def __init__(self, sheet: CachedSheet):
+        """
+        :param sheet: parsed sheet
+        """
+        self.name = sheet.name
+        self.pool = ValuePool()
+        self._sheet = sheet
+        self._matrices = OrderedDict()
+
+    def row_values(self, rowx: int, start_colx: int = 0) -> list:
+        return self._sheet.row_values(rowx, start_colx)
+
+    def iter_rows(self, start_rowx: int, colxs: [int]):
+        return self._sheet.iter_rows(start_rowx, colxs)
+
+    def matrix(self, start_rowx: int, colxs: [int]) -> RowMatrix:
+        """
+        get memoized matrix of data, dest data compared with it must use a pool layered on the same pool
+        :param start_rowx: start row idx
+        :param colxs: col indices
+        :return: row matrix
+        """
+        key = (start_rowx, tuple(colxs))
+        m = self._matrices.pop(key, None)
+        if m is None:
+            m = RowMatrix.from_rows(self.pool, self._sheet.iter_rows(start_rowx, colxs), len(colxs))
+        self._matrices[key] = m
+        while len(self._matrices) > MAX_MATRICES:
+            self._matrices.popitem(last=False)
+        return m
+
+
+class WorkbookSnapshot:
+    """
+    baseline workbook, offering the same apis as workbook readers in excel_reader
+    the real workbook is opened on first use, and sheets are parsed once on first use
+    unloaded snapshots can not be pickled to worker processes, see load
+    """
+    def __init__(self, path: str, size: int, open_book: callable, header_row: int, start_row: int, start_col: int):
+        """
+        :param path: file path
+        :param size: file size
+        :param open_book: function to open the real workbook reader
+        :param header_row: header row
+        :param start_row: start row of data
+        :param start_col: start col of data
+        """
+        self.path = path
+        self.size = size
+        # content hash, calculated by differ if needed
+        self.file_hash = ''
+        self._open_book = open_book
+        self._header_row = header_row
+        self._start_row = start_row
+        self._start_col = start_col
+        self._book = None
+        self._names = None
+        self._sheets = dict()
+
+    def _get_book(self):
+        if self._book is None:
+            if self._open_book is None:
+                raise ValueError('Workbook %s is not loaded in snapshot!' % self.path)
+            self._book = self._open_book()
+        return self._book
+
+    def _get_names(self):
+        """
+        get sheet names and signatures of sheets
+        :return: sheet names, sheet name -> signature
+        """
+        if self._names is None:
+            book = self._get_book()
+            sheet_names = book.sheet_names()
+            signatures = dict()
+            if hasattr(book, 'sheet_signature'):
+                signatures = dict([(n, book.sheet_signature(n)) for n in sheet_names])
+            self._names = (sheet_names, signatures)
+        return self._names
+
+    def sheet_names(self) -> [str]:
+        return self._get_names()[0]
+
+    def sheet_signature(self, name: str):
+        return self._get_names()[1].get(name)
+
+    def sheet(self, name: str) -> SheetSnapshot:
+        sheet = self._sheets.get(name)
+        if sheet is None:
+            book = self._get_book()
+            s = book.sheet(name)
+            if not isinstance(s, CachedSheet):
+                s = CachedSheet.from_sheet(s, self._header_row, self._start_row, self._start_col)
+                if hasattr(book, 'unload_sheet'):
+                    book.unload_sheet(name)
+            sheet = SheetSnapshot(s)
+            self._sheets[name] = sheet
+        return sheet
+
+    def load(self) -> None:
+        """
+        parse all sheets and close the real workbook, so that the snapshot can be pickled
+        :return: None
+        """
+        for name in self.sheet_names():
+            self.sheet(name)
+        self.close()
+
+    def close(self):
+        if self._book is not None:
+            self._book.close()
+            self._book = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_open_book'] = None
+        state['_book'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
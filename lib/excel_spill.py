@@ -0,0 +1,139 @@
+import hashlib
+import heapq
+import json
+import logger
+import os
+import shutil
+import struct
+import tempfile
+
+LOGGER = logger.get_logger('EXCEL_SPILL')
+
+"""
+On-disk row runs for out-of-core excel diff
+each row is spilled as a fixed-size record of (fingerprint, side, row idx, payload offset),
+records are sorted in memory-bounded runs, and runs are merged by fingerprint
+"""
+
+FINGERPRINT_SIZE = 16
+RECORD = struct.Struct('>%dsBIQ' % FINGERPRINT_SIZE)
+# estimated memory of a buffered record, including the bytes object and list slot
+RECORD_MEMORY = 80
+# max num of runs merged at once, more runs are merged in passes
+MAX_MERGE_RUNS = 128
+READ_RECORDS = 4096
+
+
+class RowSpiller:
+    """
+    spill rows of src (side 1) and dest (side 2) data to temporary files
+    payloads (json of row values) are appended to a file per side, so that rows can be loaded by offset
+    """
+    def __init__(self, memory_budget: int, tmp_dir: str = None):
+        """
+        :param memory_budget: memory in bytes for buffered records, records are sorted and spilled as a run if exceeded
+        :param tmp_dir: parent directory of temporary files, system default if None
+        """
+        self._run_records = max(memory_budget // RECORD_MEMORY, 1024)
+        self._dir = tempfile.mkdtemp(prefix='excel_spill_', dir=tmp_dir)
+        self._payloads = [open(os.path.join(self._dir, 'payload%d' % side), 'w+b') for side in (1, 2)]
+        self._offsets = [0, 0]
+        self._buffer = []
+        self._runs = []
+        self.nrows = [0, 0]
+
+    def add(self, side: int, idx: int, values: [str]) -> bytes:
+        """
+        spill a row
+        :param side: 1 for src, 2 for dest
+        :param idx: data row idx
+        :param values: stringified values
+        :return: fingerprint of row, a 128-bit blake2b digest of its payload
+        """
+        payload = json.dumps(values).encode('utf-8') + b'\n'
+        fp = hashlib.blake2b(payload, digest_size=FINGERPRINT_SIZE).digest()
+        self._buffer.append(RECORD.pack(fp, side, idx, self._offsets[side - 1]))
+        self._payloads[side - 1].write(payload)
+        self._offsets[side - 1] += len(payload)
+        if len(self._buffer) >= self._run_records:
+            self._spill()
+        return fp
+
+    def _spill(self) -> None:
+        """
+        sort buffered records and write them as a run
+        :return: None
+        """
+        if not self._buffer:
+            return
+        self._buffer.sort()
+        p = os.path.join(self._dir, 'run%d' % len(self._runs))
+        with open(p, 'wb') as f:
+            f.write(b''.join(self._buffer))
+        self._runs.append(p)
+        self._buffer = []
+
+    @staticmethod
+    def _iter_run(path: str):
+        """
+        iterate records of a run
+        :param path: run path
+        :return: generator of record bytes
+        """
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(RECORD.size * READ_RECORDS)
+                if not chunk:
+                    break
+                for i in range(0, len(chunk), RECORD.size):
+                    yield chunk[i:i + RECORD.size]
+
+    def merged(self):
+        """
+        iterate all spilled records sorted by (fingerprint, side, row idx)
+        :return: generator of (fingerprint, side, row idx, payload offset)
+        """
+        for side in (1, 2):
+            self._payloads[side - 1].flush()
+        if len(self._runs) == 0:
+            self._buffer.sort()
+            records = self._buffer
+            self._buffer = []
+        else:
+            self._spill()
+            while len(self._runs) > MAX_MERGE_RUNS:
+                runs, self._runs = self._runs, []
+                for i in range(0, len(runs), MAX_MERGE_RUNS):
+                    p = os.path.join(self._dir, 'run%d_%d' % (len(runs), i))
+                    with open(p, 'wb') as f:
+                        for rec in heapq.merge(*[RowSpiller._iter_run(r) for r in runs[i:i + MAX_MERGE_RUNS]]):
+                            f.write(rec)
+                    self._runs.append(p)
+                for r in runs:
+                    os.remove(r)
+            LOGGER.debug('Merge %d runs of spilled rows' % len(self._runs))
+            records = heapq.merge(*[RowSpiller._iter_run(r) for r in self._runs])
+        for rec in records:
+            yield RECORD.unpack(rec)
+
+    def load(self, side: int, offset: int) -> [str]:
+        """
+        load values of a spilled row
+        :param side: 1 for src, 2 for dest
+        :param offset: payload offset
+        :return: stringified values
+        """
+        f = self._payloads[side - 1]
+        f.seek(offset)
+        return json.loads(f.readline().decode('utf-8'))
+
+    def close(self) -> None:
+        for f in self._payloads:
+            f.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
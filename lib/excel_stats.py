@@ -0,0 +1,276 @@
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, process peak memory is reported as 0
+    resource = None
+
+"""
+Per-phase stats of excel diff
+timings and counts are recorded by (file, sheet), file-level phases have an empty sheet
+memory is only recorded process-wide: the peak resident memory (ru_maxrss) of differ processes since they started,
+which is never reset, so it is not a per-phase or per-file figure
+"""
+
+
+def get_process_peak_memory() -> int:
+    """
+    get peak resident memory since start of current process, or of its largest terminated child process
+    (e.g. workers of a shut down pool), whichever is larger
+    :return: peak memory in bytes, 0 if unknown
+    """
+    if resource is None:
+        return 0
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on linux, bytes on macos
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _escape_label(v: str) -> str:
+    return str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Timer:
+    """
+    context manager adding elapsed seconds to a phase
+    """
+    def __init__(self, stats, phase: str):
+        self._stats = stats
+        self._phase = phase
+        self._t = 0.0
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stats.add_seconds(self._phase, time.perf_counter() - self._t)
+
+
+class _Scope:
+    """
+    context manager setting labels of stats, restored on exit
+    """
+    def __init__(self, stats, file: str = None, sheet: str = None):
+        self._stats = stats
+        self._labels = (file, sheet)
+        self._prev = None
+
+    def __enter__(self):
+        self._prev = (self._stats.file, self._stats.sheet)
+        file, sheet = self._labels
+        if file is not None:
+            self._stats.file = file
+            self._stats.sheet = ''
+        if sheet is not None:
+            self._stats.sheet = sheet
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stats.file, self._stats.sheet = self._prev
+
+
+class DiffStats:
+    """
+    collector of phase timings, counts and process peak memory of excel diff
+    records are not pickled with the differ, stats of worker processes are collected and merged explicitly
+    """
+    enabled = True
+
+    def __init__(self):
+        self.file = ''
+        self.sheet = ''
+        self.process_peak_memory = 0
+        # (file, sheet) -> {'seconds': {phase: seconds}, 'counts': {name: count}}
+        self._records = dict()
+
+    def __getstate__(self):
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def _record(self) -> dict:
+        key = (self.file, self.sheet)
+        record = self._records.get(key)
+        if record is None:
+            record = {'seconds': dict(), 'counts': dict()}
+            self._records[key] = record
+        return record
+
+    def scope(self, file: str = None, sheet: str = None) -> _Scope:
+        """
+        set labels of following records in a with block, sheet is reset if file is set
+        :param file: file name
+        :param sheet: sheet name
+        :return: context manager
+        """
+        return _Scope(self, file, sheet)
+
+    def timer(self, phase: str) -> _Timer:
+        """
+        time a phase in a with block, seconds of the same phase are summed
+        :param phase: phase name
+        :return: context manager
+        """
+        return _Timer(self, phase)
+
+    def add_seconds(self, phase: str, seconds: float) -> None:
+        seconds_of = self._record()['seconds']
+        seconds_of[phase] = seconds_of.get(phase, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        add to a counter
+        :param name: counter name
+        :param n: num to add
+        :return: None
+        """
+        counts = self._record()['counts']
+        counts[name] = counts.get(name, 0) + n
+
+    def collect(self) -> dict:
+        """
+        get records and process peak memory as a dict, then clear records, used to send stats out of worker processes
+        :return: stats dict, see to_dict
+        """
+        d = self.to_dict()
+        self._records = dict()
+        return d
+
+    def merge(self, d: dict) -> None:
+        """
+        merge stats collected in another process
+        :param d: stats dict, see to_dict
+        :return: None
+        """
+        if not d:
+            return
+        for r in d['records']:
+            record = self._records.get((r['file'], r['sheet']))
+            if record is None:
+                record = {'seconds': dict(), 'counts': dict()}
+                self._records[(r['file'], r['sheet'])] = record
+            for k, v in r['seconds'].items():
+                record['seconds'][k] = record['seconds'].get(k, 0.0) + v
+            for k, v in r['counts'].items():
+                record['counts'][k] = record['counts'].get(k, 0) + v
+        self.process_peak_memory = max(self.process_peak_memory, d['process_peak_memory'])
+
+    def to_dict(self) -> dict:
+        """
+        get stats as a dict: {
+            process_peak_memory: (int) max process-wide peak resident memory in bytes of differ processes,
+                including workers whose stats are merged, not reset between diffs,
+            seconds: {(str) phase: (float) total seconds},
+            counts: {(str) name: (int) total count},
+            records: [
+                {
+                    file: (str) file name,
+                    sheet: (str) sheet name, empty for file-level phases,
+                    seconds: {(str) phase: (float) seconds},
+                    counts: {(str) name: (int) count}
+                }
+            ]
+        }
+        :return: stats dict
+        """
+        self.process_peak_memory = max(self.process_peak_memory, get_process_peak_memory())
+        seconds, counts, records = dict(), dict(), []
+        for (file, sheet), record in self._records.items():
+            for k, v in record['seconds'].items():
+                seconds[k] = seconds.get(k, 0.0) + v
+            for k, v in record['counts'].items():
+                counts[k] = counts.get(k, 0) + v
+            records.append({
+                'file': file,
+                'sheet': sheet,
+                'seconds': dict(record['seconds']),
+                'counts': dict(record['counts']),
+            })
+        return {
+            'process_peak_memory': self.process_peak_memory,
+            'seconds': seconds,
+            'counts': counts,
+            'records': records,
+        }
+
+    def write_json(self, fp) -> None:
+        """
+        write stats as json
+        :param fp: text file object to write
+        :return: None
+        """
+        fp.write(json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, fp, prefix: str = 'excel_diff') -> None:
+        """
+        write stats in prometheus text format, e.g. for the textfile collector of node exporter
+        :param fp: text file object to write
+        :param prefix: metric name prefix
+        :return: None
+        """
+        d = self.to_dict()
+        lines = [
+            '# HELP %s_process_peak_memory_bytes Process-wide peak resident memory of differ processes.' % prefix,
+            '# TYPE %s_process_peak_memory_bytes gauge' % prefix,
+            '%s_process_peak_memory_bytes %d' % (prefix, d['process_peak_memory']),
+            '# HELP %s_phase_seconds Seconds spent in each phase of excel diff.' % prefix,
+            '# TYPE %s_phase_seconds gauge' % prefix,
+        ]
+        for r in d['records']:
+            for phase, v in r['seconds'].items():
+                lines.append('%s_phase_seconds{file="%s",sheet="%s",phase="%s"} %.6f'
+                             % (prefix, _escape_label(r['file']), _escape_label(r['sheet']), _escape_label(phase), v))
+        lines.extend([
+            '# HELP %s_count Counts of rows, cols, candidates and changes of excel diff.' % prefix,
+            '# TYPE %s_count gauge' % prefix,
+        ])
+        for r in d['records']:
+            for name, v in r['counts'].items():
+                lines.append('%s_count{file="%s",sheet="%s",name="%s"} %d'
+                             % (prefix, _escape_label(r['file']), _escape_label(r['sheet']), _escape_label(name), v))
+        fp.write('\n'.join(lines) + '\n')
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullStats:
+    """
+    stats collector doing nothing, used if stats are disabled
+    """
+    enabled = False
+
+    def scope(self, file: str = None, sheet: str = None):
+        return _NULL_CONTEXT
+
+    def timer(self, phase: str):
+        return _NULL_CONTEXT
+
+    def add_seconds(self, phase: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, n: int = 1) -> None:
+        pass
+
+    def collect(self):
+        return None
+
+    def merge(self, d: dict) -> None:
+        pass
+
+
+NULL_STATS = NullStats()
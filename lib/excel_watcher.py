@@ -0,0 +1,191 @@
+import json
+import logger
+import os
+import time
+from util import get_iter_diff
+from lib.excel_differ import ExcelDiffer
+
+LOGGER = logger.get_logger('EXCEL_WATCHER')
+LOCK_PREFIX = '~$'
+
+
+class ExcelWatcher:
+    """
+    watch src and dest directories, and keep a live diff report of them
+    files are polled by cheap stat checks, only touched workbooks are diffed again,
+    results of other workbooks are kept in memory
+    a touched workbook is diffed after it settles, that is, its size and mtime, and the size and mtime of
+    its office lock file (~$ file, e.g. while excel is saving it), have not changed for settle seconds
+    """
+    def __init__(self, differ: ExcelDiffer, src_dir: str, dest_dir: str, report_file: str,
+                 interval: float = 1.0, settle: float = 2.0, workers: int = 1):
+        """
+        :param differ: excel differ
+        :param src_dir: directory containing source excel files
+        :param dest_dir: directory containing destination excel files
+        :param report_file: path of live report, rewritten atomically when the report changes
+        :param interval: seconds between polls
+        :param settle: seconds a touched workbook must keep unchanged before it is diffed
+        :param workers: num of worker processes to diff touched files with
+        """
+        self._differ = differ
+        self._src_dir = src_dir
+        self._dest_dir = dest_dir
+        self._report_file = report_file
+        self._interval = interval
+        self._settle = settle
+        self._workers = workers
+        # file name -> (file diff, error msg) of kept files
+        self._results = dict()
+        # file name -> signature that the result is diffed at
+        self._diffed = dict()
+        # file name -> (signature, monotonic time it was first seen), of touched files not diffed yet
+        self._pending = dict()
+        self._files = (set(), set())
+        self._report = None
+        self._stopped = False
+
+    @staticmethod
+    def _stat(path: str):
+        """
+        get stat signature of a file
+        :param path: file path
+        :return: (size, mtime in ns), None if not existed
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def _get_signature(path: str):
+        """
+        get signature of a workbook, including its office lock file
+        :param path: file path
+        :return: (stat of workbook, stat of lock file)
+        """
+        d, f = os.path.split(path)
+        return ExcelWatcher._stat(path), ExcelWatcher._stat(os.path.join(d, LOCK_PREFIX + f))
+
+    def _is_settled(self, kf: str, sig, now: float) -> bool:
+        """
+        check if a touched workbook has settled
+        :param kf: file name
+        :param sig: current signature of src and dest file
+        :param now: current monotonic time
+        :return: if it can be diffed
+        """
+        pending = self._pending.get(kf)
+        if pending is None or pending[0] != sig:
+            self._pending[kf] = (sig, now)
+            # files untouched for settle seconds are settled at once, e.g. on start
+            mtimes = [s[1] for side in sig for s in side if s is not None]
+            return len(mtimes) > 0 and time.time() - max(mtimes) / 1e9 >= self._settle
+        return now - pending[1] >= self._settle
+
+    def poll(self) -> bool:
+        """
+        poll directories once, diff settled touched workbooks and update the live report
+        :return: if the report changed
+        """
+        src_files = ExcelDiffer.get_excel_files(self._src_dir)
+        dest_files = ExcelDiffer.get_excel_files(self._dest_dir)
+        rm, kp, ad = get_iter_diff(src_files, dest_files)
+        kept = set(kp)
+        for kf in list(self._results.keys()):
+            if kf not in kept:
+                self._results.pop(kf)
+                self._diffed.pop(kf, None)
+        for kf in list(self._pending.keys()):
+            if kf not in kept:
+                self._pending.pop(kf)
+        now = time.monotonic()
+        touched = []
+        sigs = dict()
+        for kf in kp:
+            sig = (ExcelWatcher._get_signature(os.path.join(self._src_dir, kf)),
+                   ExcelWatcher._get_signature(os.path.join(self._dest_dir, kf)))
+            if self._diffed.get(kf) == sig:
+                continue
+            if self._is_settled(kf, sig, now):
+                touched.append(kf)
+                sigs[kf] = sig
+            else:
+                LOGGER.debug('Wait for %s to settle' % kf)
+        if touched:
+            LOGGER.info('Diff touched excel files: %s' % touched)
+            for kf, ret, err in self._differ.diff_files(self._src_dir, self._dest_dir, touched, self._workers):
+                self._results[kf] = (ret, err)
+                self._diffed[kf] = sigs[kf]
+                self._pending.pop(kf, None)
+        files = (src_files, dest_files)
+        if not touched and self._report is not None and files == self._files:
+            return False
+        self._files = files
+        report = {
+            'added_files': ad,
+            'removed_files': rm,
+            'modified_files': [],
+            'errors': [],
+        }
+        ExcelDiffer.add_file_diffs(report, [(kf, ) + self._results[kf] for kf in kp if kf in self._results])
+        if report == self._report:
+            return False
+        self._report = report
+        self._write_report()
+        return True
+
+    def _write_report(self) -> None:
+        """
+        write live report atomically, so that readers never see a half-written report
+        :return: None
+        """
+        d = os.path.dirname(self._report_file)
+        if d and not os.path.isdir(d):
+            os.makedirs(d, exist_ok=True)
+        tmp = '%s.%d.tmp' % (self._report_file, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self._report, ensure_ascii=False, indent=2))
+        os.replace(tmp, self._report_file)
+        LOGGER.info('Live report updated: %s' % self._report_file)
+
+    def get_report(self) -> dict:
+        """
+        get current report, see ExcelDiffer.get_diff_report
+        :return: report dict, None before the first poll
+        """
+        return self._report
+
+    def run(self, rounds: int = -1) -> None:
+        """
+        poll until stopped
+        :param rounds: max num of polls, infinite if < 0
+        :return: None
+        """
+        self._stopped = False
+        n = 0
+        while not self._stopped and (rounds < 0 or n < rounds):
+            try:
+                self.poll()
+            except Exception as e:
+                LOGGER.exception('Error while polling %s and %s! %s' % (self._src_dir, self._dest_dir, e))
+            n += 1
+            if not self._stopped and (rounds < 0 or n < rounds):
+                time.sleep(self._interval)
+
+    def stop(self) -> None:
+        """
+        stop running, e.g. from another thread
+        :return: None
+        """
+        self._stopped = True
+
+
+if __name__ == '__main__':
+    watcher = ExcelWatcher(ExcelDiffer(use_excel_indices=True), './test/excel_differ/src', './test/excel_differ/dest',
+                           './tmp/excel_watcher/report.json')
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
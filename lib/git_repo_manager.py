@@ -3,6 +3,8 @@ import os
 import json
 import git
 import util
+from lib.excel_differ import ExcelDiffer
+from lib.excel_history import CellHistory, ExcelHistory
 from typing import Dict, List, Any
 import time
 
@@ -60,6 +62,33 @@ class GitRepoManager:
             return False, 'Ref does not exist!'
         return True, ''
 
+    def _fetch(self, git_url: str) -> git.Repo:
+        """
+        fetch latest commits of remote into the object database, working tree is never touched
+        repo is cloned without checkout if not cloned yet
+        :param git_url: git url
+        :return: git Repo Object
+        """
+        hs = GitRepoManager._hash(git_url)
+        if hs not in self._info.keys():
+            dest = os.path.join(self._root_dir, hs)
+            self._info[hs] = git.Repo.clone_from(url=git_url, to_path=dest, no_checkout=True)
+        else:
+            self._info[hs].git.fetch('origin', '--tags')
+        return self._info[hs]
+
+    @staticmethod
+    def _get_commit(repo: git.Repo, ref: str) -> git.Commit:
+        """
+        get commit of a ref, origin branches are preferred to local branches
+        :param repo: git Repo Object
+        :param ref: branch, tag or commit id
+        :return: git Commit Object
+        """
+        if ref in GitRepoManager._get_origin_branches(repo):
+            return repo.commit('origin/%s' % ref)
+        return repo.commit(ref)
+
     @staticmethod
     def _get_origin_branches(repo: git.Repo) -> List[str]:
         """
@@ -190,6 +219,48 @@ class GitRepoManager:
             }
         return info
 
+    def get_excel_diff_report(self, git_url: str, ref1: str, ref2: str,
+                              differ: ExcelDiffer = None) -> Dict[str, Any]:
+        """
+        get excel diff report between 2 refs, without checking out
+        only excel files changed between the refs are read, from blobs in the object database
+        :param git_url: git url
+        :param ref1: source ref (branch, tag or commit id)
+        :param ref2: destination ref
+        :param differ: excel differ, default options are used if None
+        :return: report dict (see ExcelDiffer.get_diff_report), empty if failed
+        """
+        try:
+            repo = self._fetch(git_url)
+            c1 = GitRepoManager._get_commit(repo, ref1)
+            c2 = GitRepoManager._get_commit(repo, ref2)
+        except Exception as e:
+            LOGGER.exception('Cannot get excel diff of %s between %s and %s! %s' % (git_url, ref1, ref2, e))
+            return dict()
+        if differ is None:
+            differ = ExcelDiffer()
+        return differ.get_commit_diff_report(c1, c2)
+
+    def get_excel_history(self, git_url: str, path: str, ref: str = 'master', key_cols=None,
+                          max_count: int = 500, differ: ExcelDiffer = None) -> CellHistory:
+        """
+        get cell history of an excel table up to a ref, without checking out
+        :param git_url: git url
+        :param path: table path from repo root
+        :param ref: branch, tag or commit id to walk back from
+        :param key_cols: key cols of rows, see ExcelHistory
+        :param max_count: max num of latest commits changing the table to walk
+        :param differ: excel differ of parsing options, default options are used if None
+        :return: cell history, None if failed
+        """
+        try:
+            repo = self._fetch(git_url)
+            commit = GitRepoManager._get_commit(repo, ref)
+            return ExcelHistory(differ, key_cols).build(repo, path, commit.hexsha, max_count)
+        except Exception as e:
+            LOGGER.exception('Cannot get excel history of %s in %s at %s! %s' % (path, git_url, ref, e))
+            return None
+
 
 if __name__ == '__main__':
     manager = GitRepoManager('./tmp/git_repos')
@@ -1,8 +1,44 @@
 import logger
+import multiprocessing
 import os
 import pprint
+import queue
+import threading
+import time
+from multiprocessing.connection import wait as wait_conns
+from lib.table_loader import DeltaTables, TableLoader
 
 LOGGER = logger.get_logger('TABLE_CHECKER')
+CHECK_MODES = ['thread', 'process']
+# interval in seconds to check timeouts of running checkers
+CHECK_TICK = 0.05
+# num of checkers in slowest checkers report
+SLOWEST_COUNT = 10
+
+
+def _run_checker_of_thread(pp: dict, data, results: queue.Queue, i: int) -> None:
+    results.put((i, TableChecker.run_checker(pp, data)))
+
+
+def _run_checker_of_process(pp: dict, data, conn) -> None:
+    """
+    run a checker in forked process, args are inherited by fork instead of pickled
+    :param pp: checker of pipeline
+    :param data: table data
+    :param conn: connection to send result to parent process
+    :return: None
+    """
+    result = TableChecker.run_checker(pp, data)
+    try:
+        conn.send(result)
+    except Exception as e:
+        # e.g. result could not be pickled
+        LOGGER.exception('Failed to send result of %s! %s' % (pp['name'], e))
+        error_result = TableChecker._get_error_result(pp, e)
+        for k in ['time', 'cpu_time', 'rows']:
+            error_result[k] = result[k]
+        conn.send(error_result)
+    conn.close()
 
 
 class TableChecker:
@@ -12,12 +48,19 @@ class TableChecker:
     def __init__(self):
         self._names = set()
         self._pipeline = []
+        # checker name -> result of the last check, for incremental checks
+        self._results = dict()
 
-    def add_checker(self, name, types):
+    def add_checker(self, name, types, delta=False, indexes=None):
         """
         add a checker function
         :param name: checker name
         :param types: data types used by checker
+        :param delta: in incremental checks, receive only added and modified rows of changed tables
+            (see DeltaTables) if the previous result passed, True for all types, or a list of types
+            which may be narrowed
+        :param indexes: indexes used by checker, [(data type, index kind, cols)] (see table_loader.INDEX_KINDS),
+            built before forking in process mode so that workers share them, built on first use otherwise
         :return: checker function decorator
         """
         def wrapper(func):
@@ -29,21 +72,37 @@ class TableChecker:
                 self._pipeline.append({
                     'name': name,
                     'types': types,
+                    'delta': delta,
+                    'indexes': list(indexes or []),
                     'callback': func
                 })
         return wrapper
 
-    def get_types(self):
+    def get_types(self, names: [str] = None):
         """
         get all needed data types for check
+        :param names: checker names, all checkers if None
         :return: types
         """
         types = set()
-        for pp in self._pipeline:
+        for pp in self._get_pipeline(names):
             for t in pp['types']:
                 types.add(t)
         return sorted(list(types))
 
+    def _get_pipeline(self, names: [str] = None) -> list:
+        """
+        get checkers to run
+        :param names: checker names, all checkers if None
+        :return: checkers of pipeline, in the same order as added
+        """
+        if names is None:
+            return self._pipeline
+        names = set(names)
+        for name in names - self._names:
+            LOGGER.warning('Unknown Table Check Rule: %s!' % name)
+        return [pp for pp in self._pipeline if pp['name'] in names]
+
     def output(self):
         """
         output checker info
@@ -56,16 +115,403 @@ class TableChecker:
                 i + 1, self._pipeline[i]['name'], self._pipeline[i]['types'])
         LOGGER.info(s)
 
-    def check(self, data):
+    @staticmethod
+    def run_checker(pp: dict, data) -> dict:
+        """
+        run a checker, exceptions are caught so that other checkers are not affected
+        :param pp: checker of pipeline
+        :param data: table data
+        :return: checker result, see check
+        """
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            ret = pp['callback'](data)
+        except Exception as e:
+            LOGGER.exception('Failed to check %s! %s' % (pp['name'], e))
+            result = TableChecker._get_error_result(pp, e)
+        else:
+            result = TableChecker._get_result(pp, not (isinstance(ret, dict) and not ret.get('success', True)), ret)
+        result['time'] = time.perf_counter() - start
+        result['cpu_time'] = time.thread_time() - cpu_start
+        result['rows'] = TableChecker._count_rows(pp, data)
+        return result
+
+    @staticmethod
+    def _get_result(pp: dict, success: bool, ret=None, error: str = '', time_cost: float = 0.0,
+                    timed_out: bool = False) -> dict:
+        return {
+            'name': pp['name'],
+            'types': pp['types'],
+            'success': success,
+            'result': ret,
+            'error': error,
+            'cached': False,
+            'time': time_cost,
+            'cpu_time': None,
+            'rows': 0,
+            'timed_out': timed_out,
+        }
+
+    @staticmethod
+    def _get_error_result(pp: dict, e: Exception) -> dict:
+        return TableChecker._get_result(pp, False, error='%s: %s' % (type(e).__name__, e))
+
+    @staticmethod
+    def _get_timeout_result(pp: dict, data, start: float, now: float, timeout: float, deadline: float):
+        """
+        get result of a checker running out of time
+        :param pp: checker of pipeline
+        :param data: table data of checker
+        :param start: start time of checker, 0 if not started
+        :param now: current time
+        :param timeout: timeout of each checker in seconds, None if not limited
+        :param deadline: deadline of check, None if not limited
+        :return: failed result if timed out or skipped by time budget, None if still in time
+        """
+        if start and timeout is not None and now - start >= timeout:
+            error = 'TimeoutError: exceeded timeout of %ss' % timeout
+        elif deadline is not None and now >= deadline:
+            error = 'TimeoutError: exceeded time budget' if start else 'Skipped: exceeded time budget'
+        else:
+            return None
+        LOGGER.error('Failed to check %s! %s' % (pp['name'], error))
+        result = TableChecker._get_result(pp, False, error=error, time_cost=now - start if start else 0.0,
+                                          timed_out=True)
+        result['rows'] = TableChecker._count_rows(pp, data)
+        return result
+
+    @staticmethod
+    def _count_rows(pp: dict, data) -> int:
+        """
+        count rows of loaded tables used by a checker, changed rows only if tables are narrowed
+        :param pp: checker of pipeline
+        :param data: table data
+        :return: num of rows
+        """
+        rows = 0
+        for t in pp['types']:
+            try:
+                if t in data and (not hasattr(data, 'is_loaded') or data.is_loaded(t)):
+                    rows += len(data[t])
+            except Exception:
+                pass
+        return rows
+
+    @staticmethod
+    def get_changes_of_report(report: dict, tables: dict, use_excel_indices: bool = False) -> dict:
+        """
+        get changed tables and rows from an excel diff report (see ExcelDiffer.get_diff_report)
+        :param report: diff report
+        :param tables: data type -> (file name as in report, sheet name), or file name if the whole file is a table
+        :param use_excel_indices: use_excel_indices of the differ
+        :return: data type -> set of changed (added, duplicated or modified) sheet row indices of dest table,
+            None if the whole table changed (added, removed, cols changed), unchanged tables are excluded.
+            a table with only removed rows is changed with no changed rows
+        """
+        offset = 1 if use_excel_indices else 0
+        added = set([os.path.normpath(f) for f in report.get('added_files', [])])
+        removed = set([os.path.normpath(f) for f in report.get('removed_files', [])])
+        modified = dict([(os.path.normpath(f['name']), f) for f in report.get('modified_files', [])])
+        changes = dict()
+        for t, table in tables.items():
+            file_name, sheet_name = (table, None) if isinstance(table, str) else table
+            file_name = os.path.normpath(file_name)
+            if file_name in added or file_name in removed:
+                changes[t] = None
+                continue
+            file_diff = modified.get(file_name)
+            if file_diff is None:
+                continue
+            if sheet_name is None:
+                changes[t] = None
+                continue
+            if sheet_name in file_diff.get('added_sheets', []) or sheet_name in file_diff.get('removed_sheets', []):
+                changes[t] = None
+                continue
+            for sheet_diff in file_diff.get('modified_sheets', []):
+                if sheet_diff['name'] != sheet_name:
+                    continue
+                if sheet_diff.get('added_cols') or sheet_diff.get('removed_cols') \
+                        or 'modified_data' not in sheet_diff:
+                    # header changed, or rows are not in report (written as events)
+                    changes[t] = None
+                    break
+                data_diff = sheet_diff['modified_data']
+                rowxs = set([r - offset for r in data_diff.get('added_rows', [])])
+                for cell in data_diff.get('modified_cells', []):
+                    rowxs.add(cell['dest_row'] - offset)
+                # duplicated rows are excluded from added rows by the differ
+                for r in data_diff.get('duplicated_dest_rows', dict()).keys():
+                    rowxs.add(int(r) - offset)
+                changes[t] = rowxs
+                break
+        return changes
+
+    def check(self, data, workers: int = 1, mode: str = 'thread', names: [str] = None,
+              changes=None, previous: dict = None, timeout: float = None, budget: float = None) -> dict:
+        """
+        run checkers on table data
+        checkers must not modify data, as it is shared by checkers running at the same time
+        :param data: table data, type -> rows, or a TableLoader (see table_loader) to load tables
+            on first access, so that only tables used by the checkers to run are loaded.
+            checkers receive a TableLoader anyway, whose indexes are shared by checkers.
+            in process mode indexes built by a worker stay in the worker, only tables and indexes declared
+            by checkers (see add_checker) are built before forking and shared
+        :param workers: num of checkers running at the same time, one by one if <= 1
+        :param mode: thread, or process (forked workers share data copy-on-write, fallback to thread
+            if fork is not available), process helps if checkers are cpu bound
+        :param names: names of checkers to run, all checkers if None
+        :param changes: changed data types (see get_changes_of_report), or data type -> changed row indices,
+            None if all rows changed. if specified, only checkers using changed types run, and results of
+            others are taken from previous results, they run as well if no previous result
+        :param previous: results of previous check, results of the last check of this checker if None
+        :param timeout: max seconds of each checker, a checker running longer fails as timed out
+        :param budget: max seconds of the whole check, running checkers fail as timed out and others are
+            skipped once it is exceeded. timed out checkers are killed in process mode, yet they can not be
+            stopped in threads and are left running in daemon threads, while their slots are given to
+            other checkers
+        :return: check results: {
+            results: [
+                {
+                    name: (str) checker name,
+                    types: [(str) data types used by checker],
+                    success: (bool) False if the checker failed or raised,
+                    result: returned value of checker,
+                    error: (str) exception raised by checker, empty if not raised,
+                    cached: (bool) True if taken from previous results,
+                    time: (float) wall time in seconds,
+                    cpu_time: (float) cpu time in seconds, None if timed out,
+                    rows: (int) num of rows of tables used by checker, changed rows only if narrowed,
+                    timed_out: (bool) True if timed out or skipped by time budget
+                }
+            ], in the same order as checkers are added,
+            passed: (int) num of passed checkers,
+            failed: (int) num of failed checkers, including errors,
+            errors: (int) num of checkers raising exceptions or crashed,
+            cached: (int) num of results taken from previous results,
+            timeouts: (int) num of checkers timed out or skipped by time budget,
+            time: (float) wall time of check in seconds,
+            slowest: [{name, time, cpu_time, rows}] of slowest checkers, see get_slowest
+        }
+        """
+        if mode not in CHECK_MODES:
+            raise ValueError('Unknown check mode: %s!' % mode)
         LOGGER.info('Start checking table!!!!!!!')
-        for pp in self._pipeline:
-            LOGGER.info('Checking %s...' % pp['name'])
+        start = time.time()
+        deadline = start + budget if budget is not None else None
+        all_pipeline = self._get_pipeline(names)
+        if not isinstance(data, TableLoader):
+            # indexes of tables are built once in this run and shared by checkers
+            data = TableLoader.from_dict(data)
+        if changes is not None and not isinstance(changes, dict):
+            changes = dict([(t, None) for t in changes])
+        cached = dict()
+        prev = dict()
+        if changes is not None:
+            prev = dict([(r['name'], r) for r in previous['results']]) if previous is not None else self._results
+            for pp in all_pipeline:
+                if pp['name'] in prev and not set(pp['types']) & set(changes.keys()):
+                    cached[pp['name']] = dict(prev[pp['name']], cached=True)
+            LOGGER.info('Changed tables: %s, %d of %d checkers are skipped' % (
+                sorted(changes.keys()), len(cached), len(all_pipeline)))
+        pipeline = [pp for pp in all_pipeline if pp['name'] not in cached]
+        checker_data = [self._get_data_of_checker(pp, data, changes, prev.get(pp['name'])) for pp in pipeline]
+        results = self._run_pipeline(pipeline, data, checker_data, workers, mode, timeout, deadline)
+        it = iter(results)
+        results = [cached[pp['name']] if pp['name'] in cached else next(it) for pp in all_pipeline]
+        for r in results:
+            self._results[r['name']] = r
+        return TableChecker._summarize(results, time.time() - start)
+
+    @staticmethod
+    def _get_data_of_checker(pp: dict, data: TableLoader, changes: dict, prev_result: dict = None):
+        """
+        get table data passed to a checker
+        a delta checker only receives changed rows if its previous result passed, so that its result still
+        covers all rows, otherwise it checks full tables
+        :param pp: checker of pipeline
+        :param data: table loader
+        :param changes: changes of check
+        :param prev_result: previous result of checker, None if not checked before
+        :return: data narrowed to changed rows if checker receives delta in incremental check, else data
+        """
+        if changes is None or not pp['delta'] or prev_result is None or not prev_result['success']:
+            return data
+        return DeltaTables(data, changes, None if pp['delta'] is True else pp['delta'])
+
+    def _run_pipeline(self, pipeline: list, loader: TableLoader, data: list, workers: int, mode: str,
+                      timeout: float, deadline: float) -> [dict]:
+        """
+        run checkers
+        :param pipeline: checkers to run
+        :param loader: table loader
+        :param data: table data of each checker
+        :param workers: num of checkers running at the same time
+        :param mode: thread or process
+        :param timeout: max seconds of each checker
+        :param deadline: deadline of check
+        :return: results of checkers, in the same order as pipeline
+        """
+        n = min(workers, len(pipeline))
+        if n <= 1 and timeout is None and deadline is None:
+            results = []
+            for i in range(len(pipeline)):
+                LOGGER.info('Checking %s...' % pipeline[i]['name'])
+                results.append(TableChecker.run_checker(pipeline[i], data[i]))
+                self._log_result(results[-1])
+            return results
+        n = max(n, 1)
+        if mode == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+            LOGGER.warning('Fork is not available, check in threads')
+            mode = 'thread'
+        if mode == 'process':
+            # load tables and declared indexes before forking, or each worker builds its own copy
+            loader.load(sorted(set([t for pp in pipeline for t in pp['types']])))
+            loader.build_indexes([index for pp in pipeline for index in pp['indexes']])
+            return self._run_in_processes(pipeline, data, n, timeout, deadline)
+        return self._run_in_threads(pipeline, data, n, timeout, deadline)
+
+    def _run_in_threads(self, pipeline: list, data: list, n: int, timeout: float, deadline: float) -> [dict]:
+        """
+        run each checker in its own daemon thread, at most n at the same time
+        threads can not be stopped, a timed out checker is left running in background and its slot is given
+        to the next checker, and it does not block exit of the interpreter
+        :return: results of checkers, in the same order as pipeline
+        """
+        results = [None] * len(pipeline)
+        tick = CHECK_TICK if timeout is not None or deadline is not None else None
+        finished = queue.Queue()
+        pending = list(range(len(pipeline) - 1, -1, -1))
+        # idx of checker -> start time
+        running = dict()
+        while pending or running:
+            while pending and len(running) < n and (deadline is None or time.time() < deadline):
+                i = pending.pop()
+                LOGGER.info('Checking %s...' % pipeline[i]['name'])
+                running[i] = time.time()
+                threading.Thread(target=_run_checker_of_thread, args=(pipeline[i], data[i], finished, i),
+                                 name='checker-%d' % i, daemon=True).start()
+            if not running:
+                break
             try:
-                ret = pp['callback'](data)
-                LOGGER.info('Result of %s:\n%s' % (
-                    pp['name'], pprint.pformat(ret, indent=2, width=60)))
-            except Exception as e:
-                LOGGER.exception('Failed to check %s! %s' % (pp['name'], e))
+                i, result = finished.get(timeout=tick)
+                # results of timed out checkers are dropped
+                if i in running:
+                    running.pop(i)
+                    results[i] = result
+                    self._log_result(result)
+            except queue.Empty:
+                pass
+            now = time.time()
+            for i, start in list(running.items()):
+                result = TableChecker._get_timeout_result(pipeline[i], data[i], start, now, timeout, deadline)
+                if result is not None:
+                    running.pop(i)
+                    results[i] = result
+        now = time.time()
+        for i in pending:
+            results[i] = TableChecker._get_timeout_result(pipeline[i], data[i], 0.0, now, timeout, deadline)
+        return results
+
+    def _run_in_processes(self, pipeline: list, data: list, n: int, timeout: float, deadline: float) -> [dict]:
+        """
+        run each checker in its own forked process, which shares table data copy-on-write,
+        a crashed process only fails its own checker, and timed out checkers are killed
+        :return: results of checkers, in the same order as pipeline
+        """
+        ctx = multiprocessing.get_context('fork')
+        results = [None] * len(pipeline)
+        tick = CHECK_TICK if timeout is not None or deadline is not None else None
+        pending = list(range(len(pipeline) - 1, -1, -1))
+        # connection -> (idx of checker, process, start time)
+        running = dict()
+        while pending or running:
+            while pending and len(running) < n and (deadline is None or time.time() < deadline):
+                i = pending.pop()
+                LOGGER.info('Checking %s...' % pipeline[i]['name'])
+                conn, child_conn = ctx.Pipe(duplex=False)
+                p = ctx.Process(target=_run_checker_of_process, args=(pipeline[i], data[i], child_conn))
+                p.start()
+                child_conn.close()
+                running[conn] = (i, p, time.time())
+            if not running:
+                break
+            for conn in wait_conns(list(running.keys()), timeout=tick):
+                i, p, start = running.pop(conn)
+                try:
+                    results[i] = conn.recv()
+                except Exception as e:
+                    p.join()
+                    LOGGER.error('Worker process of %s exited with code %s! %s' % (pipeline[i]['name'], p.exitcode, e))
+                    results[i] = TableChecker._get_result(
+                        pipeline[i], False, error='ProcessError: worker process exited with code %s' % p.exitcode,
+                        time_cost=time.time() - start)
+                conn.close()
+                p.join()
+                self._log_result(results[i])
+            now = time.time()
+            for conn, (i, p, start) in list(running.items()):
+                result = TableChecker._get_timeout_result(pipeline[i], data[i], start, now, timeout, deadline)
+                if result is not None:
+                    p.kill()
+                    p.join()
+                    conn.close()
+                    running.pop(conn)
+                    results[i] = result
+        now = time.time()
+        for i in pending:
+            results[i] = TableChecker._get_timeout_result(pipeline[i], data[i], 0.0, now, timeout, deadline)
+        return results
+
+    @staticmethod
+    def get_slowest(results: [dict], n: int = SLOWEST_COUNT) -> [dict]:
+        """
+        get slowest checkers by wall time, cached results are excluded
+        :param results: results of check
+        :param n: max num of checkers
+        :return: [{name, time, cpu_time, rows}], slowest first
+        """
+        results = sorted([r for r in results if not r['cached']], key=lambda r: r['time'], reverse=True)
+        return [{
+            'name': r['name'],
+            'time': r['time'],
+            'cpu_time': r['cpu_time'],
+            'rows': r['rows'],
+        } for r in results[:n]]
+
+    @staticmethod
+    def _log_result(result: dict) -> None:
+        if not result['error']:
+            LOGGER.info('Result of %s (%.3fs):\n%s' % (
+                result['name'], result['time'], pprint.pformat(result['result'], indent=2, width=60)))
+
+    @staticmethod
+    def _summarize(results: [dict], time_cost: float) -> dict:
+        passed = len([r for r in results if r['success']])
+        errors = len([r for r in results if r['error'] and not r.get('timed_out')])
+        cached = len([r for r in results if r['cached']])
+        timeouts = len([r for r in results if r.get('timed_out')])
+        slowest = TableChecker.get_slowest(results)
+        s = 'Table check finished in %.3fs, %d passed, %d failed, %d errors, %d cached, %d timeouts' % (
+            time_cost, passed, len(results) - passed, errors, cached, timeouts)
+        if slowest:
+            s += '\nSlowest checkers:\n'
+            for i in range(len(slowest)):
+                r = slowest[i]
+                s += '%d. %s: %.3fs wall, %s cpu, %d rows\n' % (
+                    i + 1, r['name'], r['time'], '%.3fs' % r['cpu_time'] if r['cpu_time'] is not None else '-',
+                    r['rows'])
+        LOGGER.info(s.rstrip())
+        return {
+            'results': results,
+            'passed': passed,
+            'failed': len(results) - passed,
+            'errors': errors,
+            'cached': cached,
+            'timeouts': timeouts,
+            'time': time_cost,
+            'slowest': slowest,
+        }
 
 
 table_checker = TableChecker()
@@ -0,0 +1,392 @@
+import json
+import logger
+import threading
+from collections.abc import Mapping
+from lib.excel_reader import open_workbook
+
+LOGGER = logger.get_logger('TABLE_LOADER')
+
+"""
+Lazy table data of table checker
+a table is registered with its source (excel sheet, exported json or any callable),
+and loaded on the first access, so a partial check only loads tables used by its checkers
+indexes of tables (key sets, key -> row maps, groups) are built on first use and shared by checkers,
+and dropped once the table is reloaded or replaced
+"""
+
+INDEX_KINDS = ['set', 'map', 'groups']
+
+
+class TableLoader(Mapping):
+    """
+    mapping of data type -> rows, rows are loaded from sources on first access and kept for the run
+    loading is thread safe, each table (or index) is built once even if checkers access it at the same time
+    """
+    def __init__(self, sources: dict = None):
+        """
+        :param sources: data type -> callable returning rows
+        """
+        self._sources = dict()
+        self._tables = dict()
+        self._errors = dict()
+        # (data type, index kind, cols) -> index
+        self._indexes = dict()
+        # data type -> sheet row idx of each row, of tables loaded from excel
+        self._rowxs = dict()
+        self._locks = dict()
+        self._lock = threading.Lock()
+        for t, load in (sources or {}).items():
+            self.add_source(t, load)
+
+    def add_source(self, table_type: str, load: callable) -> None:
+        """
+        register source of a table, loaded table is dropped if registered again
+        :param table_type: data type
+        :param load: callable returning rows
+        :return: None
+        """
+        with self._lock:
+            if table_type in self._sources:
+                LOGGER.warning('Source of table %s is replaced!' % table_type)
+            self._sources[table_type] = load
+            self._locks[table_type] = threading.RLock()
+            self._drop(table_type)
+
+    def set_table(self, table_type: str, rows) -> None:
+        """
+        register loaded rows of a table, or replace rows of a table, indexes of the old rows are dropped
+        :param table_type: data type
+        :param rows: rows
+        :return: None
+        """
+        with self._lock:
+            self._sources[table_type] = lambda: rows
+            if table_type not in self._locks:
+                self._locks[table_type] = threading.RLock()
+            self._drop(table_type)
+            self._tables[table_type] = rows
+
+    @staticmethod
+    def from_dict(data: dict):
+        """
+        wrap loaded table data
+        :param data: data type -> rows
+        :return: table loader
+        """
+        loader = TableLoader()
+        for t, rows in data.items():
+            loader.set_table(t, rows)
+        return loader
+
+    def add_excel(self, table_type: str, path: str, sheet: str = None, header_row: int = 0,
+                  start_row: int = 1, start_col: int = 0, converters: dict = None,
+                  readers: dict = None) -> None:
+        """
+        register a table from an excel sheet, see load_excel
+        """
+        def load():
+            rowxs = []
+            rows = TableLoader.load_excel(path, sheet, header_row, start_row, start_col, converters, readers, rowxs)
+            self._rowxs[table_type] = rowxs
+            return rows
+        self.add_source(table_type, load)
+
+    def add_json(self, table_type: str, path: str) -> None:
+        """
+        register a table from an exported json file of rows
+        :param table_type: data type
+        :param path: json file path
+        :return: None
+        """
+        self.add_source(table_type, lambda: TableLoader.load_json(path))
+
+    @staticmethod
+    def load_excel(path: str, sheet: str = None, header_row: int = 0, start_row: int = 1,
+                   start_col: int = 0, converters: dict = None, readers: dict = None,
+                   rowxs: list = None) -> [dict]:
+        """
+        read rows of an excel sheet as dicts, cells are stringified as ExcelDiffer reads them
+        :param path: file path
+        :param sheet: sheet name, the first sheet if None
+        :param header_row: header row
+        :param start_row: start row of data
+        :param start_col: start col of data
+        :param converters: header name -> callable to convert non-empty values of the col, e.g. int
+        :param readers: extension -> workbook reader class, see excel_reader
+        :param rowxs: list to append sheet row idx of each row to, if specified
+        :return: [{header name: value}], cols without header and empty rows are skipped
+        """
+        converters = converters or dict()
+        rows = []
+        with open_workbook(path, readers) as book:
+            s = book.sheet(sheet if sheet is not None else book.sheet_names()[0])
+            headers = [str(v) for v in s.row_values(header_row, start_colx=start_col)]
+            colxs = [start_col + j for j in range(len(headers)) if headers[j]]
+            names = [h for h in headers if h]
+            funcs = [converters.get(h) for h in names]
+            rowx = start_row - 1
+            for values in s.iter_rows(start_row, colxs):
+                rowx += 1
+                if not any(values):
+                    continue
+                row = dict()
+                for j in range(len(names)):
+                    v = values[j]
+                    row[names[j]] = funcs[j](v) if funcs[j] is not None and v != '' else v
+                rows.append(row)
+                if rowxs is not None:
+                    rowxs.append(rowx)
+        return rows
+
+    @staticmethod
+    def load_json(path: str) -> [dict]:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def __getitem__(self, table_type: str):
+        if table_type not in self._sources:
+            raise KeyError(table_type)
+        table = self._tables.get(table_type)
+        if table is not None:
+            return table
+        with self._locks[table_type]:
+            if table_type in self._tables:
+                return self._tables[table_type]
+            if table_type in self._errors:
+                # failed tables are not loaded again by every checker using it
+                raise self._errors[table_type]
+            LOGGER.info('Loading table %s...' % table_type)
+            try:
+                table = self._sources[table_type]()
+            except Exception as e:
+                LOGGER.exception('Failed to load table %s! %s' % (table_type, e))
+                self._errors[table_type] = e
+                raise
+            self._tables[table_type] = table
+            return table
+
+    def __contains__(self, table_type) -> bool:
+        # registered tables are contained without loading them
+        return table_type in self._sources
+
+    def __iter__(self):
+        return iter(list(self._sources.keys()))
+
+    def __len__(self):
+        return len(self._sources)
+
+    def is_loaded(self, table_type: str) -> bool:
+        return table_type in self._tables
+
+    def get_loaded_types(self) -> [str]:
+        return sorted(self._tables.keys())
+
+    def load(self, types: [str]) -> None:
+        """
+        load tables ahead, e.g. before forking processes which share loaded tables
+        errors are logged and raised again when the table is accessed
+        :param types: data types, unknown types are skipped
+        :return: None
+        """
+        for t in types:
+            if t not in self._sources:
+                LOGGER.warning('Unknown table %s!' % t)
+                continue
+            try:
+                self[t]
+            except Exception:
+                pass
+
+    def build_indexes(self, indexes: list) -> None:
+        """
+        build indexes ahead, e.g. before forking processes which share built indexes
+        errors are logged and raised again when the table is accessed
+        :param indexes: [(data type, index kind, cols)], see INDEX_KINDS
+        :return: None
+        """
+        for table_type, kind, cols in indexes:
+            if kind not in INDEX_KINDS:
+                LOGGER.warning('Unknown index kind %s of table %s!' % (kind, table_type))
+                continue
+            try:
+                self._get_index(table_type, kind, cols)
+            except Exception:
+                pass
+
+    def unload(self, table_type: str = None) -> None:
+        """
+        drop a loaded table, it is loaded again on next access
+        :param table_type: data type, all tables if None
+        :return: None
+        """
+        with self._lock:
+            for t in ([table_type] if table_type is not None else list(self._sources.keys())):
+                self._drop(t)
+
+    def _drop(self, table_type: str) -> None:
+        self._tables.pop(table_type, None)
+        self._errors.pop(table_type, None)
+        self._rowxs.pop(table_type, None)
+        for k in [k for k in self._indexes.keys() if k[0] == table_type]:
+            self._indexes.pop(k, None)
+
+    def _get_index(self, table_type: str, kind: str, cols):
+        """
+        get an index of a table, built on first use
+        :param table_type: data type
+        :param kind: index kind, see INDEX_KINDS
+        :param cols: col name, or a list of col names of composite key
+        :return: index
+        """
+        single = not isinstance(cols, (list, tuple))
+        k = (table_type, kind, cols if single else tuple(cols))
+        index = self._indexes.get(k)
+        if index is not None:
+            return index
+        rows = self[table_type]
+        with self._locks[table_type]:
+            index = self._indexes.get(k)
+            if index is not None:
+                return index
+            LOGGER.debug('Building %s index of table %s by %s...' % (kind, table_type, cols))
+            index = TableLoader._build_index(rows, kind, cols, single)
+            if self._tables.get(table_type) is rows:
+                self._indexes[k] = index
+            return index
+
+    @staticmethod
+    def _build_index(rows, kind: str, cols, single: bool):
+        """
+        build an index of rows, rows missing any key col are skipped
+        :param rows: rows
+        :param kind: index kind
+        :param cols: col name or col names
+        :param single: if cols is a col name
+        :return: index
+        """
+        index = set() if kind == 'set' else dict()
+        for row in rows:
+            if single:
+                key = row.get(cols)
+                if key is None:
+                    continue
+            else:
+                key = tuple([row.get(c) for c in cols])
+                if None in key:
+                    continue
+            if kind == 'set':
+                index.add(key)
+            elif kind == 'map':
+                if key not in index:
+                    index[key] = row
+            else:
+                group = index.get(key)
+                if group is None:
+                    group = []
+                    index[key] = group
+                group.append(row)
+        return index
+
+    def get_rows(self, table_type: str, rowxs) -> list:
+        """
+        get rows of a table by row indices, e.g. changed rows in excel diff report
+        :param table_type: data type
+        :param rowxs: sheet row indices (same base as start row) for tables loaded from excel,
+            or indices of rows for other tables, unknown indices are skipped
+        :return: rows, in table order
+        """
+        rows = self[table_type]
+        sheet_rowxs = self._rowxs.get(table_type)
+        if sheet_rowxs is None:
+            return [rows[i] for i in sorted(set(rowxs)) if 0 <= i < len(rows)]
+        k = (table_type, 'rowxs', None)
+        positions = self._indexes.get(k)
+        if positions is None:
+            positions = dict([(sheet_rowxs[i], i) for i in range(len(sheet_rowxs))])
+            self._indexes[k] = positions
+        return [rows[i] for i in sorted(set([positions[r] for r in rowxs if r in positions]))]
+
+    def get_key_set(self, table_type: str, cols) -> set:
+        """
+        get keys of a table, e.g. ids of items to check foreign keys, the set is shared and must not be modified
+        :param table_type: data type
+        :param cols: col name, or a list of col names of composite key (keys are tuples)
+        :return: set of keys
+        """
+        return self._get_index(table_type, 'set', cols)
+
+    def get_key_map(self, table_type: str, cols) -> dict:
+        """
+        get rows of a table by unique key, the first row is kept if a key is duplicated
+        :param table_type: data type
+        :param cols: col name, or a list of col names of composite key
+        :return: key -> row, shared and must not be modified
+        """
+        return self._get_index(table_type, 'map', cols)
+
+    def get_groups(self, table_type: str, cols) -> dict:
+        """
+        get rows of a table grouped by key
+        :param table_type: data type
+        :param cols: col name, or a list of col names of composite key
+        :return: key -> [rows], in table order, shared and must not be modified
+        """
+        return self._get_index(table_type, 'groups', cols)
+
+
+class DeltaTables(Mapping):
+    """
+    view of table data with changed tables narrowed to changed rows, for checkers checking only the delta
+    tables without known changed rows are full, and indexes are always built on full tables
+    """
+    def __init__(self, loader: TableLoader, changes: dict, types=None):
+        """
+        :param loader: table loader of full tables
+        :param changes: data type -> changed row indices (see TableLoader.get_rows), None if all rows changed
+        :param types: data types which may be narrowed, all types if None
+        """
+        self._loader = loader
+        self._changes = changes
+        self._types = types
+        self._tables = dict()
+
+    def is_narrowed(self, table_type: str) -> bool:
+        return self._changes.get(table_type) is not None and (self._types is None or table_type in self._types)
+
+    def __getitem__(self, table_type: str):
+        if not self.is_narrowed(table_type):
+            return self._loader[table_type]
+        rows = self._tables.get(table_type)
+        if rows is None:
+            rows = self._loader.get_rows(table_type, self._changes[table_type])
+            self._tables[table_type] = rows
+        return rows
+
+    def __contains__(self, table_type) -> bool:
+        return table_type in self._loader
+
+    def __iter__(self):
+        return iter(self._loader)
+
+    def __len__(self):
+        return len(self._loader)
+
+    def is_loaded(self, table_type: str) -> bool:
+        return self._loader.is_loaded(table_type)
+
+    def get_full(self, table_type: str):
+        """
+        get all rows of a table
+        :param table_type: data type
+        :return: rows
+        """
+        return self._loader[table_type]
+
+    def get_key_set(self, table_type: str, cols) -> set:
+        return self._loader.get_key_set(table_type, cols)
+
+    def get_key_map(self, table_type: str, cols) -> dict:
+        return self._loader.get_key_map(table_type, cols)
+
+    def get_groups(self, table_type: str, cols) -> dict:
+        return self._loader.get_groups(table_type, cols)
@@ -0,0 +1,36 @@
+import json
+from lib.excel_diff_service import ExcelDiffClient, ExcelDiffService
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+
+
+if __name__ == '__main__':
+    expected = json.loads(json.dumps(ExcelDiffer(use_excel_indices=True).get_diff_report(src, dest)))
+    # no job may wait, so jobs beyond max_jobs are rejected at once
+    service = ExcelDiffService(ExcelDiffer(use_excel_indices=True), port=0, workers=2, max_jobs=1, max_queue=0)
+    service.start()
+    try:
+        client = ExcelDiffClient(*service.address, timeout=60)
+        # the second diff reads workbooks cached by workers
+        for _ in range(2):
+            assert client.diff(src, dest) == expected
+        # files are diffed as well
+        assert client.diff(src + '/2.xlsx', dest + '/2.xlsx')['modified_files'] == expected['modified_files']
+        # take the only slot, so that the service is full
+        assert service.enqueue()
+        try:
+            assert client.get_status()['running'] == 1
+            try:
+                client.diff(src, dest)
+                raise AssertionError('Diff job is not rejected!')
+            except RuntimeError as e:
+                assert 'failed with 503' in str(e), e
+        finally:
+            service.release()
+        assert client.diff(src, dest) == expected
+        assert client.get_status()['running'] == 0
+    finally:
+        service.stop()
+    print('ok')
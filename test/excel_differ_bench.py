@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from xml.sax.saxutils import escape
+
+from lib.excel_differ import ExcelDiffer
+from lib.excel_reader import open_workbook
+from lib.excel_rows import RowMatrix, ValuePool
+from lib.excel_stats import DiffStats
+
+"""
+Benchmark of ExcelDiffer on synthetic workbooks
+run at repo root: PYTHONPATH=. python test/excel_differ_bench.py --rows 10000 --cols 20 --modify 0.05
+results are appended to the output file as json lines, one line per case
+"""
+
+SHEET_NAME = 'Sheet1'
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>'''
+ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>
+</workbook>''' % SHEET_NAME
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>'''
+
+
+def _col_name(j: int) -> str:
+    s = ''
+    j += 1
+    while j > 0:
+        j, r = divmod(j - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def write_xlsx(path: str, rows: list) -> None:
+    """
+    write a minimal single-sheet xlsx, numbers as number cells and others as shared strings
+    :param path: file path
+    :param rows: rows of values, header row included
+    :return: None
+    """
+    sst, sst_ids = [], dict()
+    lines = []
+    for i in range(len(rows)):
+        cells = []
+        for j in range(len(rows[i])):
+            v = rows[i][j]
+            ref = '%s%d' % (_col_name(j), i + 1)
+            if isinstance(v, (int, float)):
+                cells.append('<c r="%s"><v>%s</v></c>' % (ref, v))
+            elif v != '':
+                if v not in sst_ids:
+                    sst_ids[v] = len(sst)
+                    sst.append(v)
+                cells.append('<c r="%s" t="s"><v>%d</v></c>' % (ref, sst_ids[v]))
+        lines.append('<row r="%d">%s</row>' % (i + 1, ''.join(cells)))
+    sheet = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+             '<sheetData>%s</sheetData></worksheet>' % ''.join(lines))
+    shared = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+              '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="%d" uniqueCount="%d">%s</sst>'
+              % (len(sst), len(sst), ''.join(['<si><t>%s</t></si>' % escape(s) for s in sst])))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', CONTENT_TYPES)
+        z.writestr('_rels/.rels', ROOT_RELS)
+        z.writestr('xl/workbook.xml', WORKBOOK)
+        z.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        z.writestr('xl/worksheets/sheet1.xml', sheet)
+        z.writestr('xl/sharedStrings.xml', shared)
+
+
+def generate_rows(rows: int, cols: int, seed: int = 0, cardinality: int = 1000) -> list:
+    """
+    generate src rows, the first col is a unique id, others are numbers or texts
+    :param rows: num of data rows
+    :param cols: num of cols
+    :param seed: random seed
+    :param cardinality: num of distinct values per col
+    :return: rows with header row
+    """
+    r = random.Random(seed)
+    data = [['id'] + ['col%d' % j for j in range(1, cols)]]
+    for i in range(rows):
+        data.append([i + 1] + [r.randrange(cardinality) if j % 2 else 'text_%d' % r.randrange(cardinality)
+                               for j in range(1, cols)])
+    return data
+
+
+def mutate_rows(src: list, seed: int = 0, modify: float = 0.0, move: float = 0.0, add: float = 0.0,
+                remove: float = 0.0, duplicate: float = 0.0, rename: int = 0) -> list:
+    """
+    generate dest rows from src rows
+    :param src: src rows with header row
+    :param seed: random seed
+    :param modify: ratio of rows with one modified cell
+    :param move: ratio of moved rows
+    :param add: ratio of added rows
+    :param remove: ratio of removed rows
+    :param duplicate: ratio of duplicated rows
+    :param rename: num of renamed headers
+    :return: dest rows with header row
+    """
+    r = random.Random(seed + 1)
+    header = list(src[0])
+    data = [list(row) for row in src[1:]]
+    n, cols = len(data), len(header)
+    for j in r.sample(range(1, cols), min(rename, cols - 1)):
+        header[j] = header[j] + '_renamed'
+    for i in r.sample(range(n), int(n * remove)):
+        data[i] = None
+    data = [row for row in data if row is not None]
+    for i in r.sample(range(len(data)), int(n * modify)):
+        j = r.randrange(1, cols) if cols > 1 else 0
+        data[i][j] = 'modified_%d' % r.randrange(1 << 30)
+    for _ in range(int(n * move)):
+        data.insert(r.randrange(len(data)), data.pop(r.randrange(len(data))))
+    for i in r.sample(range(len(data)), min(int(n * duplicate), len(data))):
+        data.insert(i, list(data[i]))
+    for k in range(int(n * add)):
+        data.insert(r.randrange(len(data) + 1), [n + k + 1] + ['added_%d' % r.randrange(1 << 30)
+                                                               for _ in range(1, cols)])
+    return [header] + data
+
+
+def run_case(work_dir: str, params: dict, key_cols=None, use_numpy: bool = True) -> dict:
+    """
+    generate a src/dest pair, then time phases and record peak memory of differing it
+    :param work_dir: directory to write workbooks
+    :param params: generator params
+    :param key_cols: key cols of differ
+    :param use_numpy: use_numpy of differ
+    :return: result
+    """
+    gen = dict(params)
+    rows, cols, seed = gen.pop('rows'), gen.pop('cols'), gen.pop('seed', 0)
+    src = generate_rows(rows, cols, seed)
+    dest = mutate_rows(src, seed, **gen)
+    f1, f2 = os.path.join(work_dir, 'src.xlsx'), os.path.join(work_dir, 'dest.xlsx')
+    write_xlsx(f1, src)
+    write_xlsx(f2, dest)
+    result = {
+        'params': dict(params, key_cols=key_cols, use_numpy=use_numpy),
+        'file_size': [os.path.getsize(f1), os.path.getsize(f2)],
+        'seconds': dict(),
+    }
+    # read only
+    t = time.perf_counter()
+    pool = ValuePool()
+    for f in [f1, f2]:
+        with open_workbook(f) as book:
+            RowMatrix.from_rows(pool, book.sheet(SHEET_NAME).iter_rows(1, list(range(cols))), cols)
+    result['seconds']['read'] = time.perf_counter() - t
+    # phases of the whole diff
+    stats = DiffStats()
+    differ = ExcelDiffer(key_cols=key_cols, use_numpy=use_numpy, stats=stats)
+    t = time.perf_counter()
+    ret = differ.diff_file(f1, f2)
+    result['seconds']['diff_file'] = time.perf_counter() - t
+    # seconds of each phase of the diff, see excel_stats
+    result['phases'] = stats.to_dict()['seconds']
+    result['candidates'] = stats.to_dict()['counts'].get('candidates', 0)
+    # peak memory in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    ExcelDiffer(key_cols=key_cols, use_numpy=use_numpy).diff_file(f1, f2)
+    result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    md = ret['modified_sheets'][0]['modified_data'] if ret and ret['modified_sheets'] else {}
+    result['counts'] = dict([(k, len(md.get(k, []))) for k in [
+        'moved_rows', 'duplicated_src_rows', 'duplicated_dest_rows', 'added_rows', 'removed_rows', 'modified_cells']])
+    return result
+
+
+SUITE = [
+    {'rows': 1000, 'cols': 10, 'modify': 0.05, 'move': 0.01, 'add': 0.01, 'remove': 0.01, 'duplicate': 0.01},
+    {'rows': 10000, 'cols': 10, 'modify': 0.05, 'move': 0.01, 'add': 0.01, 'remove': 0.01, 'duplicate': 0.01},
+    {'rows': 10000, 'cols': 10, 'modify': 0.5},
+    {'rows': 10000, 'cols': 50, 'modify': 0.05, 'rename': 2},
+    {'rows': 100000, 'cols': 10, 'modify': 0.01, 'move': 0.001, 'add': 0.001, 'remove': 0.001},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of excel differ on synthetic workbooks')
+    parser.add_argument('--rows', type=int, help='num of data rows, run the default suite if not set')
+    parser.add_argument('--cols', type=int, default=10)
+    parser.add_argument('--modify', type=float, default=0.0)
+    parser.add_argument('--move', type=float, default=0.0)
+    parser.add_argument('--add', type=float, default=0.0)
+    parser.add_argument('--remove', type=float, default=0.0)
+    parser.add_argument('--duplicate', type=float, default=0.0)
+    parser.add_argument('--rename', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--key-cols', default=None, help='key col name of differ, e.g. id')
+    parser.add_argument('--no-numpy', action='store_true', help='compare cells in pure python')
+    parser.add_argument('--tag', default='', help='tag of results, e.g. version')
+    parser.add_argument('--output', default='./bench_output.txt', help='json lines file to append results')
+    args = parser.parse_args()
+    if args.rows is None:
+        cases = SUITE
+    else:
+        cases = [dict([(k, getattr(args, k)) for k in [
+            'rows', 'cols', 'modify', 'move', 'add', 'remove', 'duplicate', 'rename', 'seed']])]
+    work_dir = tempfile.mkdtemp(prefix='excel_bench_')
+    try:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            for params in cases:
+                result = run_case(work_dir, params, args.key_cols, not args.no_numpy)
+                result['tag'] = args.tag
+                result['python'] = platform.python_version()
+                result['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                line = json.dumps(result, ensure_ascii=False)
+                print(line)
+                f.write(line + '\n')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import json
+import os
+import shutil
+import tempfile
+from lib.excel_cache import SheetCache
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = SheetCache(cache_dir, max_size=1 << 20)
+        # the first diff fills the cache, the second one reads sheets from it
+        for _ in range(2):
+            report = ExcelDiffer(use_excel_indices=True, cache=cache).get_diff_report(src, dest)
+            assert json.loads(json.dumps(report)) == expected, report
+        files = os.listdir(cache_dir)
+        assert len(files) > 0
+        # sheets are keyed by reader, another reader does not hit sheets cached by the default one
+        key = SheetCache.get_names_key('hash', 'lib.excel_reader.XlsxWorkbook')
+        assert key != SheetCache.get_names_key('hash', 'lib.excel_reader.XlrdWorkbook')
+        # least recently used sheets are evicted once the cache is over max size
+        max_size = sum([os.path.getsize(os.path.join(cache_dir, n)) for n in files]) // 2
+        small = SheetCache(cache_dir, max_size=max_size)
+        small.put('new', list(range(100)))
+        total = sum([os.path.getsize(os.path.join(cache_dir, n)) for n in os.listdir(cache_dir)])
+        assert 0 < total <= max_size, (total, max_size)
+        assert small.get('new') == list(range(100))
+        report = ExcelDiffer(use_excel_indices=True, cache=small).get_diff_report(src, dest)
+        assert json.loads(json.dumps(report)) == expected, report
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print('ok')
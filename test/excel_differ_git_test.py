@@ -0,0 +1,42 @@
+import git
+import json
+import os
+import shutil
+import tempfile
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+def commit_dir(repo, directory: str, message: str):
+    """
+    replace files of repo working tree with files of a directory and commit them
+    """
+    for name in os.listdir(repo.working_tree_dir):
+        if name != '.git':
+            os.remove(os.path.join(repo.working_tree_dir, name))
+    for name in os.listdir(directory):
+        shutil.copy(os.path.join(directory, name), repo.working_tree_dir)
+    repo.git.add('-A')
+    return repo.index.commit(message)
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    root = tempfile.mkdtemp()
+    try:
+        repo = git.Repo.init(root)
+        c1 = commit_dir(repo, src, 'src')
+        c2 = commit_dir(repo, dest, 'dest')
+        # blobs of commits are diffed without checking out, the same as differing directories
+        report = ExcelDiffer(use_excel_indices=True).get_commit_diff_report(c1, c2)
+        assert json.loads(json.dumps(report)) == expected, report
+        report = ExcelDiffer(use_excel_indices=True).get_commit_diff_report(c2, c2)
+        assert report == {'added_files': [], 'removed_files': [], 'modified_files': [], 'errors': []}, report
+        repo.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('ok')
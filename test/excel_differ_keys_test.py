@@ -0,0 +1,64 @@
+import json
+from lib.excel_differ import ExcelDiffer
+from lib.excel_reader import open_workbook
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+def read_rows(path: str, sheet: str) -> (list, dict):
+    """
+    read a sheet as headers and id -> [(excel row idx, row values)]
+    """
+    with open_workbook(path) as book:
+        s = book.sheet(sheet)
+        headers = [str(v) for v in s.row_values(0)]
+        rows = dict()
+        rowx = 1
+        for values in s.iter_rows(1, list(range(len(headers)))):
+            rowx += 1
+            if values[0] != '':
+                rows.setdefault(values[0], []).append((rowx, values))
+    return headers, rows
+
+
+if __name__ == '__main__':
+    report = ExcelDiffer(use_excel_indices=True, key_cols='id').get_diff_report(src, dest)
+    report = json.loads(json.dumps(report))
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    # files, sheets and cols do not depend on how rows are matched
+    for s in report['modified_files'][0]['modified_sheets'] + expected['modified_files'][0]['modified_sheets']:
+        s.pop('modified_data')
+    assert report == expected, report
+
+    report = ExcelDiffer(use_excel_indices=True, key_cols='id').get_diff_report(src, dest)
+    data = report['modified_files'][0]['modified_sheets'][0]['modified_data']
+    headers1, rows1 = read_rows(src + '/2.xlsx', 'Sheet1')
+    headers2, rows2 = read_rows(dest + '/2.xlsx', 'Sheet1')
+    # rows of unique ids kept in both sheets are modified if any cell of a kept col changed
+    cells = set()
+    for k in set(rows1.keys()) & set(rows2.keys()):
+        if len(rows1[k]) > 1 or len(rows2[k]) > 1:
+            continue
+        (r1, v1), (r2, v2) = rows1[k][0], rows2[k][0]
+        for j1 in range(len(headers1)):
+            if headers1[j1] in headers2:
+                j2 = headers2.index(headers1[j1])
+                if v1[j1] != v2[j2]:
+                    cells.add((r1, r2, j1 + 1, j2 + 1, v1[j1], v2[j2]))
+    actual = set([(c['src_row'], c['dest_row'], c['src_col'], c['dest_col'], c['src_val'], c['dest_val'])
+                  for c in data['modified_cells']])
+    assert cells <= actual, (cells - actual)
+    # rows of duplicated ids are matched as well, each modified cell pairs rows of the same id
+    values1 = dict([(r, v) for rows in rows1.values() for r, v in rows])
+    values2 = dict([(r, v) for rows in rows2.values() for r, v in rows])
+    for r1, r2, c1, c2, v1, v2 in actual:
+        assert values1[r1][0] == values2[r2][0], (r1, r2)
+        assert values1[r1][c1 - 1] == v1 and values2[r2][c2 - 1] == v2, (r1, r2, c1, c2)
+    removed = sorted([rows1[k][0][0] for k in rows1.keys() if k not in rows2])
+    added = sorted([rows2[k][0][0] for k in rows2.keys() if k not in rows1])
+    assert data['removed_rows'] == removed, data['removed_rows']
+    assert data['added_rows'] == added, data['added_rows']
+    print('ok')
@@ -0,0 +1,23 @@
+import json
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    dest_dirs = [dest, src, dest]
+    for kwargs in [dict(use_excel_indices=True), dict(use_excel_indices=True, key_cols='id')]:
+        # each target is reported the same as differing the baseline and the target alone
+        targets = [json.loads(json.dumps(ExcelDiffer(**kwargs).get_diff_report(src, d))) for d in dest_dirs]
+        if 'key_cols' not in kwargs:
+            assert targets[0] == expected
+        for workers in [1, 2]:
+            reports = ExcelDiffer(**kwargs).get_multi_diff_report(src, dest_dirs, workers=workers)
+            assert len(reports) == len(dest_dirs)
+            for i in range(len(dest_dirs)):
+                assert json.loads(json.dumps(reports[i])) == targets[i], (kwargs, workers, i)
+    print('ok')
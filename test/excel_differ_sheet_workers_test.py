@@ -0,0 +1,48 @@
+import json
+import os
+import shutil
+import tempfile
+from lib.excel_differ import ExcelDiffer
+from lib.excel_reader import XlsxWorkbook
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+class BrokenSheetWorkbook(XlsxWorkbook):
+    """
+    xlsx reader failing to read Sheet2
+    """
+    def sheet(self, name: str):
+        if name == 'Sheet2':
+            raise ValueError('Broken sheet %s' % name)
+        return XlsxWorkbook.sheet(self, name)
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    # sheets of a workbook are diffed in a process pool, and keep the workbook order in the report
+    for workers in [1, 2]:
+        report = ExcelDiffer(use_excel_indices=True, sheet_workers=3).get_diff_report(src, dest, workers=workers)
+        assert json.loads(json.dumps(report)) == expected, report
+    # a failed sheet is left out of the report without affecting other sheets
+    readers = {'xlsx': BrokenSheetWorkbook}
+    serial = ExcelDiffer(use_excel_indices=True, readers=readers).get_diff_report(src, dest)
+    assert [s['name'] for s in serial['modified_files'][0]['modified_sheets']] == ['Sheet1'], serial
+    assert ExcelDiffer(use_excel_indices=True, readers=readers, sheet_workers=3).get_diff_report(src, dest) == serial
+    # a broken file is reported as an error
+    root = tempfile.mkdtemp()
+    try:
+        for d, name in [(src, 'src'), (dest, 'dest')]:
+            shutil.copytree(d, os.path.join(root, name))
+            with open(os.path.join(root, name, 'broken.xlsx'), 'wb') as f:
+                f.write(('not a workbook of %s' % name).encode('utf-8'))
+        report = ExcelDiffer(use_excel_indices=True, sheet_workers=3).get_diff_report(
+            os.path.join(root, 'src'), os.path.join(root, 'dest'))
+        assert len(report['errors']) == 1 and 'broken.xlsx' in report['errors'][0], report['errors']
+        assert json.loads(json.dumps(report['modified_files'])) == expected['modified_files'], report
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('ok')
@@ -0,0 +1,48 @@
+import copy
+import json
+import random
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+def gen_rows(seed: int) -> (list, list, int):
+    """
+    generate rows, randomly modified, removed, inserted, moved and duplicated rows of them, and num of cols
+    """
+    r = random.Random(seed)
+    n, cols, vals = r.randrange(1, 80), r.randrange(1, 7), r.randrange(2, 6)
+    rows1 = [[str(r.randrange(vals)) for _ in range(cols)] for _ in range(n)]
+    rows2 = copy.deepcopy(rows1)
+    for _ in range(n // 3):
+        op, i = r.random(), r.randrange(len(rows2)) if rows2 else 0
+        if op < 0.3 and rows2:
+            rows2[i][r.randrange(cols)] = str(r.randrange(vals))
+        elif op < 0.5 and rows2:
+            rows2.pop(i)
+        elif op < 0.7:
+            rows2.insert(i, [str(r.randrange(vals)) for _ in range(cols)])
+        elif op < 0.85 and rows2:
+            rows2.insert(r.randrange(len(rows2)), rows2.pop(i))
+        elif rows2:
+            rows2.insert(i, list(rows2[i]))
+    return rows1, rows2, cols
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    # rows of every sheet are spilled to disk with a tiny budget
+    report = ExcelDiffer(use_excel_indices=True, memory_budget=1).get_diff_report(src, dest)
+    assert json.loads(json.dumps(report)) == expected, report
+    # out of core diff is the same as in memory diff
+    for seed in range(200):
+        rows1, rows2, cols = gen_rows(seed)
+        threshold = random.Random(seed).choice([0.0, 0.5, 1.0])
+        a = ExcelDiffer(row_modify_threshold=threshold).diff_data(copy.deepcopy(rows1), copy.deepcopy(rows2))
+        b = ExcelDiffer(row_modify_threshold=threshold, memory_budget=1).diff_data_external(
+            copy.deepcopy(rows1), copy.deepcopy(rows2), cols)
+        assert json.dumps(a) == json.dumps(b), seed
+    print('ok')
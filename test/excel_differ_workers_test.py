@@ -0,0 +1,42 @@
+import json
+import os
+import shutil
+import tempfile
+from lib.excel_differ import ExcelDiffer
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+def copy_with_broken_file(root: str) -> (str, str):
+    """
+    copy src and dest dirs, with a broken workbook kept in both
+    """
+    dirs = []
+    for d, name in [(src, 'src'), (dest, 'dest')]:
+        p = os.path.join(root, name)
+        shutil.copytree(d, p)
+        with open(os.path.join(p, 'broken.xlsx'), 'wb') as f:
+            f.write(('not a workbook of %s' % name).encode('utf-8'))
+        dirs.append(p)
+    return dirs[0], dirs[1]
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    # files are diffed in a process pool, and the report keeps the same order as diffing one by one
+    report = ExcelDiffer(use_excel_indices=True).get_diff_report(src, dest, workers=2)
+    assert json.loads(json.dumps(report)) == expected, report
+    root = tempfile.mkdtemp()
+    try:
+        src_dir, dest_dir = copy_with_broken_file(root)
+        serial = ExcelDiffer(use_excel_indices=True).get_diff_report(src_dir, dest_dir)
+        assert len(serial['errors']) == 1 and 'broken.xlsx' in serial['errors'][0], serial['errors']
+        assert serial['modified_files'] == report['modified_files'], serial
+        for workers in [2, 3]:
+            assert ExcelDiffer(use_excel_indices=True).get_diff_report(src_dir, dest_dir, workers=workers) == serial
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('ok')
@@ -0,0 +1,98 @@
+import git
+import os
+import shutil
+import tempfile
+from lib.excel_differ import ExcelDiffer
+from lib.excel_history import ExcelHistory
+from lib.excel_reader import open_workbook
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+path = '2.xlsx'
+
+
+def get_cells(commit) -> dict:
+    """
+    read cells of a version, (sheet, id, header) -> value
+    the first row of a duplicated id and the first col of a duplicated header are tracked
+    """
+    cells = dict()
+    with open_workbook(path, None, (commit.tree / path).data_stream.read()) as book:
+        for sheet_name in book.sheet_names():
+            s = book.sheet(sheet_name)
+            headers = [str(v) for v in s.row_values(0)]
+            if 'id' not in headers:
+                continue
+            keys = set()
+            for values in s.iter_rows(1, list(range(len(headers)))):
+                k = values[headers.index('id')]
+                if k == '' or k in keys:
+                    continue
+                keys.add(k)
+                for j in range(len(headers)):
+                    if headers[j] and headers.index(headers[j]) == j:
+                        cells[(sheet_name, k, headers[j])] = values[j]
+    return cells
+
+
+def commit_file(repo, data: bytes, message: str):
+    with open(os.path.join(repo.working_tree_dir, path), 'wb') as f:
+        f.write(data)
+    repo.index.add([path])
+    return repo.index.commit(message)
+
+
+def check_history(history, commits) -> None:
+    """
+    check that the last change of each cell is the last commit changing its value, unreadable versions are skipped
+    """
+    last, prev = dict(), dict()
+    for commit in commits:
+        try:
+            cur = get_cells(commit)
+        except Exception:
+            continue
+        for k in set(prev.keys()) | set(cur.keys()):
+            if prev.get(k) != cur.get(k):
+                last[k] = (commit.hexsha, cur.get(k))
+        prev = cur
+    for (sheet, k, col), (sha, value) in last.items():
+        change = history.get_last_change(sheet, k, col)
+        assert change is not None and change['id'] == sha and change['value'] == value, (sheet, k, col)
+
+
+if __name__ == '__main__':
+    with open(os.path.join(src, path), 'rb') as f:
+        data1 = f.read()
+    with open(os.path.join(dest, path), 'rb') as f:
+        data2 = f.read()
+    root = tempfile.mkdtemp()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        repo = git.Repo.init(root)
+        commits = [commit_file(repo, data, str(i)) for i, data in enumerate([data1, data2, data1])]
+        for i in range(2):
+            # the second build is read from cache
+            history = ExcelHistory(ExcelDiffer(), key_cols='id', cache_dir=cache_dir).build(repo, path)
+            assert [c['id'] for c in history.commits] == [c.hexsha for c in commits]
+            check_history(history, commits)
+        # cached history is resumed when old commits drop out of the window of latest commits
+        window = ExcelHistory(ExcelDiffer(), key_cols='id', cache_dir=os.path.join(cache_dir, 'window'))
+        assert len(window.build(repo, path, max_count=2).commits) == 2
+        commits.append(commit_file(repo, data2, 'window'))
+        history = window.build(repo, path, max_count=2)
+        assert [c['id'] for c in history.commits] == [c.hexsha for c in commits[1:]]
+        check_history(history, commits[1:])
+        # an unreadable version is skipped, and walking resumes from the last readable version
+        history = ExcelHistory(ExcelDiffer(), key_cols='id', cache_dir=cache_dir)
+        commits.append(commit_file(repo, b'broken', 'broken'))
+        assert len(history.build(repo, path).commits) == len(commits)
+        commits.append(commit_file(repo, data1, 'fixed'))
+        built = history.build(repo, path)
+        assert [c['id'] for c in built.commits] == [c.hexsha for c in commits]
+        check_history(built, commits)
+        repo.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print('ok')
@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+from lib.excel_differ import ExcelDiffer
+from lib.excel_manifest import ExcelManifest
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+def walk_excel_files(root: str) -> set:
+    """
+    get relative paths of excel files by os.walk, office lock files excluded
+    """
+    files = set()
+    for d, _, names in os.walk(root):
+        for name in names:
+            if os.path.splitext(name)[1] in ('.xls', '.xlsx') and not name.startswith('~$'):
+                files.add(os.path.relpath(os.path.join(d, name), root))
+    return files
+
+
+def make_tree(root: str) -> str:
+    """
+    copy src dir with nested dirs, a lock file and a non excel file
+    """
+    p = os.path.join(root, 'tree')
+    shutil.copytree(src, p)
+    os.makedirs(os.path.join(p, 'a', 'b'))
+    os.makedirs(os.path.join(p, 'empty'))
+    shutil.copy(os.path.join(src, '2.xlsx'), os.path.join(p, 'a', '2.xlsx'))
+    shutil.copy(os.path.join(src, '2.xlsx'), os.path.join(p, 'a', 'b', '3.xls'))
+    for name in ['~$2.xlsx', 'notes.txt']:
+        with open(os.path.join(p, 'a', name), 'w') as f:
+            f.write(name)
+    return p
+
+
+if __name__ == '__main__':
+    root = tempfile.mkdtemp()
+    try:
+        tree = make_tree(root)
+        expected = walk_excel_files(tree)
+        assert os.path.join('a', 'b', '3.xls') in expected and os.path.join('a', '~$2.xlsx') not in expected
+        # scanning across threads finds the same files as walking the tree
+        for workers in [1, 3]:
+            assert ExcelDiffer.get_excel_files(tree, workers) == expected, workers
+            assert ExcelManifest.scan(tree, workers).files() == expected, workers
+        # a saved manifest is loaded with the same entries
+        manifest = ExcelManifest.scan(tree, 3, hash_files=True)
+        path = os.path.join(root, 'out', 'manifest.json')
+        manifest.save(path)
+        loaded = ExcelManifest.load(path)
+        assert loaded.root == manifest.root and loaded.files() == manifest.files()
+        for p in expected:
+            assert loaded.get(p) == manifest.get(p) and loaded.get(p)[2], p
+        for rel in ['', 'a', os.path.join('a', 'b'), 'empty']:
+            assert loaded.get_dir(rel) == manifest.get_dir(rel), rel
+        # nothing changed since the loaded manifest, hashes are reused, even if dir entries are trusted
+        for trust in [False, True]:
+            rescanned = ExcelManifest.scan(tree, 2, hash_files=True, previous=loaded, trust_dir_mtime=trust)
+            assert rescanned.compare(loaded) == ([], [], []), trust
+            assert [rescanned.get(p) for p in sorted(expected)] == [loaded.get(p) for p in sorted(expected)]
+        shutil.copy(os.path.join(dest, '2.xlsx'), os.path.join(tree, 'a', '2.xlsx'))
+        os.remove(os.path.join(tree, 'a', 'b', '3.xls'))
+        shutil.copy(os.path.join(src, '1.xlsx'), os.path.join(tree, 'empty', '1.xlsx'))
+        rescanned = ExcelManifest.scan(tree, hash_files=True, previous=loaded)
+        assert rescanned.compare(loaded) == ([os.path.join('a', 'b', '3.xls')], [os.path.join('a', '2.xlsx')],
+                                             [os.path.join('empty', '1.xlsx')]), rescanned.compare(loaded)
+        # reports diffed with manifests equal reports scanning dirs
+        with open(report_file, encoding='utf-8') as f:
+            report = json.load(f)
+        for hash_files in [False, True]:
+            src_manifest = ExcelManifest.scan(src, hash_files=hash_files)
+            dest_manifest = ExcelManifest.scan(dest, hash_files=hash_files)
+            r = ExcelDiffer(use_excel_indices=True).get_diff_report(src, dest, src_manifest=src_manifest,
+                                                                    dest_manifest=dest_manifest)
+            assert json.loads(json.dumps(r)) == report, hash_files
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('ok')
@@ -0,0 +1,32 @@
+from lib.excel_differ import ExcelDiffer
+from lib.excel_reader import open_workbook
+from lib.excel_stats import DiffStats
+
+src = './test/excel_differ/xls/src'
+dest = './test/excel_differ/xls/dest'
+
+
+def get_signatures(path: str) -> dict:
+    with open_workbook(path) as book:
+        return dict([(n, book.sheet_signature(n)) for n in book.sheet_names()])
+
+
+if __name__ == '__main__':
+    sig1 = get_signatures(src + '/5.xls')
+    sig2 = get_signatures(dest + '/5.xls')
+    # shared strings of sheet 'same' are shifted by strings added to sheet 'changed', its signature is kept
+    assert sig1['same'] is not None and sig1['same'] == sig2['same'], (sig1, sig2)
+    assert sig1['changed'] is not None and sig1['changed'] != sig2['changed'], (sig1, sig2)
+    # no signature if private fields of xlrd are missing
+    with open_workbook(src + '/5.xls') as book:
+        del book._book._sh_abs_posn
+        assert book.sheet_signature('same') is None
+    stats = DiffStats()
+    report = ExcelDiffer(use_excel_indices=True, stats=stats).get_diff_report(src, dest)
+    sheets = report['modified_files'][0]['modified_sheets']
+    assert [s['name'] for s in sheets] == ['changed'], sheets
+    data = sheets[0]['modified_data']
+    assert data['added_rows'] == [4], data
+    assert [(c['dest_row'], c['dest_val']) for c in data['modified_cells']] == [(2, '12.0'), (3, 'cherry')], data
+    assert stats.to_dict()['counts']['skipped_sheets'] == 1
+    print('ok')
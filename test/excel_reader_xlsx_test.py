@@ -0,0 +1,75 @@
+import glob
+import io
+import xlrd
+import zipfile
+from lib.excel_reader import XlsxWorkbook
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml"
+ ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>'''
+RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="xl/workbook.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>
+</Relationships>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Target="worksheets/sheet1.xml"
+ Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>
+</Relationships>'''
+# header is shorter than data rows, and B2 is a formula without cached value
+SHEET = '''<?xml version="1.0" encoding="UTF-8"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+<row r="1"><c r="A1" t="inlineStr"><is><t>id</t></is></c><c r="B1" t="inlineStr"><is><t>name</t></is></c></row>
+<row r="2"><c r="A2"><v>1</v></c><c r="B2" t="str"><f>A2&amp;""</f></c><c r="D2"><v>3</v></c></row>
+<row r="4"><c r="A4"><v>2</v></c></row>
+</sheetData></worksheet>'''
+
+
+def make_xlsx() -> bytes:
+    fp = io.BytesIO()
+    with zipfile.ZipFile(fp, 'w') as z:
+        z.writestr('[Content_Types].xml', CONTENT_TYPES)
+        z.writestr('_rels/.rels', RELS)
+        z.writestr('xl/workbook.xml', WORKBOOK)
+        z.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        z.writestr('xl/worksheets/sheet1.xml', SHEET)
+    return fp.getvalue()
+
+
+if __name__ == '__main__':
+    # values and dims are the same as xlrd for all xlsx fixtures
+    for path in sorted(glob.glob('./test/excel_differ/*/*.xlsx')):
+        book1, book2 = xlrd.open_workbook(path), XlsxWorkbook(path)
+        assert book1.sheet_names() == book2.sheet_names(), path
+        for name in book1.sheet_names():
+            s1, s2 = book1.sheet_by_name(name), book2.sheet(name)
+            assert (s1.nrows, s1.ncols) == (s2.nrows, s2.ncols), (path, name)
+            for rowx in range(s1.nrows):
+                for start_colx in [0, 1]:
+                    assert s1.row_values(rowx, start_colx) == s2.row_values(rowx, start_colx), (path, name, rowx)
+            colxs = list(range(s1.ncols))
+            assert list(s2.iter_rows(1, colxs)) == [[str(v) for v in s1.row_values(rowx)]
+                                                   for rowx in range(1, s1.nrows)], (path, name)
+        book2.close()
+    # rows are padded to num of cols, and a formula cell without cached value is empty
+    book = XlsxWorkbook('x.xlsx', make_xlsx())
+    s = book.sheet('Sheet1')
+    assert (s.nrows, s.ncols) == (4, 4), (s.nrows, s.ncols)
+    assert s.row_values(0) == ['id', 'name', '', ''], s.row_values(0)
+    assert s.row_values(2) == ['', '', '', ''], s.row_values(2)
+    assert s.row_values(4) == []
+    assert list(s.iter_rows(1, [0, 1, 2, 3])) == [['1.0', '', '', '3.0'], ['', '', '', ''], ['2.0', '', '', '']]
+    book.close()
+    print('ok')
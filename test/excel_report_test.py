@@ -0,0 +1,30 @@
+import io
+import json
+from lib.excel_differ import ExcelDiffer
+from lib.excel_report import read_report
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    # the nested report rebuilt from events is the same as the report built in memory
+    for workers in [1, 2]:
+        fp = io.StringIO()
+        summary = ExcelDiffer(use_excel_indices=True).write_diff_report(src, dest, fp, workers=workers)
+        fp.seek(0)
+        assert read_report(fp) == expected, workers
+        for line in fp.getvalue().splitlines():
+            json.loads(line)
+        assert [[s['name'] for s in f['modified_sheets']] for f in summary['modified_files']] == \
+            [[s['name'] for s in f['modified_sheets']] for f in expected['modified_files']], summary
+    # keyed diff as well
+    differ = ExcelDiffer(key_cols='id')
+    fp = io.StringIO()
+    differ.write_diff_report(src, dest, fp)
+    fp.seek(0)
+    assert read_report(fp) == json.loads(json.dumps(differ.get_diff_report(src, dest)))
+    print('ok')
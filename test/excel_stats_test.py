@@ -0,0 +1,58 @@
+import io
+import json
+import re
+from lib.excel_differ import ExcelDiffer
+from lib.excel_stats import DiffStats
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+report_file = './test/excel_differ/report.json'
+METRIC_LINE = re.compile(r'^(\w+)(\{(\w+="[^"]*",?)*\})? [0-9.]+$')
+
+
+def get_report_counts(report: dict) -> dict:
+    """
+    count changes of a report by the names of stats counts
+    """
+    counts = dict()
+    for f in report['modified_files']:
+        for s in f['modified_sheets']:
+            data = s['modified_data']
+            for name in ['added_rows', 'removed_rows', 'modified_cells', 'moved_rows',
+                         'duplicated_src_rows', 'duplicated_dest_rows']:
+                counts[name] = counts.get(name, 0) + len(data.get(name, []))
+    return counts
+
+
+if __name__ == '__main__':
+    with open(report_file, encoding='utf-8') as f:
+        expected = json.load(f)
+    stats = DiffStats()
+    report = ExcelDiffer(use_excel_indices=True, stats=stats).get_diff_report(src, dest)
+    assert json.loads(json.dumps(report)) == expected
+    d = stats.to_dict()
+    # counts of changes are the same as the report
+    for name, n in get_report_counts(expected).items():
+        assert d['counts'].get(name, 0) == n, (name, d['counts'])
+    assert d['process_peak_memory'] > 0
+    # records are labeled by file and sheet, and totals are sums of records
+    sheets = set([(r['file'], r['sheet']) for r in d['records'] if r['sheet']])
+    assert sheets == set([(src + '/2.xlsx', 'Sheet1'), (src + '/2.xlsx', 'Sheet2')]), sheets
+    for k, v in d['seconds'].items():
+        assert abs(sum([r['seconds'].get(k, 0.0) for r in d['records']]) - v) < 1e-6, k
+    # stats of worker processes are merged
+    parallel = DiffStats()
+    ExcelDiffer(use_excel_indices=True, stats=parallel, sheet_workers=2).get_diff_report(src, dest, workers=2)
+    assert parallel.to_dict()['counts'] == d['counts'], (parallel.to_dict()['counts'], d['counts'])
+    # prometheus export holds each record
+    fp = io.StringIO()
+    stats.write_prometheus(fp)
+    lines = fp.getvalue().splitlines()
+    for line in lines:
+        assert line.startswith('# ') or METRIC_LINE.match(line), line
+    assert 'excel_diff_process_peak_memory_bytes %d' % stats.process_peak_memory in lines
+    n = len([1 for r in d['records'] for _ in r['counts']])
+    assert len([line for line in lines if line.startswith('excel_diff_count{')]) == n
+    added = [line for line in lines if line.startswith('excel_diff_count{') and 'name="added_rows"' in line]
+    assert sum([int(line.split(' ')[-1]) for line in added]) == d['counts']['added_rows'], added
+    print('ok')
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from lib.excel_differ import ExcelDiffer
+from lib.excel_watcher import ExcelWatcher
+
+src = './test/excel_differ/src'
+dest = './test/excel_differ/dest'
+
+
+def copy_dirs(root: str) -> (str, str):
+    """
+    copy src and dest dirs, with mtimes older than any settle time
+    """
+    dirs = []
+    old = time.time() - 100
+    for d, name in [(src, 'src'), (dest, 'dest')]:
+        p = os.path.join(root, name)
+        shutil.copytree(d, p)
+        for f in os.listdir(p):
+            os.utime(os.path.join(p, f), (old, old))
+        dirs.append(p)
+    return dirs[0], dirs[1]
+
+
+if __name__ == '__main__':
+    root = tempfile.mkdtemp()
+    try:
+        src_dir, dest_dir = copy_dirs(root)
+        report_file = os.path.join(root, 'out', 'report.json')
+        differ = ExcelDiffer(use_excel_indices=True)
+        diffed = []
+        diff_files = differ.diff_files
+
+        def record_diff_files(src_dir, dest_dir, files, *args, **kwargs):
+            diffed.append(sorted(files))
+            return diff_files(src_dir, dest_dir, files, *args, **kwargs)
+
+        differ.diff_files = record_diff_files
+        watcher = ExcelWatcher(differ, src_dir, dest_dir, report_file, settle=0.5)
+        # files untouched for settle seconds are all diffed by the first poll
+        assert watcher.poll()
+        kept = sorted(ExcelDiffer.get_excel_files(src_dir) & ExcelDiffer.get_excel_files(dest_dir))
+        assert diffed == [kept], diffed
+        expected = ExcelDiffer(use_excel_indices=True).get_diff_report(src_dir, dest_dir)
+        assert watcher.get_report() == expected, watcher.get_report()
+        with open(report_file, encoding='utf-8') as f:
+            assert json.load(f) == json.loads(json.dumps(expected))
+        # nothing is diffed again if no file is touched
+        diffed.clear()
+        assert not watcher.poll() and diffed == [], diffed
+        # a touched file waits until it and its lock file settle
+        shutil.copy(os.path.join(dest_dir, '2.xlsx'), os.path.join(dest_dir, '3.xlsx'))
+        with open(os.path.join(dest_dir, '~$3.xlsx'), 'w') as f:
+            f.write('x')
+        assert not watcher.poll() and diffed == [], diffed
+        time.sleep(0.6)
+        # only the touched file is diffed again, results of the others are kept
+        assert watcher.poll()
+        assert diffed == [['3.xlsx']], diffed
+        expected = ExcelDiffer(use_excel_indices=True).get_diff_report(src_dir, dest_dir)
+        assert '3.xlsx' in [f['name'] for f in expected['modified_files']], expected
+        assert watcher.get_report() == expected, watcher.get_report()
+        with open(report_file, encoding='utf-8') as f:
+            assert json.load(f) == json.loads(json.dumps(expected))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    print('ok')
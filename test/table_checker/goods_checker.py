@@ -1,13 +1,11 @@
 from lib.table_checker import table_checker as tc
 
 
-@tc.add_checker('goods item exist', ['item', 'good'])
+@tc.add_checker('goods item exist', ['item', 'good'], indexes=[('item', 'set', 'id')])
 def check_goods_item(data):
-    items = data['item']
     goods = data['good']
-    item_ids = set()
-    for item in items:
-        item_ids.add(item['id'])
+    # shared index of item table, built once by the first checker using it
+    item_ids = data.get_key_set('item', 'id')
     noitem_good_ids = []
     for good in goods:
         if good['item_id'] not in item_ids:
@@ -1,7 +1,7 @@
 from lib.table_checker import table_checker as tc
 
 
-@tc.add_checker('item name exist', ['item'])
+@tc.add_checker('item name exist', ['item'], delta=True)
 def check_item_name_exist(data):
     noname_ids = []
     items = data['item']
@@ -1,4 +1,7 @@
-from lib.table_checker import load_checkers, table_checker
+import time
+from lib.excel_differ import ExcelDiffer
+from lib.table_checker import TableChecker, load_checkers, table_checker
+from lib.table_loader import TableLoader
 
 data = {
     'item': [
@@ -11,8 +14,114 @@ data = {
         {'id': 900002, 'item_id': 4}
     ]
 }
+# item table of src and dest, item 2 is renamed and item 6 is added in dest, item 3 has no name in both
+excel_dir = './test/table_checker_data'
+
+
+def get_statuses(results: dict) -> list:
+    """
+    get (name, success, error raised, timed out) of each checker
+    """
+    return [(r['name'], r['success'], bool(r['error']), r['timed_out']) for r in results['results']]
+
+
+def test_modes() -> None:
+    """
+    results keep the order of checkers, and are the same running one by one, in threads or in processes
+    """
+    tc = TableChecker()
+    tc.add_checker('item name exist', ['item'])(
+        lambda d: {'success': all([item['name'] for item in d['item']])})
+    tc.add_checker('goods item exist', ['item', 'good'])(
+        lambda d: {'success': all([g['item_id'] in d.get_key_set('item', 'id') for g in d['good']])})
+    tc.add_checker('item id positive', ['item'])(lambda d: {'success': all([item['id'] > 0 for item in d['item']])})
+    tc.add_checker('broken', ['good'])(lambda d: d['good'][100])
+    expected = [
+        ('item name exist', False, False, False),
+        ('goods item exist', False, False, False),
+        ('item id positive', True, False, False),
+        ('broken', False, True, False),
+    ]
+    for workers, mode in [(1, 'thread'), (2, 'thread'), (3, 'process')]:
+        results = tc.check(data, workers=workers, mode=mode)
+        assert get_statuses(results) == expected, (mode, results)
+        assert (results['passed'], results['failed'], results['errors']) == (1, 3, 1), (mode, results)
+        assert results['results'][3]['error'].startswith('IndexError'), results['results'][3]
+
+
+def test_delta() -> None:
+    """
+    delta checkers receive changed rows of the diff report if their previous results passed, or full tables
+    """
+    tc = TableChecker()
+    received = dict()
+
+    def check_name(d):
+        received['name'] = [item['id'] for item in d['item']]
+        return {'success': all([item['name'] for item in d['item']])}
+
+    def check_id(d):
+        received['id'] = [item['id'] for item in d['item']]
+        return {'success': all([item['id'] > 0 for item in d['item']])}
+
+    tc.add_checker('item name exist', ['item'], delta=True)(check_name)
+    tc.add_checker('item id positive', ['item'], delta=True)(check_id)
+    tc.add_checker('good', ['good'])(lambda d: {'success': True})
+    loader = TableLoader()
+    loader.add_excel('item', excel_dir + '/dest/item.xls', 'item', converters={'id': lambda v: int(float(v))})
+    loader.set_table('good', data['good'])
+    previous = tc.check(loader)
+    assert get_statuses(previous) == [
+        ('item name exist', False, False, False),
+        ('item id positive', True, False, False),
+        ('good', True, False, False),
+    ], previous
+    assert received == {'name': [1, 2, 3, 4, 5, 6], 'id': [1, 2, 3, 4, 5, 6]}, received
+    report = ExcelDiffer(use_excel_indices=True).get_diff_report(excel_dir + '/src', excel_dir + '/dest')
+    changes = TableChecker.get_changes_of_report(report, {'item': ('item.xls', 'item')}, use_excel_indices=True)
+    assert changes == {'item': {2, 6}}, changes
+    received.clear()
+    results = tc.check(loader, changes=changes, previous=previous)
+    # failed item 3 is not changed, yet the failed checker checks full tables and still reports it
+    assert received == {'name': [1, 2, 3, 4, 5, 6], 'id': [2, 6]}, received
+    assert get_statuses(results) == get_statuses(previous), results
+    assert [r['cached'] for r in results['results']] == [False, False, True], results
+    assert [r['rows'] for r in results['results'][:2]] == [6, 2], results
+
+
+def test_timeout() -> None:
+    """
+    checkers running out of timeout or budget fail as timed out, and checkers not started in budget are skipped
+    """
+    tc = TableChecker()
+    tc.add_checker('slow', ['item'])(lambda d: time.sleep(10))
+    tc.add_checker('fast', ['item'])(lambda d: {'success': True})
+    for mode in ['thread', 'process']:
+        start = time.time()
+        results = tc.check(data, workers=2, mode=mode, timeout=0.5)
+        assert time.time() - start < 5, mode
+        assert get_statuses(results) == [('slow', False, True, True), ('fast', True, False, False)], results
+        assert results['results'][0]['error'].startswith('TimeoutError'), results
+        assert results['results'][0]['rows'] == 3, results
+        assert (results['timeouts'], results['errors']) == (1, 0), results
+        # the slow checker takes the only slot until the budget is exceeded, and the fast one is skipped
+        results = tc.check(data, workers=1, mode=mode, budget=0.5)
+        assert time.time() - start < 10, mode
+        assert get_statuses(results) == [('slow', False, True, True), ('fast', False, True, True)], results
+        assert results['results'][1]['error'].startswith('Skipped'), results
+        assert results['timeouts'] == 2, results
 
 
 if __name__ == '__main__':
     load_checkers('./test/table_checker')
     table_checker.check(data)
+    # tables are loaded on first access, only item is loaded for the item checker
+    loader = TableLoader(dict([(t, lambda t=t: data[t]) for t in data.keys()]))
+    table_checker.check(loader, names=['item name exist'])
+    assert loader.get_loaded_types() == ['item']
+    # incremental check, only checkers using item run, and item name checker receives changed item rows only
+    table_checker.check(loader, changes={'item': [2]})
+    test_modes()
+    test_delta()
+    test_timeout()
+    print('ok')
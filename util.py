@@ -2,6 +2,7 @@ import os
 import pprint
 import hashlib
 import json
+from array import array
 
 """
 Common utils
@@ -37,7 +38,8 @@ def lis(seq: []):
     l = len(seq)
     if l <= 1:
         return seq
-    m, p, k = [None] * l, [None] * l, 1
+    # typed arrays instead of lists, as seq may have millions of items
+    m, p, k = array('q', [0]) * l, array('q', [0]) * l, 1
     m[0] = 0
     for i in range(1, l):
         # find the insert point (j) of seq[i] in current lis
@@ -73,6 +75,18 @@ def md5(s: str):
     return hl.hexdigest()
 
 
+def md5_file(path: str, chunk_size: int = 1 << 20):
+    hl = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hl.update(chunk)
+    return hl.hexdigest()
+
+
+def md5_bytes(data: bytes):
+    return hashlib.md5(data).hexdigest()
+
+
 def ppf(o, is_json=False) -> str:
     if is_json:
         return json.dumps(o, indent=2, ensure_ascii=False)